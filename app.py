@@ -1,27 +1,46 @@
 import os
 from flask import Flask
 from models import db
+import cache
+import startup
+import database
+import metrics
+import images
 from flask_login import LoginManager
 
 __version__ = '0.8.3'
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
+# Bump when a migration is added below; a database stamped with this version
+# skips create_all and the column probes on startup.
+SCHEMA_VERSION = 6
 
 
 def create_app():
+    timer = startup.StartupTimer()
     app = Flask(__name__, template_folder='templates', static_folder='static')
     app.config['SECRET_KEY'] = os.environ.get('VIEWFLOW_SECRET', 'dev-secret-key-gautham-deepak')
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(BASE_DIR, 'viewflow.db')
+    database.configure(app, BASE_DIR)
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 * 1024  # 16GB max
+    # Rendered video cards: 'memory' (per process), 'sqlite[:path]' (shared by workers) or 'off'
+    app.config['FRAGMENT_CACHE'] = os.environ.get('VIEWFLOW_FRAGMENT_CACHE', 'memory')
     # Prefer bundled model in repo/models if present, fallback to uploads/models if env set
     app.config['VOSK_MODEL_PATH'] = os.environ.get('VOSK_MODEL_PATH', os.path.join(BASE_DIR, 'models', 'vosk-model-small-en-us-0.15'))
 
+    # Video.js ships in static/vendor (see startup.py); only check the files exist
+    app.config['VIDEOJS_LOCAL'] = startup.videojs_local(app.static_folder)
+
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    timer.mark('config')
 
     db.init_app(app)
+    database.init_app(app, db)
+    metrics.init_app(app, db)
+    cache.init_app(app)
+    images.init_app(app, db)
 
     login_manager = LoginManager()
     login_manager.login_view = 'auth.login'
@@ -29,11 +48,13 @@ def create_app():
     # user loader for flask-login
     try:
         from models import User
+        import identity
 
         @login_manager.user_loader
         def load_user(user_id):
+            # cached snapshot; views that write to the user load the row (current_user_record)
             try:
-                return User.query.get(int(user_id))
+                return identity.load_identity(user_id, lambda uid: db.session.get(User, uid))
             except Exception:
                 return None
     except Exception:
@@ -44,66 +65,86 @@ def create_app():
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(main_bp)
-
-    # Force reload
-    # Try to bundle Video.js locally for offline/dev use
-    def _ensure_videojs_local():
-        try:
-            import urllib.request
-            static_vendor = os.path.join(app.static_folder, 'vendor')
-            os.makedirs(static_vendor, exist_ok=True)
-            js_path = os.path.join(static_vendor, 'video.min.js')
-            css_path = os.path.join(static_vendor, 'video-js.css')
-            have = True
-            if not os.path.exists(js_path):
-                try:
-                    urllib.request.urlretrieve('https://vjs.zencdn.net/8.20.0/video.min.js', js_path)
-                except Exception:
-                    have = False
-            if not os.path.exists(css_path):
-                try:
-                    urllib.request.urlretrieve('https://vjs.zencdn.net/8.20.0/video-js.css', css_path)
-                except Exception:
-                    have = False
-            app.config['VIDEOJS_LOCAL'] = have and os.path.exists(js_path) and os.path.exists(css_path)
-        except Exception:
-            app.config['VIDEOJS_LOCAL'] = False
-
-    _ensure_videojs_local()
+    timer.mark('blueprints')
 
     # Create DB and try to add new columns if older DB exists
     with app.app_context():
-        db.create_all()
-        # If the users table exists but missing columns, try to add them (SQLite supports ADD COLUMN)
-        try:
-            from models import User
-            # pragma: check columns
-            from sqlalchemy import text
-            conn = db.engine.connect()
+        _migrate()
+    database.start_replica_sync(app)
+    timer.mark('database')
+    app.config['STARTUP_TIMINGS'] = timer.as_dict()
+    timer.report('app.py startup')
+
+    return app
+
+
+def _migrate():
+    """create_all plus best-effort column migrations, skipped once stamped with SCHEMA_VERSION."""
+    with db.engine.connect() as conn:
+        if startup.schema_version(conn, 'app') >= SCHEMA_VERSION:
+            return
+    db.create_all()
+    # If the users table exists but missing columns, try to add them (SQLite supports ADD COLUMN)
+    try:
+        from models import User
+        # pragma: check columns
+        from sqlalchemy import text
+        with db.engine.connect() as conn:
             cols = conn.execute(text("PRAGMA table_info('user')")).fetchall()
             col_names = {c[1] for c in cols}
             if 'display_name' not in col_names:
                 conn.execute(text("ALTER TABLE user ADD COLUMN display_name TEXT"))
             if 'age' not in col_names:
                 conn.execute(text("ALTER TABLE user ADD COLUMN age INTEGER"))
+            if 'notifications_seen_at' not in col_names:
+                conn.execute(text("ALTER TABLE user ADD COLUMN notifications_seen_at DATETIME"))
+            if 'fanout_on_read_since' not in col_names:
+                conn.execute(text("ALTER TABLE user ADD COLUMN fanout_on_read_since DATETIME"))
+            if 'playlist_version' not in col_names:
+                conn.execute(text("ALTER TABLE user ADD COLUMN playlist_version INTEGER DEFAULT 0"))
+            if 'unread_notifications' not in col_names:
+                conn.execute(text("ALTER TABLE user ADD COLUMN unread_notifications INTEGER DEFAULT 0"))
+                conn.execute(text(
+                    'UPDATE "user" SET unread_notifications = '
+                    '(SELECT COUNT(*) FROM notification n WHERE n.user_id = "user".id AND n.is_read = 0)'))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_subscription_channel ON subscription (channel_id, id)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_subscription_channel_subscriber ON subscription (channel_id, subscriber_id, id)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_notification_user_created ON notification (user_id, created_at, id)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_comment_video_posted ON comment (video_id, date_posted, id)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_watch_later_user_added ON watch_later (user_id, added_at, id)"))
+            pv_cols = {c[1] for c in conn.execute(text("PRAGMA table_info('playlist_video')")).fetchall()}
+            if 'position' not in pv_cols:
+                conn.execute(text("ALTER TABLE playlist_video ADD COLUMN position INTEGER"))
+            # number existing playlist entries in insertion order
+            conn.execute(text(
+                "UPDATE playlist_video SET position = (SELECT COUNT(*) FROM playlist_video p2 "
+                "WHERE p2.playlist_id = playlist_video.playlist_id AND p2.id <= playlist_video.id) "
+                "WHERE position IS NULL"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_playlist_video_position ON playlist_video (playlist_id, position, id)"))
             # Check video table for thumbnail column
-            try:
-                vcols = conn.execute(text("PRAGMA table_info('video')")).fetchall()
-                vcol_names = {c[1] for c in vcols}
-                if 'thumbnail' not in vcol_names:
-                    conn.execute(text("ALTER TABLE video ADD COLUMN thumbnail TEXT"))
-                if 'category' not in vcol_names:
-                    conn.execute(text("ALTER TABLE video ADD COLUMN category TEXT"))
-                if 'tags' not in vcol_names:
-                    conn.execute(text("ALTER TABLE video ADD COLUMN tags TEXT"))
-                if 'captions' not in vcol_names:
-                    conn.execute(text("ALTER TABLE video ADD COLUMN captions TEXT"))
-                if 'auto_captions' not in vcol_names:
-                    conn.execute(text("ALTER TABLE video ADD COLUMN auto_captions TEXT"))
-            except Exception:
-                pass
-            conn.close()
-        except Exception:
-            pass
-
-    return app
+            vcols = conn.execute(text("PRAGMA table_info('video')")).fetchall()
+            vcol_names = {c[1] for c in vcols}
+            if 'thumbnail' not in vcol_names:
+                conn.execute(text("ALTER TABLE video ADD COLUMN thumbnail TEXT"))
+            if 'category' not in vcol_names:
+                conn.execute(text("ALTER TABLE video ADD COLUMN category TEXT"))
+            if 'tags' not in vcol_names:
+                conn.execute(text("ALTER TABLE video ADD COLUMN tags TEXT"))
+            if 'captions' not in vcol_names:
+                conn.execute(text("ALTER TABLE video ADD COLUMN captions TEXT"))
+            if 'auto_captions' not in vcol_names:
+                conn.execute(text("ALTER TABLE video ADD COLUMN auto_captions TEXT"))
+            if 'card_version' not in vcol_names:
+                conn.execute(text("ALTER TABLE video ADD COLUMN card_version INTEGER DEFAULT 0"))
+            if 'fanout_on_read' not in vcol_names:
+                conn.execute(text("ALTER TABLE video ADD COLUMN fanout_on_read BOOLEAN DEFAULT 0"))
+                # uploads merged at read time before the flag existed
+                conn.execute(text(
+                    'UPDATE video SET fanout_on_read = 1 WHERE EXISTS (SELECT 1 FROM "user" u '
+                    'WHERE u.id = video.user_id AND u.fanout_on_read_since IS NOT NULL '
+                    'AND video.upload_date >= u.fanout_on_read_since)'))
+            conn.commit()
+            # only stamped when every step above succeeded, so a failed one is retried on the next start
+            startup.set_schema_version(conn, 'app', SCHEMA_VERSION)
+    except Exception as e:
+        print(f"Migration error (will retry on next start): {e}")
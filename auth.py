@@ -1,10 +1,11 @@
 import os
 from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
-from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from flask_login import login_user, logout_user, login_required
 from models import db, User
+from passwords import hash_password, authenticate, login_allowed, PasswordBusy
 from datetime import datetime
+import images
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -19,8 +20,16 @@ def login():
     if request.method == 'POST':
         email = request.form.get('email')
         password = request.form.get('password')
+        if not login_allowed(request.remote_addr, email):
+            flash('Too many login attempts. Please wait a minute and try again.')
+            return render_template('login.html', title='Login'), 429
         user = User.query.filter_by(email=email).first()
-        if user and check_password_hash(user.password, password):
+        try:
+            authenticated = authenticate(db.session, user, password)
+        except PasswordBusy:
+            flash('The server is busy. Please try again in a moment.')
+            return render_template('login.html', title='Login'), 503
+        if authenticated:
             login_user(user)
             return redirect(url_for('main.home'))
         flash('Login failed. Check your email and password.')
@@ -73,7 +82,7 @@ def register():
             username=username,
             display_name=display_name,
             email=email,
-            password=generate_password_hash(password, method='pbkdf2:sha256'),
+            password=hash_password(password),
             age=int(age) if age else None,
             gender=gender if gender else None,
             location=location if location else None,
@@ -83,6 +92,7 @@ def register():
         )
         db.session.add(new_user)
         db.session.commit()
+        images.generate_async(current_app._get_current_object(), db, profile_pic_path, 'avatar')
         login_user(new_user)
         flash('Account created successfully!')
         return redirect(url_for('main.home'))
@@ -0,0 +1,117 @@
+"""
+Concurrent write traffic (watch page views, reactions, heatmap beats) from
+several worker processes against one SQLite file, with and without the
+database.py tuning (WAL, synchronous=NORMAL, busy timeout).
+
+    python benchmarks/bench_db_contention.py [--workers 8] [--seconds 10] [--profile both|tuned|default]
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+import argparse
+import contextlib
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+VIDEOS = 5
+
+
+def _load_app(url, tuned):
+    # test.py reads the database settings at import, so set them first
+    os.environ['DATABASE_URL'] = url
+    os.environ['VIEWFLOW_SQLITE_TUNING'] = '1' if tuned else '0'
+    with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+        import test
+    return test
+
+
+def seed(url, tuned, users):
+    test = _load_app(url, tuned)
+    from passwords import hash_password
+    with test.app.app_context():
+        pw = hash_password('bench', method='pbkdf2:sha256:1000')
+        owner = test.User(username='owner', email='owner@example.com', password=pw)
+        test.db.session.add(owner)
+        for i in range(users):
+            test.db.session.add(test.User(username=f'u{i}', email=f'u{i}@example.com', password=pw))
+        test.db.session.commit()
+        for i in range(VIDEOS):
+            test.db.session.add(test.Video(title=f'bench {i}', filename='missing.mp4', user_id=owner.id,
+                                           is_public=True, status='ready'))
+        test.db.session.commit()
+        return [v.id for v in test.Video.query.all()], [u.id for u in test.User.query.filter(test.User.id != owner.id)]
+
+
+def worker(args):
+    url, tuned, user_id, video_ids, seconds, seed_value = args
+    test = _load_app(url, tuned)
+    rng = random.Random(seed_value)
+    client = test.app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+    ajax = {'X-Requested-With': 'XMLHttpRequest'}
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+    with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+        while time.perf_counter() < deadline:
+            vid = rng.choice(video_ids)
+            op = rng.random()
+            start = time.perf_counter()
+            try:
+                if op < 0.4:
+                    r = client.get(f'/watch/{vid}')
+                elif op < 0.8:
+                    r = client.post(f'/api/video/{vid}/heatmap', json={'bucket': rng.randrange(100)})
+                else:
+                    r = client.post(f'/video/{vid}/react', data={'action': rng.choice(('like', 'dislike'))}, headers=ajax)
+                ok = r.status_code < 400
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+    return latencies, errors
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def run(profile, workers, seconds):
+    tuned = profile == 'tuned'
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        url = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+        with ctx.Pool(1) as pool:
+            video_ids, user_ids = pool.apply(seed, (url, tuned, workers))
+        jobs = [(url, tuned, user_ids[i], video_ids, seconds, i) for i in range(workers)]
+        with ctx.Pool(workers) as pool:
+            results = pool.map(worker, jobs)
+    latencies = [x for lat, _ in results for x in lat]
+    errors = sum(e for _, e in results)
+    print(f"{profile:8s} {len(latencies) / seconds:8.1f} req/s  "
+          f"p50 {percentile(latencies, 0.50) * 1000:7.1f} ms  p99 {percentile(latencies, 0.99) * 1000:7.1f} ms  "
+          f"errors {errors}/{len(latencies)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--profile', choices=('both', 'tuned', 'default'), default='both')
+    args = parser.parse_args()
+
+    profiles = ('default', 'tuned') if args.profile == 'both' else (args.profile,)
+    print(f"{args.workers} worker processes, {args.seconds:g}s per profile")
+    for profile in profiles:
+        run(profile, args.workers, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
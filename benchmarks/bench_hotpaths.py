@@ -0,0 +1,212 @@
+"""
+Micro-benchmarks for the recommendation and search hot paths: the profile
+vector, recommendations, channel recommendation and the search query, at
+several catalog sizes and watch history lengths, plus voice.process_command
+and the caption cue writer. Each catalog size is seeded into a fresh SQLite
+database in its own process.
+
+    python benchmarks/bench_hotpaths.py [--videos 1000,10000,100000] [--history 10,50] [--json out.json]
+
+The scaling column is the slope of log(median time) against log(catalog
+size) between the smallest and largest size: about 1 means linear in the
+catalog, well under 1 sub-linear. Save --json per commit to compare trends.
+"""
+import io
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import tempfile
+import contextlib
+import statistics
+import multiprocessing
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import catalog as catalog_mod
+from loadtest import load_app, git_revision
+
+VOICE_PHRASES = ('search for funny cats', 'Show me cooking videos', 'find guitar lessons',
+                 'look for travel vlogs', 'lofi beats to study to')
+
+
+def hot_paths(kind):
+    """The catalog-dependent functions of test.py, or of recommendations.py and views.py."""
+    if kind == 'test':
+        import test
+        return test.get_user_profile_vector, test.get_recommendations, test.get_channel_recommendation, \
+            test.search_videos
+    import recommendations
+    import views
+    return recommendations.get_user_profile_vector, recommendations.get_recommendations, \
+        recommendations.get_channel_recommendation, views.search_videos
+
+
+def timed(fn, repeat, budget):
+    """Seconds per call, at least one run and at most repeat, stopping once budget is spent."""
+    runs = []
+    while len(runs) < repeat and (not runs or sum(runs) < budget):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def row(bench, runs, **params):
+    return dict(bench=bench, **params, runs=len(runs), min_ms=min(runs) * 1000,
+                median_ms=statistics.median(runs) * 1000, mean_ms=statistics.fmean(runs) * 1000)
+
+
+def add_history(conn, table, user_id, cat, length, rng):
+    now = datetime.utcnow()
+    conn.execute(table.insert(), [{
+        'user_id': user_id, 'video_id': cat.popular_video(rng),
+        'timestamp': now - timedelta(minutes=i),
+    } for i in range(length)])
+
+
+def measure_catalog(kind, db_path, videos, histories, args):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+    with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+        app, db = load_app(kind)
+        profile_vector, recommend, channel_recommendation, search_videos = hot_paths(kind)
+    rng = random.Random(args.seed)
+    results = []
+    with app.app_context():
+        start = time.perf_counter()
+        # background history is light; the measured users get exact lengths below
+        cat = catalog_mod.seed(db.engine, db.metadata, users=args.users + len(histories), videos=videos,
+                               tags=args.tags, history=2, comments=0, subscriptions=2, reactions=2,
+                               seed=args.seed)
+        bench_users = dict(zip(histories, cat.user_ids[-len(histories):]))
+        with db.engine.begin() as conn:
+            for length, user_id in bench_users.items():
+                conn.execute(db.metadata.tables['view_history'].delete().where(
+                    db.metadata.tables['view_history'].c.user_id == user_id))
+                add_history(conn, db.metadata.tables['view_history'], user_id, cat, length, rng)
+        print(f"  seeded {videos} videos in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        for length, user_id in bench_users.items():
+            params = {'videos': videos, 'history': length}
+            for bench, fn in (
+                ('profile_vector', lambda: profile_vector(user_id)),
+                ('recommendations', lambda: recommend(user_id, limit=4)),
+                ('channel_recommendation', lambda: channel_recommendation(user_id)),
+            ):
+                fn()  # warm the connection and statement caches
+                results.append(row(bench, timed(fn, args.repeat, args.budget), **params))
+                db.session.remove()
+
+        terms = [cat.search_term(rng) for _ in range(args.repeat)]
+        search_videos(terms[0]).all()
+        term = iter(terms * 2)
+        results.append(row('search', timed(lambda: search_videos(next(term)).all(), args.repeat, args.budget),
+                           videos=videos, history=None))
+        db.session.remove()
+    return results
+
+
+def measure_voice(repeat):
+    import voice
+    calls = 10000
+    runs = timed(lambda: [voice.process_command(VOICE_PHRASES[i % len(VOICE_PHRASES)]) for i in range(calls)],
+                 repeat, float('inf'))
+    return row('process_command', [r / calls for r in runs], videos=None, history=None)
+
+
+def measure_vtt(words, repeat, seed):
+    from captions import VttWriter
+    rng = random.Random(seed)
+    vocab = catalog_mod.vocabulary(500, rng)
+    timings, t = [], 0.0
+    for _ in range(words):
+        # speech-like pacing with an occasional pause that forces a new cue
+        length = rng.uniform(0.15, 0.5)
+        timings.append({'word': rng.choice(vocab), 'start': t, 'end': t + length})
+        t += length + (rng.uniform(0.8, 1.5) if rng.random() < 0.05 else rng.uniform(0.0, 0.1))
+
+    def write():
+        writer = VttWriter(io.StringIO())
+        writer.add_words(timings)
+        writer.close()
+
+    return row('vtt_cues', timed(write, repeat, float('inf')), videos=None, history=None, words=words)
+
+
+def scaling(results):
+    """Log-log slope of median time between the smallest and largest catalog, per bench and history."""
+    series = {}
+    for r in results:
+        if r['videos']:
+            key = r['bench'] if r['history'] is None else f"{r['bench']}@history={r['history']}"
+            series.setdefault(key, []).append((r['videos'], r['median_ms']))
+    slopes = {}
+    for key, points in series.items():
+        (n0, t0), (n1, t1) = min(points), max(points)
+        if n1 > n0 and t0 > 0 and t1 > 0:
+            slopes[key] = math.log(t1 / t0) / math.log(n1 / n0)
+    return slopes
+
+
+def print_report(results, slopes):
+    print(f"{'bench':24s} {'videos':>8s} {'history':>8s} {'runs':>5s} {'min ms':>10s} {'median ms':>10s}")
+    for r in results:
+        videos = r['videos'] if r['videos'] is not None else '-'
+        history = r['history'] if r['history'] is not None else '-'
+        print(f"{r['bench']:24s} {videos!s:>8s} {history!s:>8s} {r['runs']:5d} "
+              f"{r['min_ms']:10.4f} {r['median_ms']:10.4f}")
+    if slopes:
+        print("scaling with catalog size (log-log slope; 1 = linear):")
+        for key, slope in slopes.items():
+            print(f"  {key:40s} {slope:6.2f}")
+
+
+def int_list(spec):
+    return [int(float(x)) for x in spec.split(',') if x.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('--app', choices=('test', 'app'), default='test',
+                        help="test.py (default) or recommendations.py/views.py")
+    parser.add_argument('--videos', type=int_list, default=[1000, 10000, 100000],
+                        help="comma-separated catalog sizes, up to 1e6")
+    parser.add_argument('--history', type=int_list, default=[10, 50],
+                        help="comma-separated watch history lengths of the measured users")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--tags', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=20, help="runs per measurement (at most)")
+    parser.add_argument('--budget', type=float, default=10.0,
+                        help="stop repeating a measurement after this many seconds")
+    parser.add_argument('--vtt-words', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="also write the results, config and git revision here")
+    args = parser.parse_args()
+
+    results = [measure_voice(args.repeat), measure_vtt(args.vtt_words, args.repeat, args.seed)]
+    ctx = multiprocessing.get_context('spawn')
+    for videos in sorted(args.videos):
+        print(f"catalog of {videos} videos...", file=sys.stderr)
+        # test.py binds its database at import, so every size gets a new process
+        with tempfile.TemporaryDirectory() as tmp, ctx.Pool(1) as pool:
+            results += pool.apply(measure_catalog, (args.app, os.path.join(tmp, 'bench.db'), videos, args.history, args))
+    slopes = scaling(results)
+    print_report(results, slopes)
+    if args.json:
+        report = {'revision': git_revision(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  'config': {k: v for k, v in vars(args).items() if k != 'json'},
+                  'results': results, 'scaling': slopes}
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"wrote {args.json}")
+
+
+if __name__ == '__main__':
+    main()
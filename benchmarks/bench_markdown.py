@@ -0,0 +1,54 @@
+"""
+Cold vs warm rendering of a long video description through the cached
+Markdown filter.
+
+    python benchmarks/bench_markdown.py [--paragraphs 200] [--repeat 200]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rendering
+
+
+def sample_description(paragraphs):
+    block = (
+        "## Chapter {n}\n\n"
+        "Some **bold** and *italic* text with a [link](https://example.com/{n}) and `inline code`.\n\n"
+        "- first point\n- second point\n- third point\n\n"
+        "> quoted line {n}\n\n"
+    )
+    return "".join(block.format(n=n) for n in range(paragraphs))
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--paragraphs', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    text = sample_description(args.paragraphs)
+    print(f"description: {len(text)} chars")
+
+    uncached = timed(lambda: rendering.render_markdown_uncached(text), max(1, args.repeat // 10))
+    rendering._markdown_cache.clear()
+    cold = timed(lambda: rendering.render_markdown(text), 1)
+    warm = timed(lambda: rendering.render_markdown(text), args.repeat)
+
+    print(f"uncached: {uncached * 1000:9.3f} ms/render")
+    print(f"cold:     {cold * 1000:9.3f} ms/render")
+    print(f"warm:     {warm * 1000:9.3f} ms/render  ({uncached / warm:,.0f}x faster than uncached)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Per-request cost of metrics.py: the same page requests with instrumentation
+on and off (VIEWFLOW_METRICS), each in a fresh process on a seeded database.
+
+    python benchmarks/bench_metrics.py [--requests 500] [--path /]
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+import contextlib
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def measure(url, enabled, path, requests):
+    os.environ['DATABASE_URL'] = url
+    os.environ['VIEWFLOW_METRICS'] = '1' if enabled else '0'
+    with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+        import test
+        with test.app.app_context():
+            if not test.User.query.first():
+                owner = test.User(username='owner', email='owner@example.com', password='-')
+                test.db.session.add(owner)
+                test.db.session.commit()
+                for i in range(24):
+                    test.db.session.add(test.Video(title=f'bench {i}', filename='missing.mp4', user_id=owner.id,
+                                                   is_public=True, status='ready'))
+                test.db.session.commit()
+        client = test.app.test_client()
+        for _ in range(20):
+            client.get(path)
+        start = time.perf_counter()
+        for _ in range(requests):
+            client.get(path)
+        return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--path', default='/')
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        url = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+        results = {}
+        # alternate to spread any drift over both settings
+        for enabled in (False, True, False, True):
+            with ctx.Pool(1) as pool:
+                t = pool.apply(measure, (url, enabled, args.path, args.requests))
+            results[enabled] = min(t, results.get(enabled, t))
+    off, on = results[False], results[True]
+    print(f"GET {args.path}, {args.requests} requests per run, best of 2")
+    print(f"metrics off: {off * 1000:8.3f} ms/request")
+    print(f"metrics on:  {on * 1000:8.3f} ms/request  (+{(on - off) * 1e6:.0f} us, {100 * (on - off) / off:+.1f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+Upload post-processing on synthetic media: process_video_upload (probe,
+decode, thumbnail, previews and each transcode_video rendition) from
+test.py, and the thumbnail and caption threads of views.py, run against
+lavfi fixtures (see media_fixtures.py). Reports wall time, CPU time and
+peak RSS per stage, as recorded by metrics.stage().
+
+    python benchmarks/bench_pipeline.py [--duration 10,60] [--resolution 640x360,1920x1080] [--json out.json]
+    python benchmarks/bench_pipeline.py --input my_clip.mp4
+
+CPU time is the stage thread's own, plus media pool jobs it waited on and
+ffmpeg and other subprocesses that finished inside the stage (see
+metrics.Span). Peak RSS covers this process and its
+children, sampled every --sample-ms (Linux only). Captions use Vosk when
+VOSK_MODEL_PATH (or --vosk-model) points at a model; the Google fallback
+is off unless --google is given.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import media_fixtures
+from loadtest import load_app, git_revision
+
+STEPS = {'test': ('process_video_upload',), 'app': ('thumbnail', 'captions')}
+
+
+def _rss_bytes(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _children(pid):
+    kids = []
+    try:
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{tid}/children') as f:
+                kids += [int(k) for k in f.read().split()]
+    except OSError:
+        pass
+    return kids
+
+
+def tree_rss(pid):
+    """Resident memory of pid and all of its descendants."""
+    total, todo = 0, [pid]
+    while todo:
+        p = todo.pop()
+        total += _rss_bytes(p)
+        todo += _children(p)
+    return total
+
+
+class RssSampler:
+    """Samples this process tree's RSS on a background thread."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = []
+        self.enabled = os.path.exists(f'/proc/{os.getpid()}/task')
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        pid = os.getpid()
+        while True:
+            self.samples.append((datetime.utcnow(), tree_rss(pid)))
+            if self._stop.wait(self.interval):
+                # one last sample so stages shorter than the interval still get one
+                self.samples.append((datetime.utcnow(), tree_rss(pid)))
+                return
+
+    def peak(self, start, end):
+        """Highest sample between start and end, or the first one after start for very short windows."""
+        if not self.enabled:
+            return None
+        inside = [rss for at, rss in self.samples if start <= at <= end]
+        if inside:
+            return max(inside)
+        after = [rss for at, rss in self.samples if at >= start]
+        return after[0] if after else None
+
+    def __enter__(self):
+        if self.enabled:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self.enabled:
+            self._thread.join()
+
+
+def _mb(n):
+    return None if n is None else n / 1e6
+
+
+def run_step(kind, step, app, video_id, path, filename, ts):
+    if kind == 'test':
+        import test
+        test.process_video_upload(app, video_id, path, filename, ts)
+    else:
+        import views
+        {'thumbnail': views._generate_thumbnail, 'captions': views._generate_captions}[step](
+            app, video_id, path, filename, ts)
+
+
+def new_video(kind, db, title, filename):
+    if kind == 'test':
+        from test import User, Video
+    else:
+        from models import User, Video
+    owner = User.query.filter_by(username='bench').first()
+    if not owner:
+        owner = User(username='bench', email='bench@bench.local', password='-')
+        db.session.add(owner)
+        db.session.commit()
+    video = Video(title=title, filename=filename, user_id=owner.id, is_public=True, status='processing')
+    db.session.add(video)
+    db.session.commit()
+    return video.id
+
+
+def remove_outputs(upload_dir, prefix):
+    for dirpath, _, files in os.walk(upload_dir):
+        for name in files:
+            if name.startswith(prefix):
+                os.remove(os.path.join(dirpath, name))
+
+
+def measure_app(kind, db_path, fixtures, args):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+    if not args.google:
+        os.environ['VIEWFLOW_GOOGLE_CAPTIONS'] = '0'
+    if args.vosk_model:
+        os.environ['VOSK_MODEL_PATH'] = args.vosk_model
+    with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+        app, db = load_app(kind)
+    try:
+        return _measure_fixtures(kind, app, db, fixtures, args)
+    finally:
+        # a worker process exits without running atexit, so stop the media pool here
+        import mediapool
+        mediapool.shutdown()
+
+
+def _measure_fixtures(kind, app, db, fixtures, args):
+    import metrics
+    upload_dir = app.config['UPLOAD_FOLDER']
+    os.makedirs(upload_dir, exist_ok=True)
+    results = []
+    for index, (settings, source) in enumerate(fixtures):
+        for step in STEPS[kind]:
+            for run in range(args.repeat):
+                ts = f'benchpipe{os.getpid()}_{index}_{run}'
+                filename = f'{ts}_{os.path.basename(source)}'
+                path = os.path.join(upload_dir, filename)
+                shutil.copyfile(source, path)
+                try:
+                    with app.app_context():
+                        video_id = new_video(kind, db, os.path.basename(source), filename)
+                    with RssSampler(args.sample_ms / 1000) as sampler, metrics.trace(video_id) as spans, \
+                            open(os.devnull, 'w') as null, contextlib.redirect_stdout(null), \
+                            metrics.stage(f'bench_{step}') as total:
+                        run_step(kind, step, app, video_id, path, filename, ts)
+                finally:
+                    remove_outputs(upload_dir, ts)
+                stages = [{
+                    'stage': s.name, 'outcome': s.outcome, 'wall_s': s.seconds, 'cpu_s': s.cpu_seconds,
+                    'peak_rss_mb': _mb(sampler.peak(s.started_at, s.started_at + timedelta(seconds=s.seconds))),
+                } for s in spans if s is not total and s.name != metrics.UPLOAD_TO_READY]
+                results.append({
+                    'app': kind, 'step': step, 'run': run, 'fixture': dict(settings, file=os.path.basename(source)),
+                    'wall_s': total.seconds, 'cpu_s': total.cpu_seconds,
+                    'peak_rss_mb': _mb(sampler.peak(total.started_at, total.started_at + timedelta(seconds=total.seconds))),
+                    'stages': stages,
+                })
+    return results
+
+
+def _fmt(value, spec):
+    return format(value, spec) if value is not None else '-'.rjust(int(spec.split('.')[0]))
+
+
+def print_report(results):
+    print(f"{'fixture / stage':44s} {'outcome':>8s} {'wall s':>8s} {'cpu s':>8s} {'rss MB':>8s}")
+    for r in results:
+        print(f"{(r['fixture']['file'] + ': ' + r['step'])[:44]:44s} {'':>8s} "
+              f"{_fmt(r['wall_s'], '8.3f')} {_fmt(r['cpu_s'], '8.3f')} {_fmt(r['peak_rss_mb'], '8.1f')}")
+        for s in r['stages']:
+            print(f"  {s['stage']:42s} {s['outcome']:>8s} {_fmt(s['wall_s'], '8.3f')} "
+                  f"{_fmt(s['cpu_s'], '8.3f')} {_fmt(s['peak_rss_mb'], '8.1f')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('--app', type=media_fixtures.csv(), default=['test', 'app'],
+                        help="test (process_video_upload) and/or app (views.py threads)")
+    media_fixtures.add_arguments(parser)
+    parser.add_argument('--fixtures', help="directory to generate and reuse fixtures in (default: temporary)")
+    parser.add_argument('--input', action='append', default=[], help="use this media file instead (repeatable)")
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--sample-ms', type=float, default=20)
+    parser.add_argument('--vosk-model', help="Vosk model directory for the captions step")
+    parser.add_argument('--google', action='store_true', help="allow the online Google captions fallback")
+    parser.add_argument('--json', help="also write the results, config and git revision here")
+    args = parser.parse_args()
+    for kind in args.app:
+        if kind not in STEPS:
+            sys.exit(f"unknown app {kind!r}; choose from {', '.join(STEPS)}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.input:
+            fixtures = [({'file': os.path.basename(p)}, os.path.abspath(p)) for p in args.input]
+        else:
+            if not media_fixtures.have_ffmpeg():
+                sys.exit("ffmpeg was not found on PATH; it is needed to generate fixtures (or pass --input)")
+            print("generating fixtures...", file=sys.stderr)
+            fixtures = media_fixtures.fixtures_from_args(args.fixtures or os.path.join(tmp, 'fixtures'), args)
+
+        results = []
+        ctx = multiprocessing.get_context('spawn')
+        # the two apps have separate models, so each gets its own process and database
+        for kind in args.app:
+            print(f"running {kind} pipeline on {len(fixtures)} fixture(s)...", file=sys.stderr)
+            # not multiprocessing.Pool: its daemonic workers cannot start the media pool
+            with ProcessPoolExecutor(1, mp_context=ctx) as pool:
+                results += pool.submit(measure_app, kind, os.path.join(tmp, f'{kind}.db'), fixtures, args).result()
+
+    print_report(results)
+    if args.json:
+        report = {'revision': git_revision(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  'config': {k: v for k, v in vars(args).items() if k != 'json'}, 'results': results}
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"wrote {args.json}")
+
+
+if __name__ == '__main__':
+    main()
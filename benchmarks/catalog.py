@@ -0,0 +1,132 @@
+"""
+Synthetic catalog for the benchmarks: users, videos with titles, tags and
+categories, watch history, comments, subscriptions and reactions. Video
+popularity is Zipf-like so a few videos get most of the traffic, as on the
+real site. Rows go in with bulk inserts through the app's own tables, so
+either app's models (test.py or models.py) can be seeded.
+"""
+import random
+import bisect
+import itertools
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+
+CATEGORIES = ('Music', 'Gaming', 'Education', 'Comedy', 'News', 'Sports', 'Technology', 'Travel', 'Cooking', 'Film')
+BATCH_SIZE = 5000
+PRIVATE_SHARE = 0.05
+# plain-text password of every seeded user (emails are bench<id>@bench.local)
+BENCH_PASSWORD = 'bench'
+
+
+class Catalog:
+    """What was seeded: user and public video ids, the title/tag vocabulary, and a popularity sampler."""
+
+    def __init__(self, user_ids, video_ids, words, tags, rng):
+        self.user_ids = user_ids
+        self.video_ids = video_ids
+        self.words = words
+        self.tags = tags
+        weights = [1.0 / (rank + 1) for rank in range(len(video_ids))]
+        self._cum = list(itertools.accumulate(weights))
+        self.rng = rng
+
+    def popular_video(self, rng=None):
+        rng = rng or self.rng
+        return self.video_ids[bisect.bisect_left(self._cum, rng.random() * self._cum[-1])]
+
+    def user(self, rng=None):
+        return (rng or self.rng).choice(self.user_ids)
+
+    def search_term(self, rng=None):
+        return (rng or self.rng).choice(self.words)
+
+
+def vocabulary(n, rng):
+    """n distinct pronounceable words."""
+    consonants, vowels = 'bcdfghklmnprstvz', 'aeiou'
+    words = set()
+    while len(words) < n:
+        words.add(''.join(rng.choice(consonants) + rng.choice(vowels) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def _insert(conn, table, rows):
+    # the two apps' models differ slightly; drop fields this table lacks
+    columns = set(table.c.keys())
+    rows = [{k: v for k, v in row.items() if k in columns} for row in rows]
+    for i in range(0, len(rows), BATCH_SIZE):
+        conn.execute(table.insert(), rows[i:i + BATCH_SIZE])
+
+
+def _next_id(conn, table):
+    return (conn.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+
+
+def seed(engine, metadata, users=200, videos=5000, tags=300, history=20, comments=3, subscriptions=10,
+         reactions=10, seed=0, password_hash='-'):
+    """
+    Insert a catalog into the tables of metadata (already created) and
+    return a Catalog. history, subscriptions and reactions are per user,
+    comments per video, all on average.
+    """
+    rng = random.Random(seed)
+    t = metadata.tables
+    words = vocabulary(max(200, tags), rng)
+    tag_words = words[:tags]
+    now = datetime.utcnow()
+
+    with engine.begin() as conn:
+        first_user = _next_id(conn, t['user'])
+        user_ids = list(range(first_user, first_user + users))
+        _insert(conn, t['user'], [{
+            'id': uid, 'username': f'bench{uid}', 'email': f'bench{uid}@bench.local', 'password': password_hash,
+            'display_name': f'{rng.choice(words).title()} {rng.choice(words).title()}',
+            'date_joined': now - timedelta(days=rng.randint(0, 1000)),
+        } for uid in user_ids])
+
+        first_video = _next_id(conn, t['video'])
+        video_ids = list(range(first_video, first_video + videos))
+        public = {vid: rng.random() > PRIVATE_SHARE for vid in video_ids}
+        # popularity rank follows insertion order; views roughly Zipf
+        _insert(conn, t['video'], [{
+            'id': vid, 'title': ' '.join(rng.choice(words) for _ in range(rng.randint(3, 6))).capitalize()[:100],
+            'description': ' '.join(rng.choice(words) for _ in range(rng.randint(10, 60))),
+            'filename': f'bench_{vid}.mp4', 'category': rng.choice(CATEGORIES),
+            'tags': ','.join(rng.sample(tag_words, min(len(tag_words), rng.randint(3, 8)))),
+            'views': int(100000 / (rank + 1)) + rng.randint(0, 50), 'user_id': rng.choice(user_ids),
+            'is_public': public[vid], 'status': 'ready', 'heatmap': '[]',
+            'upload_date': now - timedelta(minutes=rng.randint(0, 60 * 24 * 365)),
+        } for rank, vid in enumerate(video_ids)])
+
+        # traffic only targets videos anyone can open
+        catalog = Catalog(user_ids, [vid for vid in video_ids if public[vid]], words, tag_words, rng)
+
+        _insert(conn, t['view_history'], [{
+            'user_id': uid, 'video_id': catalog.popular_video(),
+            'timestamp': now - timedelta(minutes=rng.randint(0, 60 * 24 * 90)),
+        } for uid in user_ids for _ in range(rng.randint(0, 2 * history))])
+
+        _insert(conn, t['comment'], [{
+            'video_id': catalog.popular_video(), 'user_id': rng.choice(user_ids),
+            'content': ' '.join(rng.choice(words) for _ in range(rng.randint(3, 30))),
+            'date_posted': now - timedelta(minutes=rng.randint(0, 60 * 24 * 365)),
+        } for _ in range(comments * videos)])
+
+        subs = set()
+        for uid in user_ids:
+            for channel in rng.sample(user_ids, min(len(user_ids), rng.randint(0, 2 * subscriptions))):
+                if channel != uid:
+                    subs.add((uid, channel))
+        _insert(conn, t['subscription'], [
+            {'subscriber_id': s, 'channel_id': c, 'created_at': now - timedelta(days=rng.randint(0, 365))}
+            for s, c in sorted(subs)])
+
+        liked = set()
+        for uid in user_ids:
+            for _ in range(rng.randint(0, 2 * reactions)):
+                liked.add((uid, catalog.popular_video()))
+        _insert(conn, t['reaction'], [
+            {'user_id': u, 'video_id': v, 'type': 1 if rng.random() < 0.9 else -1, 'created_at': now}
+            for u, v in sorted(liked)])
+
+    return catalog
@@ -0,0 +1,275 @@
+"""
+Load test for the web tier: seed a synthetic catalog into a fresh SQLite
+database, then replay a weighted mix of home, watch, search, suggestions,
+reactions, heatmap beats and file downloads from several concurrent
+clients, and report p50/p95/p99 latency per request type and throughput.
+
+    python benchmarks/loadtest.py [--videos 5000] [--requests 3000] [--concurrency 8] [--json out.json]
+
+By default requests go through the Flask test client in this process. To
+load a running server instead, seed its database first and point at it:
+
+    python benchmarks/loadtest.py --db /tmp/bench.db --seed-only
+    DATABASE_URL=sqlite:////tmp/bench.db gunicorn -w 4 test:app
+    python benchmarks/loadtest.py --db /tmp/bench.db --no-seed --url http://127.0.0.1:8000
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import contextlib
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import catalog as catalog_mod
+
+DEFAULT_MIX = 'home=20,watch=30,search=10,suggest=10,react=5,heatmap=20,file=5'
+SAMPLE_FILE_BYTES = 256 * 1024
+
+
+def load_app(kind):
+    """(app, db) for test.py or the app.py factory; DATABASE_URL must already be set."""
+    if kind == 'test':
+        import test
+        return test.app, test.db
+    import app as app_module
+    from models import db
+    return app_module.create_app(), db
+
+
+class LiveClient:
+    """Just enough of the Flask test client's interface over HTTP, with cookies."""
+
+    class Response:
+        def __init__(self, status_code, data):
+            self.status_code = status_code
+            self.data = data
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+
+    def _open(self, req):
+        try:
+            with self.opener.open(req, timeout=60) as resp:
+                return self.Response(resp.status, resp.read())
+        except urllib.error.HTTPError as e:
+            return self.Response(e.code, e.read())
+
+    def get(self, path, headers=None):
+        return self._open(urllib.request.Request(self.base_url + path, headers=headers or {}))
+
+    def post(self, path, data=None, json=None, headers=None):
+        headers = dict(headers or {})
+        if json is not None:
+            body = _dumps(json).encode()
+            headers['Content-Type'] = 'application/json'
+        else:
+            body = urllib.parse.urlencode(data or {}).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        return self._open(urllib.request.Request(self.base_url + path, data=body, headers=headers, method='POST'))
+
+
+AJAX = {'X-Requested-With': 'XMLHttpRequest'}
+_dumps = json.dumps  # LiveClient.post's json argument shadows the module
+
+
+def _prefix(term, rng):
+    return term[:rng.randint(2, max(2, len(term)))]
+
+
+SCENARIOS = {
+    'home': lambda c, rng, cat, ctx: c.get('/'),
+    'watch': lambda c, rng, cat, ctx: c.get(f'/watch/{cat.popular_video(rng)}'),
+    'search': lambda c, rng, cat, ctx: c.get('/search?' + urllib.parse.urlencode({'q': cat.search_term(rng)})),
+    'suggest': lambda c, rng, cat, ctx: c.get('/search/suggestions?' + urllib.parse.urlencode(
+        {'q': _prefix(cat.search_term(rng), rng).capitalize()})),
+    'react': lambda c, rng, cat, ctx: c.post(f'/video/{cat.popular_video(rng)}/react',
+                                             data={'action': rng.choice(('like', 'dislike'))}, headers=AJAX),
+    'heatmap': lambda c, rng, cat, ctx: c.post(f'/api/video/{cat.popular_video(rng)}/heatmap',
+                                               json={'bucket': rng.randrange(100)}),
+    'file': lambda c, rng, cat, ctx: c.get(f"/uploads/{ctx['sample_file']}"),
+}
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"unknown request type {name!r}; choose from {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def make_client(args, app, user_id):
+    if args.url:
+        client = LiveClient(args.url)
+        client.post('/login', data={'email': f'bench{user_id}@bench.local', 'password': catalog_mod.BENCH_PASSWORD})
+        return client
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+    return client
+
+
+def run_client(args, app, cat, ctx, mix, index, count, results):
+    rng = random.Random(args.seed * 1000 + index)
+    client = make_client(args, app, cat.user_ids[index % len(cat.user_ids)])
+    names, weights = list(mix), list(mix.values())
+    samples = []
+    for i in range(args.warmup + count):
+        name = rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            status = SCENARIOS[name](client, rng, cat, ctx).status_code
+        except Exception:
+            status = 599
+        if i >= args.warmup:
+            samples.append((name, time.perf_counter() - start, status))
+    results[index] = samples
+
+
+def summarize(samples, elapsed):
+    by_name = {}
+    for name, seconds, status in samples:
+        by_name.setdefault(name, []).append((seconds, status))
+    report = {'requests': len(samples), 'seconds': elapsed, 'throughput': len(samples) / elapsed if elapsed else 0.0,
+              'errors': sum(status >= 400 for _, _, status in samples), 'endpoints': {}}
+    for name, rows in sorted(by_name.items()):
+        latencies = [s for s, _ in rows]
+        report['endpoints'][name] = {
+            'count': len(rows), 'errors': sum(status >= 400 for _, status in rows),
+            'p50_ms': percentile(latencies, 0.50) * 1000, 'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+        }
+    all_latencies = [s for _, s, _ in samples]
+    report['p50_ms'] = percentile(all_latencies, 0.50) * 1000
+    report['p95_ms'] = percentile(all_latencies, 0.95) * 1000
+    report['p99_ms'] = percentile(all_latencies, 0.99) * 1000
+    return report
+
+
+def print_report(report):
+    print(f"{'request':10s} {'count':>7s} {'errors':>7s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    for name, r in report['endpoints'].items():
+        print(f"{name:10s} {r['count']:7d} {r['errors']:7d} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} {r['p99_ms']:9.2f}")
+    print(f"{'all':10s} {report['requests']:7d} {report['errors']:7d} "
+          f"{report['p50_ms']:9.2f} {report['p95_ms']:9.2f} {report['p99_ms']:9.2f}")
+    print(f"throughput: {report['throughput']:.1f} req/s over {report['seconds']:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('--app', choices=('test', 'app'), default='test', help="test.py (default) or the app.py factory")
+    parser.add_argument('--db', help="SQLite file to use (default: a temporary file)")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--videos', type=int, default=5000)
+    parser.add_argument('--tags', type=int, default=300)
+    parser.add_argument('--history', type=int, default=20, help="watch history rows per user (average)")
+    parser.add_argument('--comments', type=int, default=3, help="comments per video (average)")
+    parser.add_argument('--subscriptions', type=int, default=10, help="subscriptions per user (average)")
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=10, help="unmeasured requests per client")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"request weights (default {DEFAULT_MIX})")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help="load a running server instead of the in-process test client")
+    parser.add_argument('--seed-only', action='store_true')
+    parser.add_argument('--no-seed', action='store_true', help="reuse the catalog already in --db")
+    parser.add_argument('--json', help="also write the results, config and git revision here")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    tmp = None
+    if not args.db:
+        tmp = tempfile.TemporaryDirectory()
+        args.db = os.path.join(tmp.name, 'bench.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(args.db)
+    # the app logs every view; keep the report readable
+    with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+        app, db = load_app(args.app)
+
+    from passwords import hash_password
+    with app.app_context():
+        if args.no_seed:
+            users = [r[0] for r in db.session.execute(db.text(
+                "SELECT id FROM \"user\" WHERE email LIKE '%@bench.local' ORDER BY id")).fetchall()]
+            videos = [r[0] for r in db.session.execute(db.text("SELECT id FROM video WHERE is_public = 1 ORDER BY id")).fetchall()]
+            rng = random.Random(args.seed)
+            cat = catalog_mod.Catalog(users, videos, catalog_mod.vocabulary(max(200, args.tags), rng), [], rng)
+        else:
+            start = time.perf_counter()
+            cat = catalog_mod.seed(db.engine, db.metadata, users=args.users, videos=args.videos, tags=args.tags,
+                                   history=args.history, comments=args.comments,
+                                   subscriptions=args.subscriptions, seed=args.seed,
+                                   password_hash=hash_password(catalog_mod.BENCH_PASSWORD))
+            print(f"seeded {args.users} users, {args.videos} videos in {time.perf_counter() - start:.1f}s ({args.db})")
+    if args.seed_only:
+        return
+
+    upload_dir = app.config['UPLOAD_FOLDER']
+    sample_name = f'loadtest_{os.getpid()}.bin'
+    sample_path = os.path.join(upload_dir, sample_name)
+    with open(sample_path, 'wb') as f:
+        f.write(os.urandom(SAMPLE_FILE_BYTES))
+    ctx = {'sample_file': sample_name}
+
+    per_client = [args.requests // args.concurrency + (i < args.requests % args.concurrency)
+                  for i in range(args.concurrency)]
+    results = [None] * args.concurrency
+    threads = [threading.Thread(target=run_client, args=(args, app, cat, ctx, mix, i, n, results))
+               for i, n in enumerate(per_client)]
+    try:
+        with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start
+    finally:
+        os.remove(sample_path)
+
+    report = summarize([s for r in results for s in (r or [])], elapsed)
+    print(f"{'live ' + args.url if args.url else 'test client'}, {args.concurrency} clients, mix {args.mix}")
+    print_report(report)
+    if args.json:
+        report.update({'revision': git_revision(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'config': {k: v for k, v in vars(args).items() if k not in ('json', 'db')}})
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"wrote {args.json}")
+    if tmp:
+        tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Synthetic test media for the pipeline benchmarks, generated offline with
+ffmpeg's lavfi sources: a moving test pattern (testsrc, testsrc2,
+smptebars or mandelbrot) plus a sine tone, pink noise, silence or no
+audio track, at any duration, resolution, frame rate and codec.
+
+    python benchmarks/media_fixtures.py fixtures/ --duration 10,60 --resolution 640x360,1920x1080 --audio sine,noise
+
+Every combination of the comma-separated options is written once; files
+that already exist are reused.
+"""
+import os
+import sys
+import shutil
+import argparse
+import itertools
+import subprocess
+
+VIDEO_SOURCES = ('testsrc', 'testsrc2', 'smptebars', 'mandelbrot')
+AUDIO_SOURCES = {
+    'sine': 'sine=frequency=440:sample_rate={rate}',
+    'noise': 'anoisesrc=color=pink:amplitude=0.3:sample_rate={rate}',
+    'silence': 'anullsrc=channel_layout=mono:sample_rate={rate}',
+    'none': None,
+}
+# container and audio codec that go with each video codec
+CODECS = {
+    'libx264': ('mp4', 'aac'),
+    'libx265': ('mp4', 'aac'),
+    'mpeg4': ('mp4', 'aac'),
+    'libvpx-vp9': ('webm', 'libopus'),
+    'libaom-av1': ('mkv', 'libopus'),
+}
+AUDIO_RATE = 48000
+
+
+def fixture_name(duration, width, height, fps=30, codec='libx264', audio='sine', source='testsrc'):
+    ext = CODECS[codec][0]
+    return f"{source}_{width}x{height}_{fps}fps_{duration:g}s_{codec}_{audio}.{ext}"
+
+
+def ffmpeg_command(path, duration, width, height, fps=30, codec='libx264', audio='sine', source='testsrc'):
+    """The ffmpeg invocation that writes one fixture to path."""
+    if source not in VIDEO_SOURCES:
+        raise ValueError(f"unknown video source {source!r}")
+    if codec not in CODECS:
+        raise ValueError(f"unknown codec {codec!r}")
+    if audio not in AUDIO_SOURCES:
+        raise ValueError(f"unknown audio {audio!r}")
+    cmd = ['ffmpeg', '-nostdin', '-v', 'error', '-y',
+           '-f', 'lavfi', '-i', f'{source}=size={width}x{height}:rate={fps}:duration={duration:g}']
+    if AUDIO_SOURCES[audio]:
+        cmd += ['-f', 'lavfi', '-t', f'{duration:g}', '-i', AUDIO_SOURCES[audio].format(rate=AUDIO_RATE)]
+    cmd += ['-c:v', codec, '-pix_fmt', 'yuv420p']
+    if codec in ('libx264', 'libx265'):
+        cmd += ['-preset', 'veryfast']
+    if AUDIO_SOURCES[audio]:
+        cmd += ['-c:a', CODECS[codec][1], '-shortest']
+    return cmd + [path]
+
+
+def make_fixture(out_dir, duration=10, width=1280, height=720, fps=30, codec='libx264', audio='sine',
+                 source='testsrc', force=False):
+    """Write one fixture into out_dir (unless it is already there) and return its path."""
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, fixture_name(duration, width, height, fps, codec, audio, source))
+    if force or not os.path.exists(path):
+        tmp = path + '.part' + os.path.splitext(path)[1]
+        subprocess.run(ffmpeg_command(tmp, duration, width, height, fps, codec, audio, source),
+                       check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        os.replace(tmp, path)
+    return path
+
+
+def make_fixtures(out_dir, durations=(10,), resolutions=((1280, 720),), fps=(30,), codecs=('libx264',),
+                  audios=('sine',), sources=('testsrc',), force=False):
+    """Every combination of the given settings; returns [(settings dict, path)]."""
+    fixtures = []
+    for duration, (width, height), rate, codec, audio, source in itertools.product(
+            durations, resolutions, fps, codecs, audios, sources):
+        settings = {'duration': duration, 'width': width, 'height': height, 'fps': rate,
+                    'codec': codec, 'audio': audio, 'source': source}
+        fixtures.append((settings, make_fixture(out_dir, force=force, **settings)))
+    return fixtures
+
+
+def have_ffmpeg():
+    return shutil.which('ffmpeg') is not None
+
+
+def csv(cast=str):
+    return lambda spec: [cast(x.strip()) for x in spec.split(',') if x.strip()]
+
+
+def resolution(spec):
+    width, _, height = spec.lower().partition('x')
+    return int(width), int(height)
+
+
+def add_arguments(parser):
+    parser.add_argument('--duration', type=csv(float), default=[10.0], help="seconds, comma-separated")
+    parser.add_argument('--resolution', type=csv(resolution), default=[(1280, 720)], help="e.g. 640x360,1920x1080")
+    parser.add_argument('--fps', type=csv(int), default=[30])
+    parser.add_argument('--codec', type=csv(), default=['libx264'], help=f"any of {', '.join(CODECS)}")
+    parser.add_argument('--audio', type=csv(), default=['sine'], help=f"any of {', '.join(AUDIO_SOURCES)}")
+    parser.add_argument('--source', type=csv(), default=['testsrc'], help=f"any of {', '.join(VIDEO_SOURCES)}")
+
+
+def fixtures_from_args(out_dir, args, force=False):
+    return make_fixtures(out_dir, args.duration, args.resolution, args.fps, args.codec, args.audio, args.source,
+                         force=force)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('out_dir')
+    add_arguments(parser)
+    parser.add_argument('--force', action='store_true', help="regenerate files that already exist")
+    args = parser.parse_args()
+    if not have_ffmpeg():
+        sys.exit("ffmpeg was not found on PATH")
+    for settings, path in fixtures_from_args(args.out_dir, args, args.force):
+        print(f"{path}  ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
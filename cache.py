@@ -0,0 +1,281 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from markupsafe import Markup
+from flask import render_template
+from sqlalchemy import event, func, text, inspect as sa_inspect
+
+# Columns shown on a video card; a change to any of them gives the card a new key
+CARD_VIDEO_FIELDS = ('title', 'thumbnail', 'upload_date')
+CARD_USER_FIELDS = ('username', 'display_name', 'profile_pic')
+
+# Per-process LRU size for rendered fragments
+FRAGMENT_CACHE_SIZE = 4096
+# Users whose playlist membership map is kept in memory
+PLAYLIST_MAP_USERS = 2048
+# Rows kept by the shared sqlite store; older entries are pruned in batches
+SQLITE_MAX_ENTRIES = 50000
+SQLITE_PRUNE_EVERY = 500
+
+
+class LRUCache:
+    """Small thread-safe LRU map with hit/miss counters."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            return self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.hits = self.misses = 0
+
+
+class MemoryBackend:
+    """Fragments held in this process only."""
+
+    def __init__(self, maxsize=FRAGMENT_CACHE_SIZE):
+        self.lru = LRUCache(maxsize)
+
+    def get(self, key):
+        return self.lru.get(key)
+
+    def put(self, key, value):
+        self.lru.put(key, value)
+
+    def clear(self):
+        self.lru.clear()
+
+
+class SqliteBackend:
+    """
+    Fragments in a local sqlite file, shared by every worker process on the
+    host. One connection per thread; WAL so readers never wait on a writer.
+    """
+
+    def __init__(self, path, max_entries=SQLITE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.puts = 0
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS fragment (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_fragment_stored ON fragment (stored_at)")
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute("SELECT value FROM fragment WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, value):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO fragment (key, value, stored_at) VALUES (?, ?, ?)", (key, value, time.time()))
+        self.puts += 1
+        if self.puts % SQLITE_PRUNE_EVERY == 0:
+            conn.execute(
+                "DELETE FROM fragment WHERE stored_at < ("
+                "SELECT stored_at FROM fragment ORDER BY stored_at DESC LIMIT 1 OFFSET ?)", (self.max_entries,))
+
+    def clear(self):
+        self._conn().execute("DELETE FROM fragment")
+
+
+class NullBackend:
+    def get(self, key):
+        return None
+
+    def put(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+
+class FragmentCache:
+    """Rendered HTML fragments by key, over a pluggable backend, with hit/miss counters."""
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key, render):
+        try:
+            html = self.backend.get(key)
+        except Exception:
+            html = None
+        if html is not None:
+            self.hits += 1
+            return html
+        self.misses += 1
+        html = render()
+        try:
+            self.backend.put(key, html)
+        except Exception:
+            pass
+        return html
+
+    def stats(self):
+        return {'backend': type(self.backend).__name__, 'hits': self.hits, 'misses': self.misses}
+
+
+def make_backend(spec, base_dir='.'):
+    """
+    Backend from a config string: 'memory' (default), 'sqlite' or
+    'sqlite:<path>', and 'off'.
+    """
+    spec = (spec or 'memory').strip()
+    if spec == 'off':
+        return NullBackend()
+    if spec == 'sqlite' or spec.startswith('sqlite:'):
+        path = spec.partition(':')[2] or os.path.join(base_dir, 'fragment_cache.db')
+        return SqliteBackend(path)
+    return MemoryBackend()
+
+
+fragments = FragmentCache()
+
+
+def compact_count(n):
+    """1234 -> '1.2K'. Cards show this so a cached card stays exact until it changes."""
+    n = int(n or 0)
+    for div, suffix in ((1_000_000_000, 'B'), (1_000_000, 'M'), (1_000, 'K')):
+        if n >= div:
+            value = n / div
+            text = f"{value:.1f}" if value < 10 else f"{int(value)}"
+            return f"{text.rstrip('0').rstrip('.')}{suffix}"
+    return str(n)
+
+
+def video_card(video, variant='grid'):
+    """
+    Card HTML for a video, cached per variant. The key carries the video's
+    card_version (bumped on edits, thumbnail and uploader changes) and the
+    displayed view count, so a stale card is never served.
+    """
+    key = f"card:{variant}:{video.id}:{video.card_version or 0}:{compact_count(video.views)}"
+    return Markup(fragments.get_or_render(
+        key, lambda: render_template('_video_card.html', video=video, variant=variant)))
+
+
+def track_card_changes(video_model, user_model):
+    """
+    Bump Video.card_version whenever a field shown on its card changes,
+    including the uploader's name or picture, so edits never serve a stale card.
+    """
+    def changed(target, fields):
+        state = sa_inspect(target)
+        return any(state.attrs[f].history.has_changes() for f in fields)
+
+    @event.listens_for(video_model, 'before_update')
+    def _video_changed(mapper, connection, target):
+        if changed(target, CARD_VIDEO_FIELDS):
+            target.card_version = (target.card_version or 0) + 1
+
+    @event.listens_for(user_model, 'after_update')
+    def _uploader_changed(mapper, connection, target):
+        if changed(target, CARD_USER_FIELDS):
+            table = video_model.__table__
+            connection.execute(table.update().where(table.c.user_id == target.id)
+                               .values(card_version=func.coalesce(table.c.card_version, 0) + 1))
+
+
+_playlist_maps = LRUCache(PLAYLIST_MAP_USERS)
+
+
+def playlist_map(session, user_id, version=0):
+    """
+    video id -> set of the user's playlist ids containing it, built with one
+    query. Cached per (user, User.playlist_version); the version is bumped on
+    every add/remove, so a map is never reused once the caller sees the new
+    version (the watch page reads it from the identity snapshot).
+    """
+    key = (user_id, version or 0)
+    saved = _playlist_maps.get(key)
+    if saved is None:
+        saved = {}
+        rows = session.execute(text(
+            "SELECT pv.video_id, pv.playlist_id FROM playlist_video pv "
+            "JOIN playlist p ON p.id = pv.playlist_id WHERE p.user_id = :u"
+        ), {'u': user_id})
+        for video_id, playlist_id in rows:
+            saved.setdefault(video_id, set()).add(playlist_id)
+        _playlist_maps.put(key, saved)
+    return saved
+
+
+def next_playlist_version(session, user_id):
+    """
+    Increment User.playlist_version and return the new value; concurrent
+    writers each get their own version. Uses UPDATE ... RETURNING where the
+    backend has it (SQLite 3.35+, Postgres), else a SELECT in the same
+    transaction, after the UPDATE has locked the row. The caller commits.
+    """
+    bump = text('UPDATE "user" SET playlist_version = COALESCE(playlist_version, 0) + 1 WHERE id = :u')
+    if session.get_bind(clause=bump).dialect.update_returning:
+        return session.execute(text(bump.text + ' RETURNING playlist_version'), {'u': user_id}).scalar()
+    session.execute(bump, {'u': user_id})
+    return session.execute(text('SELECT playlist_version FROM "user" WHERE id = :u'), {'u': user_id}).scalar()
+
+
+def update_playlist_map(user_id, old_version, new_version, video_id, playlist_id, added):
+    """
+    Carry a cached map over to the user's new playlist_version after one
+    add/remove, so the response and the next watch page need no rebuild.
+    Only valid when new_version came from next_playlist_version and
+    old_version is new_version - 1, i.e. no other write came in between.
+    """
+    saved = _playlist_maps.get((user_id, old_version or 0))
+    if saved is None:
+        return
+    saved = {vid: set(pids) for vid, pids in saved.items()}
+    pids = saved.setdefault(video_id, set())
+    if added:
+        pids.add(playlist_id)
+    else:
+        pids.discard(playlist_id)
+        if not pids:
+            del saved[video_id]
+    _playlist_maps.put((user_id, new_version), saved)
+
+
+def init_app(app):
+    """Choose the fragment backend from app config and register the template helpers."""
+    fragments.backend = make_backend(app.config.get('FRAGMENT_CACHE'), app.root_path)
+    app.add_template_global(video_card)
+    app.add_template_filter(compact_count)
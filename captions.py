@@ -0,0 +1,358 @@
+import os
+import re
+import json
+import subprocess
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import metrics
+
+# Cue layout limits (roughly broadcast caption conventions)
+MAX_LINE_CHARS = 42
+MAX_CUE_LINES = 2
+MAX_CUE_SECONDS = 6.0
+# A pause this long between words always starts a new cue
+PAUSE_SPLIT_SECONDS = 0.8
+
+# Chunked transcription: long audio is cut near every CHUNK_TARGET_SECONDS at
+# the quietest SILENCE_WINDOW_SECONDS window within CHUNK_SEARCH_SECONDS, and
+# the chunks are recognised in parallel.
+CHUNK_TARGET_SECONDS = 60.0
+CHUNK_SEARCH_SECONDS = 10.0
+SILENCE_WINDOW_SECONDS = 0.1
+PARALLEL_MIN_SECONDS = 300.0
+
+# Audio is decoded by ffmpeg straight to mono 16 kHz signed 16-bit PCM on stdout
+PCM_RATE = 16000
+PCM_READ_BYTES = 8000  # 0.25 s
+
+# Google's recognizer is the fallback when Vosk is unavailable or hears
+# nothing; VIEWFLOW_GOOGLE_CAPTIONS=0 keeps captioning offline.
+GOOGLE_FALLBACK = os.environ.get('VIEWFLOW_GOOGLE_CAPTIONS', '1') != '0'
+
+_DURATION_RE = re.compile(r'Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)')
+
+
+def format_timestamp(x):
+    h = int(x // 3600); m = int((x % 3600) // 60); s = int(x % 60); ms = int((x - int(x)) * 1000)
+    return f"{h:02d}:{m:02d}:{s:02d}.{ms:03d}"
+
+
+def wrap_words(words, width=MAX_LINE_CHARS):
+    """Greedy line wrap of a list of words."""
+    lines = []
+    line = ''
+    for w in words:
+        if line and len(line) + 1 + len(w) > width:
+            lines.append(line)
+            line = w
+        else:
+            line = f"{line} {w}" if line else w
+    if line:
+        lines.append(line)
+    return lines
+
+
+class VttWriter:
+    """
+    Incremental WebVTT writer. Words are fed with their timings and each cue
+    is written out as soon as it is complete, so only the words of the
+    current cue are ever held in memory.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.words = []
+        self.start = None
+        self.end = None
+        self.cues = 0
+        f.write('WEBVTT\n\n')
+
+    def _fits(self, word, start):
+        if not self.words:
+            return True
+        if start - self.end > PAUSE_SPLIT_SECONDS:
+            return False
+        if start - self.start > MAX_CUE_SECONDS:
+            return False
+        return len(wrap_words(self.words + [word])) <= MAX_CUE_LINES
+
+    def add_word(self, word, start, end):
+        if not word:
+            return
+        if not self._fits(word, start):
+            self.flush()
+        if not self.words:
+            self.start = start
+        self.words.append(word)
+        self.end = max(end, start)
+
+    def add_words(self, words):
+        for w in words:
+            self.add_word(w['word'], w['start'], w['end'])
+
+    def flush(self):
+        if not self.words:
+            return
+        text = '\n'.join(wrap_words(self.words))
+        self.f.write(f"{format_timestamp(self.start)} --> {format_timestamp(self.end)}\n{text}\n\n")
+        self.cues += 1
+        self.words = []
+        self.start = self.end = None
+
+    def close(self):
+        self.flush()
+        self.f.flush()
+
+
+def result_words(result, offset=0.0):
+    """Extract timed words from a Vosk Result()/FinalResult() JSON string."""
+    try:
+        data = json.loads(result)
+    except Exception:
+        return []
+    return [
+        {'word': w.get('word', ''), 'start': w.get('start', 0.0) + offset, 'end': w.get('end', 0.0) + offset}
+        for w in data.get('result', [])
+    ]
+
+
+def transcribe_stream(rec, chunks, writer, offset=0.0):
+    """
+    Feed PCM chunks to a Vosk recognizer and write cues as each utterance
+    is finalised. Returns the number of words written.
+    """
+    rec.SetWords(True)
+    count = 0
+    for buf in chunks:
+        if rec.AcceptWaveform(buf):
+            words = result_words(rec.Result(), offset)
+            writer.add_words(words)
+            count += len(words)
+    words = result_words(rec.FinalResult(), offset)
+    writer.add_words(words)
+    return count + len(words)
+
+
+def write_uniform_cues(writer, transcript, duration):
+    """
+    Fallback for recognizers without word timings (e.g. Google): spread the
+    words evenly over the duration.
+    """
+    words = transcript.split()
+    if not words:
+        return
+    if not duration or duration <= 0:
+        duration = max(4.0, len(words) / 2.0)
+    step = duration / len(words)
+    for i, w in enumerate(words):
+        writer.add_word(w, i * step, (i + 1) * step)
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class PcmStream:
+    """
+    ffmpeg decoding a media file's audio to raw PCM on a pipe. The duration
+    is parsed from the same run's stderr header, so no separate ffprobe.
+    """
+
+    def __init__(self, src, rate=PCM_RATE):
+        self.rate = rate
+        self.duration = None
+        self._header = threading.Event()
+        self.proc = subprocess.Popen(
+            ['ffmpeg', '-nostdin', '-i', src, '-vn', '-ac', '1', '-ar', str(rate), '-f', 's16le', '-'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # stderr has to be drained or ffmpeg stalls once the pipe buffer fills
+        threading.Thread(target=self._read_stderr, daemon=True).start()
+
+    def _read_stderr(self):
+        for line in iter(self.proc.stderr.readline, b''):
+            if self.duration is None:
+                m = _DURATION_RE.search(line.decode('utf-8', 'replace'))
+                if m:
+                    self.duration = int(m.group(1)) * 3600 + int(m.group(2)) * 60 + float(m.group(3))
+                    self._header.set()
+        self._header.set()
+
+    def wait_duration(self, timeout=10):
+        self._header.wait(timeout)
+        return self.duration
+
+    def chunks(self, size=PCM_READ_BYTES):
+        while True:
+            buf = self.proc.stdout.read(size)
+            if not buf:
+                break
+            yield buf
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def quietest_cut(pcm, lo, hi, window_bytes):
+    """Byte offset of the quietest window of 16-bit PCM between lo and hi."""
+    a = np.frombuffer(bytes(pcm[lo:hi]), dtype=np.int16).astype(np.float32)
+    window = window_bytes // 2
+    n = len(a) // window
+    if n == 0:
+        return hi
+    w = a[:n * window].reshape(n, window)
+    return lo + int(np.argmin((w * w).mean(axis=1))) * window_bytes
+
+
+def split_at_silences(chunks, rate=PCM_RATE, target=CHUNK_TARGET_SECONDS,
+                      search=CHUNK_SEARCH_SECONDS, window=SILENCE_WINDOW_SECONDS):
+    """
+    Regroup a PCM byte stream into (pcm, offset_seconds) pieces of roughly
+    target seconds, cut at the quietest window within +/- search seconds.
+    Only the current piece is buffered.
+    """
+    bps = rate * 2
+    lo = int((target - search) * rate) * 2
+    hi = int((target + search) * rate) * 2
+    window_bytes = max(2, int(window * rate) * 2)
+    buf = bytearray()
+    consumed = 0
+    for c in chunks:
+        buf += c
+        while len(buf) >= hi:
+            cut = quietest_cut(buf, lo, hi, window_bytes)
+            yield bytes(buf[:cut]), consumed / bps
+            consumed += cut
+            del buf[:cut]
+    if buf:
+        yield bytes(buf), consumed / bps
+
+
+_worker_model = None
+
+
+def _init_worker(model_path):
+    global _worker_model
+    from vosk import Model
+    _worker_model = Model(model_path)
+
+
+def _transcribe_pcm(job):
+    """Pool worker: recognise one PCM piece and return its timed words."""
+    from vosk import KaldiRecognizer
+    pcm, offset, rate = job
+    rec = KaldiRecognizer(_worker_model, rate)
+    rec.SetWords(True)
+    words = []
+    for i in range(0, len(pcm), PCM_READ_BYTES):
+        if rec.AcceptWaveform(pcm[i:i + PCM_READ_BYTES]):
+            words.extend(result_words(rec.Result(), offset))
+    words.extend(result_words(rec.FinalResult(), offset))
+    return words
+
+
+def transcribe_parallel(model_path, chunks, writer, rate=PCM_RATE, workers=None):
+    """
+    Cut a PCM stream at silences, recognise the pieces in a process pool and
+    write the stitched, timed words in order. At most two pieces per worker
+    are in flight. Returns the number of words written.
+    """
+    workers = workers or available_cpus()
+    # spawn: the caller is a thread inside the web process, forking it is not safe
+    ctx = multiprocessing.get_context('spawn')
+    pending = deque()
+    count = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_init_worker, initargs=(model_path,)) as pool:
+        for pcm, offset in split_at_silences(chunks, rate):
+            pending.append(pool.submit(_transcribe_pcm, (pcm, offset, rate)))
+            while len(pending) >= workers * 2:
+                words = pending.popleft().result()
+                writer.add_words(words)
+                count += len(words)
+        while pending:
+            words = pending.popleft().result()
+            writer.add_words(words)
+            count += len(words)
+    return count
+
+
+def _transcribe_vosk(video_path, model_path, writer):
+    with PcmStream(video_path) as src:
+        with metrics.stage('audio_probe'):
+            duration = src.wait_duration()
+        if duration and duration >= PARALLEL_MIN_SECONDS and available_cpus() > 1:
+            # long upload: split at silences and recognise pieces in parallel
+            return transcribe_parallel(model_path, src.chunks(), writer)
+        from vosk import Model, KaldiRecognizer
+        rec = KaldiRecognizer(Model(model_path), PCM_RATE)
+        return transcribe_stream(rec, src.chunks(), writer)
+
+
+def _transcribe_google(video_path, writer):
+    # Google needs the whole clip in one request and gives no word timings
+    import speech_recognition as sr
+    with PcmStream(video_path) as src:
+        audio_data = sr.AudioData(b''.join(src.chunks()), PCM_RATE, 2)
+        duration = src.duration
+    transcript = sr.Recognizer().recognize_google(audio_data)
+    write_uniform_cues(writer, transcript, duration)
+    return len(transcript.split())
+
+
+def generate_auto_captions(video_path, vtt_path, model_path=None):
+    """
+    Transcribe the audio of video_path into a WebVTT file. Vosk (offline) is
+    tried first, then Google unless GOOGLE_FALLBACK is off. Cues are streamed to a .part file which is
+    moved into place only when something was recognised.
+    Returns the number of words written.
+    """
+    part_path = vtt_path + '.part'
+    written = 0
+    try:
+        with open(part_path, 'w', encoding='utf-8') as f:
+            writer = VttWriter(f)
+            if model_path and os.path.exists(model_path):
+                # audio is decoded while it is recognised, so this stage covers both
+                try:
+                    with metrics.stage('recognition') as span:
+                        written = _transcribe_vosk(video_path, model_path, writer)
+                        if not written:
+                            span.fail()
+                except Exception as e:
+                    print(f"Vosk captions error: {e}")
+                    written = 0
+            if not written and GOOGLE_FALLBACK:
+                # start over so a failed partial Vosk run does not leak into the file
+                f.seek(0)
+                f.truncate()
+                writer = VttWriter(f)
+                try:
+                    with metrics.stage('recognition_google'):
+                        written = _transcribe_google(video_path, writer)
+                except Exception:
+                    written = 0
+            with metrics.stage('vtt_write'):
+                writer.close()
+        if written:
+            os.replace(part_path, vtt_path)
+    finally:
+        if os.path.exists(part_path):
+            try:
+                os.remove(part_path)
+            except Exception:
+                pass
+    return written
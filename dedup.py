@@ -0,0 +1,274 @@
+# Duplicate upload detection. Every upload is fingerprinted early in the
+# pipeline: a SHA-256 of the file plus a 64-bit difference hash (dHash) of
+# the frames at FRAME_POSITIONS. An identical file is an exact duplicate; a
+# file whose frame hashes are within MAX_FRAME_DISTANCE bits on at least
+# MIN_MATCHING_FRAMES frames, with about the same duration, is a near
+# duplicate (a re-encode or re-mux). Flat frames (black screens, solid
+# cover art) all hash alike, so they are left out of matching.
+#
+# Frame hashes are stored split into four 16-bit bands, each indexed, and
+# candidates are the videos sharing a band with the upload at some position.
+# That lookup is best-effort recall: a frame within 3 bits always shares a
+# band, but one 4-MAX_FRAME_DISTANCE bits away only does if its differing
+# bits fall in at most three bands, so a re-encode is missed only when none
+# of its frames does. Narrower bands would cover the full distance but match
+# a large share of the table each.
+#
+# The match is visual only, so what a duplicate may reuse (see reusable())
+# depends on its kind. An exact copy has the same audio: it reuses the
+# renditions, previews and auto captions, plus the thumbnail and captions
+# when it is the uploader's own. A near duplicate by the same uploader with
+# every frame within REUSE_FRAME_DISTANCE bits takes only the previews and
+# thumbnail. Other near duplicates are only recorded
+# (video_fingerprint.duplicate_of).
+import os
+import shutil
+from datetime import datetime
+from sqlalchemy import text, bindparam, DateTime
+import metrics
+import mediapool
+
+FRAME_POSITIONS = (0.1, 0.3, 0.5, 0.7, 0.9)
+MAX_FRAME_DISTANCE = 10
+MIN_MATCHING_FRAMES = 3
+REUSE_FRAME_DISTANCE = 4
+# Frames whose 9x8 grayscale thumbnail has a lower standard deviation are flat
+MIN_FRAME_CONTRAST = 4.0
+DURATION_TOLERANCE = 0.02
+BANDS = 4
+BAND_BITS = 16
+# Near-duplicate candidates checked per upload, at most
+MAX_CANDIDATES = 200
+
+
+def dhash(frame):
+    """
+    64-bit difference hash of a BGR frame: 9x8 grayscale, one bit per
+    horizontal gradient. None for flat frames, which carry no signal.
+    """
+    import cv2
+    small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (9, 8), interpolation=cv2.INTER_AREA)
+    if small.std() < MIN_FRAME_CONTRAST:
+        return None
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value or None
+
+
+def fingerprint(video_path):
+    """
+    Content hash, stream size, duration and frame hashes of an upload (runs
+    on a media worker), one per FRAME_POSITIONS entry and None for flat
+    frames. hashes is empty when OpenCV cannot decode the file.
+    """
+    import cv2
+    import media
+    from images import content_hash
+    result = {'content_hash': content_hash(video_path), 'duration': 0.0, 'width': 0, 'height': 0, 'hashes': []}
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            return result
+        info = media.probe_capture(cap)
+        result.update(duration=info['duration'], width=info['width'], height=info['height'])
+        total = info['frame_count']
+        if total <= 0:
+            return result
+        indices = [min(total - 1, int(total * p)) for p in FRAME_POSITIONS]
+        frames = dict(media.iter_frames(cap, indices))
+        if len(frames) == len(set(indices)):
+            result['hashes'] = [dhash(frames[i]) for i in indices]
+    finally:
+        cap.release()
+    return result
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def _signed(h):
+    # SQLite integers are signed 64-bit
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+
+def _unsigned(h):
+    return h + (1 << 64) if h < 0 else h
+
+
+def _bands(h):
+    mask = (1 << BAND_BITS) - 1
+    return [(h >> (i * BAND_BITS)) & mask for i in range(BANDS)]
+
+
+def save(session, video_id, fp, duplicate_of=None, match=None):
+    """Store the fingerprint of video_id, with the duplicate found for it, if any."""
+    session.execute(text("DELETE FROM video_frame_hash WHERE video_id = :v"), {'v': video_id})
+    session.execute(text("DELETE FROM video_fingerprint WHERE video_id = :v"), {'v': video_id})
+    session.execute(text(
+        "INSERT INTO video_fingerprint (video_id, content_hash, duration, width, height, duplicate_of, match_kind, created_at) "
+        "VALUES (:v, :hash, :duration, :width, :height, :dup, :match_kind, :created_at)"
+    ).bindparams(bindparam('created_at', type_=DateTime())), {
+        'v': video_id, 'hash': fp['content_hash'], 'duration': fp['duration'], 'width': fp['width'],
+        'height': fp['height'], 'dup': duplicate_of, 'match_kind': match, 'created_at': datetime.utcnow(),
+    })
+    if any(h is not None for h in fp['hashes']):
+        session.execute(text(
+            "INSERT INTO video_frame_hash (video_id, position, hash, band0, band1, band2, band3) "
+            "VALUES (:v, :position, :hash, :b0, :b1, :b2, :b3)"
+        ), [
+            dict({f'b{i}': band for i, band in enumerate(_bands(h))}, v=video_id, position=pos, hash=_signed(h))
+            for pos, h in enumerate(fp['hashes']) if h is not None
+        ])
+    session.commit()
+
+
+def forget(session, video_id):
+    """Drop the fingerprint of a deleted video (the caller commits)."""
+    session.execute(text("DELETE FROM video_frame_hash WHERE video_id = :v"), {'v': video_id})
+    session.execute(text("DELETE FROM video_fingerprint WHERE video_id = :v"), {'v': video_id})
+
+
+def _near_candidates(session, video_id, hashes):
+    found = set()
+    for pos, h in enumerate(hashes):
+        if h is None:
+            continue
+        params = {f'b{i}': band for i, band in enumerate(_bands(h))}
+        params.update(v=video_id, position=pos, limit=MAX_CANDIDATES)
+        rows = session.execute(text(
+            "SELECT DISTINCT video_id FROM video_frame_hash WHERE position = :position AND video_id != :v "
+            "AND (band0 = :b0 OR band1 = :b1 OR band2 = :b2 OR band3 = :b3) LIMIT :limit"
+        ), params)
+        found.update(r[0] for r in rows)
+        if len(found) >= MAX_CANDIDATES:
+            break
+    return found
+
+
+def find_duplicate(session, video_id, fp):
+    """
+    (video_id, 'exact' | 'near', [frame distances]) for the closest earlier
+    upload that finished processing, or None. Distances are None where
+    either frame is flat.
+    """
+    row = session.execute(text(
+        "SELECT f.video_id FROM video_fingerprint f JOIN video v ON v.id = f.video_id "
+        "WHERE f.content_hash = :hash AND f.video_id != :v AND v.status = 'ready' ORDER BY f.video_id LIMIT 1"
+    ), {'hash': fp['content_hash'], 'v': video_id}).first()
+    if row:
+        return row[0], 'exact', [0] * len(fp['hashes'])
+    if sum(h is not None for h in fp['hashes']) < MIN_MATCHING_FRAMES:
+        return None
+
+    candidates = _near_candidates(session, video_id, fp['hashes'])
+    if not candidates:
+        return None
+    rows = session.execute(text(
+        "SELECT h.video_id, h.position, h.hash, f.duration FROM video_frame_hash h "
+        "JOIN video_fingerprint f ON f.video_id = h.video_id JOIN video v ON v.id = h.video_id "
+        "WHERE h.video_id IN :ids AND v.status = 'ready'"
+    ).bindparams(bindparam('ids', expanding=True)), {'ids': sorted(candidates)}).fetchall()
+    by_video = {}
+    for vid, pos, h, duration in rows:
+        entry = by_video.setdefault(vid, {'duration': duration, 'hashes': {}})
+        entry['hashes'][pos] = _unsigned(h)
+
+    best = None
+    for vid, entry in by_video.items():
+        if fp['duration'] and entry['duration'] and \
+                abs(entry['duration'] - fp['duration']) > DURATION_TOLERANCE * fp['duration']:
+            continue
+        distances = [hamming(h, entry['hashes'][pos]) if h is not None and pos in entry['hashes'] else None
+                     for pos, h in enumerate(fp['hashes'])]
+        close = [d for d in distances if d is not None and d <= MAX_FRAME_DISTANCE]
+        if len(close) < MIN_MATCHING_FRAMES:
+            continue
+        score = (-len(close), sum(close))
+        if best is None or score < best[0]:
+            best = (score, (vid, 'near', distances))
+    return best[1] if best else None
+
+
+def reusable(match, distances, same_uploader):
+    """Which outputs of the matched video a duplicate may take over."""
+    exact = match == 'exact'
+    # a near match compares pixels only; it says nothing about the audio
+    close = exact or (match == 'near' and all(d is None or d <= REUSE_FRAME_DISTANCE for d in distances))
+    return {
+        # carry the audio track or speech, so only an identical file shares them
+        'renditions': exact,
+        'auto_captions': exact,
+        'captions': exact and same_uploader,
+        # pictures only; custom artwork stays with its uploader
+        'previews': exact or (close and same_uploader),
+        'thumbnail': close and same_uploader,
+    }
+
+
+def detect(session, upload_dir, video_id, user_id, filename):
+    """
+    The 'dedup' stage: fingerprint upload_dir/filename and look for an earlier
+    copy. Returns (fingerprint, duplicate video id or None, reusable() dict).
+    An exact copy's uploaded file is swapped for a link to the original's.
+    """
+    with metrics.stage('dedup'):
+        fp = mediapool.fingerprint(os.path.join(upload_dir, filename))
+        found = find_duplicate(session, video_id, fp)
+        if not found:
+            save(session, video_id, fp)
+            return fp, None, reusable(None, [], False)
+        duplicate_of, match, distances = found
+        original = session.execute(text("SELECT user_id, filename FROM video WHERE id = :v"),
+                                   {'v': duplicate_of}).first()
+        save(session, video_id, fp, duplicate_of, match)
+        if match == 'exact':
+            share_source(upload_dir, original.filename, filename)
+        return fp, duplicate_of, reusable(match, distances, original.user_id == user_id)
+
+
+def link_upload(upload_dir, src, dst):
+    """Hard-link (or copy) upload_dir/src to upload_dir/dst. Returns True if dst exists afterwards."""
+    src_path, dst_path = os.path.join(upload_dir, src), os.path.join(upload_dir, dst)
+    if not os.path.exists(src_path):
+        return False
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+    try:
+        # a link shares the bytes; deleting either video leaves the other's file intact
+        os.link(src_path, dst_path)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copyfile(src_path, dst_path)
+    return True
+
+
+def share_source(upload_dir, src, dst):
+    """Replace an exact duplicate's uploaded file with a link to the original's, freeing its space."""
+    part = dst + '.link'
+    try:
+        if not link_upload(upload_dir, src, part):
+            return False
+        os.replace(os.path.join(upload_dir, part), os.path.join(upload_dir, dst))
+        return True
+    except OSError:
+        return False
+
+
+def reuse_previews(upload_dir, previews, prefix):
+    """Copy a preview sprite and its WebVTT track under a new prefix; returns the new previews dict or None."""
+    if not previews or not previews.get('sprite') or not previews.get('vtt'):
+        return None
+    sprite_name, vtt_name = f"{prefix}_sprite.jpg", f"{prefix}_sprite.vtt"
+    if not link_upload(upload_dir, previews['sprite'], sprite_name):
+        return None
+    try:
+        with open(os.path.join(upload_dir, previews['vtt']), encoding='utf-8') as f:
+            track = f.read()
+    except OSError:
+        return None
+    with open(os.path.join(upload_dir, vtt_name), 'w', encoding='utf-8') as f:
+        f.write(track.replace(previews['sprite'] + '#', sprite_name + '#'))
+    return dict(previews, sprite=sprite_name, vtt=vtt_name)
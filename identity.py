@@ -0,0 +1,60 @@
+import time
+from flask_login import UserMixin
+from cache import LRUCache
+
+# How long a logged-in user's snapshot is trusted before the row is re-read
+IDENTITY_TTL_SECONDS = 60
+IDENTITY_CACHE_SIZE = 10000
+
+# What base.html and the views read from current_user on a typical request,
+# including the watch page's playlist_version (a change in this process drops
+# the snapshot; other workers see it within the TTL). Anything else (settings
+# form, notification timestamps) loads the real User row.
+SNAPSHOT_FIELDS = ('id', 'username', 'display_name', 'profile_pic', 'notifications_enabled', 'unread_notifications',
+                   'playlist_version')
+
+
+class UserSnapshot(UserMixin):
+    """Read-only copy of the identity fields of a User, safe to share between requests."""
+
+    __slots__ = SNAPSHOT_FIELDS
+
+    def __init__(self, user):
+        for name in SNAPSHOT_FIELDS:
+            object.__setattr__(self, name, getattr(user, name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"UserSnapshot is read-only; load the User row to change {name!r}")
+
+    def __repr__(self):
+        return f"<UserSnapshot {self.id} {self.username!r}>"
+
+
+_snapshots = LRUCache(IDENTITY_CACHE_SIZE)
+
+
+def load_identity(user_id, load_row, ttl=IDENTITY_TTL_SECONDS):
+    """
+    Flask-Login user_loader body: a cached UserSnapshot for user_id, or
+    load_row(user_id) -> User (or None) on a miss or after ttl seconds.
+    """
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    now = time.monotonic()
+    entry = _snapshots.get(user_id)
+    if entry is not None and entry[1] > now:
+        return entry[0]
+    user = load_row(user_id)
+    if user is None:
+        invalidate(user_id)
+        return None
+    snap = UserSnapshot(user)
+    _snapshots.put(user_id, (snap, now + ttl))
+    return snap
+
+
+def invalidate(user_id):
+    """Drop a cached snapshot after the user's row changed in this process."""
+    _snapshots.pop(int(user_id))
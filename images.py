@@ -0,0 +1,261 @@
+# Resized variants of user-uploaded images (profile pictures and custom
+# video thumbnails). On upload a media worker writes WebP copies scaled so
+# their shorter side is each of VARIANT_SIZES[kind] pixels, named by the
+# content hash of the original, and records them in image_variant. The
+# image_url(path, px) template helper then serves the smallest variant that
+# still covers px CSS pixels at IMAGE_DENSITY, falling back to the original.
+# `python images.py backfill` processes images uploaded before this existed.
+import os
+import time
+import hashlib
+import threading
+from datetime import datetime
+from flask import url_for
+from sqlalchemy import text, bindparam, DateTime
+import cache
+import metrics
+import mediapool
+
+# Shorter-side pixel sizes per kind of image
+VARIANT_SIZES = {
+    'avatar': (48, 96, 320),
+    'thumbnail': (90, 180, 360),
+}
+VARIANTS_DIR = 'variants'
+# 'webp' (default) or 'jpg'; workers fall back to jpg if OpenCV cannot write WebP
+IMAGE_FORMAT = os.environ.get('VIEWFLOW_IMAGE_FORMAT', 'webp')
+IMAGE_QUALITY = 82
+# Device pixels per CSS pixel to provide for (2 keeps avatars sharp on HiDPI screens)
+IMAGE_DENSITY = 2
+# Variant lists kept per process; images without variants are re-checked after MISS_TTL_SECONDS
+VARIANT_CACHE_SIZE = 8192
+MISS_TTL_SECONDS = 60
+
+
+def content_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _is_jpeg(path):
+    with open(path, 'rb') as f:
+        return f.read(3) == b'\xff\xd8\xff'
+
+
+def _load(path, keep_alpha):
+    import cv2
+    import numpy as np
+    # IMREAD_COLOR applies the EXIF orientation of phone photos; JPEGs have
+    # no alpha, so they need nothing else
+    if _is_jpeg(path):
+        return cv2.imread(path, cv2.IMREAD_COLOR)
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None or img.dtype != np.uint8 or img.ndim != 3:
+        # grayscale, 16-bit or undecodable: let IMREAD_COLOR convert it
+        return cv2.imread(path, cv2.IMREAD_COLOR)
+    if img.shape[2] == 4:
+        if keep_alpha:
+            return img
+        # flatten transparency onto white for JPEG
+        alpha = img[:, :, 3:4].astype(np.float32) / 255.0
+        return (img[:, :, :3] * alpha + 255.0 * (1.0 - alpha)).astype(np.uint8)
+    return img
+
+
+def make_variants(upload_dir, source, sizes):
+    """
+    Write the variants of upload_dir/source (runs on a media worker). Never
+    upscales: sizes at or above the image's shorter side are replaced by one
+    variant at its own size. Returns {'hash', 'format', 'variants': [...]},
+    or None when OpenCV cannot decode the file (e.g. GIF), so the original
+    keeps being served.
+    """
+    import cv2
+    path = os.path.join(upload_dir, source)
+    ext = 'webp' if IMAGE_FORMAT == 'webp' and cv2.haveImageWriter('x.webp') else 'jpg'
+    img = _load(path, keep_alpha=ext == 'webp')
+    if img is None:
+        return None
+    digest = content_hash(path)
+    height, width = img.shape[:2]
+    short = min(width, height)
+    targets = [s for s in sizes if s < short]
+    if short < max(sizes):
+        targets.append(short)
+    params = [cv2.IMWRITE_WEBP_QUALITY, IMAGE_QUALITY] if ext == 'webp' else [cv2.IMWRITE_JPEG_QUALITY, IMAGE_QUALITY]
+
+    os.makedirs(os.path.join(upload_dir, VARIANTS_DIR), exist_ok=True)
+    variants = []
+    for size in targets:
+        w, h = max(1, round(width * size / short)), max(1, round(height * size / short))
+        name = f"{VARIANTS_DIR}/{digest[:24]}_{size}.{ext}"
+        full = os.path.join(upload_dir, name)
+        # the same picture uploaded again reuses the files already written
+        if not os.path.exists(full):
+            resized = img if size == short else cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+            part = os.path.join(upload_dir, f"{VARIANTS_DIR}/{digest[:24]}_{size}.part.{ext}")
+            if not cv2.imwrite(part, resized, params):
+                continue
+            os.replace(part, full)
+        variants.append({'size': size, 'width': w, 'height': h, 'filename': name, 'bytes': os.path.getsize(full)})
+    return {'hash': digest, 'format': ext, 'variants': variants}
+
+
+def save_variants(session, source, result):
+    """Replace the image_variant rows of source and bump the cards that show it."""
+    session.execute(text("DELETE FROM image_variant WHERE source = :source"), {'source': source})
+    now = datetime.utcnow()
+    if result['variants']:
+        session.execute(text(
+            "INSERT INTO image_variant (source, content_hash, size, width, height, format, filename, bytes, created_at) "
+            "VALUES (:source, :hash, :size, :width, :height, :format, :filename, :bytes, :created_at)"
+        ).bindparams(bindparam('created_at', type_=DateTime())), [
+            dict(v, source=source, hash=result['hash'], format=result['format'], created_at=now)
+            for v in result['variants']
+        ])
+    # cached video cards embed the image URL; a new card_version re-renders them
+    session.execute(text(
+        "UPDATE video SET card_version = COALESCE(card_version, 0) + 1 "
+        "WHERE thumbnail = :source OR user_id IN (SELECT id FROM \"user\" WHERE profile_pic = :source)"
+    ), {'source': source})
+    session.commit()
+    _variants.pop(source)
+
+
+def release(session, source):
+    """
+    Drop the image_variant rows of source once no user or video refers to
+    it any more (call after the change that replaced or deleted it). Returns
+    the variant files no other source shares, for delete_files() once the
+    caller has committed.
+    """
+    if not source:
+        return []
+    in_use = session.execute(text(
+        'SELECT 1 FROM "user" WHERE profile_pic = :source UNION ALL SELECT 1 FROM video WHERE thumbnail = :source'
+    ), {'source': source}).first()
+    if in_use:
+        return []
+    files = session.execute(text("SELECT filename FROM image_variant WHERE source = :source"),
+                            {'source': source}).scalars().all()
+    session.execute(text("DELETE FROM image_variant WHERE source = :source"), {'source': source})
+    _variants.pop(source)
+    if not files:
+        return []
+    # variants are named by content hash, so the same picture elsewhere shares them
+    shared = set(session.execute(text(
+        "SELECT filename FROM image_variant WHERE filename IN :files"
+    ).bindparams(bindparam('files', expanding=True)), {'files': files}).scalars())
+    return [f for f in files if f not in shared]
+
+
+def delete_files(upload_dir, filenames):
+    for name in filenames:
+        try:
+            os.remove(os.path.join(upload_dir, name))
+        except OSError:
+            pass
+
+
+def generate(app, db, source, kind):
+    """Make and record the variants of one uploaded image (call inside an app context)."""
+    with metrics.stage('image_variants') as span:
+        result = mediapool.make_image_variants(app.config['UPLOAD_FOLDER'], source, VARIANT_SIZES[kind])
+        if result is None:
+            span.fail()
+            return None
+        save_variants(db.session, source, result)
+    return result
+
+
+def _generate_in_background(app, db, source, kind):
+    with app.app_context():
+        try:
+            generate(app, db, source, kind)
+        except Exception as e:
+            print(f"Image variant error: {e}")
+            metrics.error('image_variants', e)
+            db.session.rollback()
+
+
+def generate_async(app, db, source, kind):
+    """Start generate() on a background thread so the upload request returns at once."""
+    if not source:
+        return None
+    thread = threading.Thread(target=_generate_in_background, args=(app, db, source, kind))
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+_variants = cache.LRUCache(VARIANT_CACHE_SIZE)
+
+
+def variants_for(session, source):
+    """[(size, filename)] of source, smallest first; cached per process."""
+    saved = _variants.get(source)
+    if saved is not None and (saved[0] is None or saved[0] > time.time()):
+        return saved[1]
+    rows = session.execute(text(
+        "SELECT size, filename FROM image_variant WHERE source = :source ORDER BY size"
+    ), {'source': source}).fetchall()
+    found = [(r.size, r.filename) for r in rows]
+    _variants.put(source, (None if found else time.time() + MISS_TTL_SECONDS, found))
+    return found
+
+
+def pick(variants, px, density=IMAGE_DENSITY):
+    """Filename of the smallest variant covering px CSS pixels, else the largest; None if there are none."""
+    if not variants:
+        return None
+    want = px * density
+    for size, filename in variants:
+        if size >= want:
+            return filename
+    return variants[-1][1]
+
+
+def init_app(app, db):
+    """Register the image_url(path, px) template helper."""
+    def image_url(path, px):
+        filename = None
+        try:
+            filename = pick(variants_for(db.session, path), px)
+        except Exception:
+            pass
+        return url_for('main.uploaded_file', filename=filename or path)
+
+    app.add_template_global(image_url)
+
+
+def backfill(app, db, user_model, video_model):
+    """Generate variants for profile pictures and custom thumbnails that have none."""
+    with app.app_context():
+        done = {r[0] for r in db.session.execute(text("SELECT DISTINCT source FROM image_variant"))}
+        jobs = [(u.profile_pic, 'avatar') for u in user_model.query.filter(user_model.profile_pic.isnot(None))]
+        jobs += [(v.thumbnail, 'thumbnail') for v in video_model.query.filter(video_model.thumbnail.isnot(None))]
+        count = 0
+        for source, kind in dict(jobs).items():
+            if source in done or not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], source)):
+                continue
+            if generate(app, db, source, kind):
+                count += 1
+        return count
+
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:2] != ['backfill']:
+        sys.exit("usage: python images.py backfill [app]")
+    if sys.argv[2:3] == ['app']:
+        import app as app_module
+        from models import db, User, Video
+        flask_app = app_module.create_app()
+    else:
+        import test
+        flask_app, db, User, Video = test.app, test.db, test.User, test.Video
+    print(f"generated variants for {backfill(flask_app, db, User, Video)} images")
+    mediapool.shutdown()
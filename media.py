@@ -0,0 +1,239 @@
+import os
+import time
+import cv2
+import numpy as np
+import metrics
+
+# Thumbnail / preview sizes used across the site
+THUMB_SIZE = (320, 180)
+PREVIEW_SIZE = (160, 90)
+PREVIEW_COUNT = 10
+SPRITE_COLUMNS = 5
+
+# Thumbnail selection: candidates are scored on small grayscale copies and
+# sampling stops once the per-video CPU budget is spent.
+THUMB_CANDIDATES = 24
+THUMB_BUDGET_SECONDS = 2.0
+SCORE_SIZE = (64, 36)
+
+# Walking forward with grab() is cheaper than a seek for short gaps, but a
+# two-hour video should not be decoded end to end just to reach a preview.
+SEEK_GAP_FRAMES = 300
+
+
+def probe_capture(cap):
+    """Return basic stream info for an opened capture."""
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    return {
+        'frame_count': frame_count,
+        'fps': fps,
+        'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 0),
+        'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 0),
+        'duration': (frame_count / fps) if fps > 0 else 0.0,
+    }
+
+
+def iter_frames(cap, frame_indices):
+    """
+    Yield (index, frame) for the requested frame indices in increasing order.
+    Frames are reached by grabbing forward; a seek is only issued when the
+    next wanted frame is more than SEEK_GAP_FRAMES away.
+    """
+    wanted = sorted(set(i for i in frame_indices if i >= 0))
+    pos = 0
+    for idx in wanted:
+        if idx - pos > SEEK_GAP_FRAMES:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+            pos = idx
+        while pos < idx:
+            if not cap.grab():
+                return
+            pos += 1
+        ret, frame = cap.read()
+        if not ret:
+            return
+        pos += 1
+        yield idx, frame
+
+
+def extract_frames(video_path, frame_indices, size=None):
+    """Open the video once and return a list of (index, frame) pairs, resized to size if given."""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            return []
+        if size:
+            return [(idx, cv2.resize(frame, size, interpolation=cv2.INTER_AREA))
+                    for idx, frame in iter_frames(cap, frame_indices)]
+        return list(iter_frames(cap, frame_indices))
+    finally:
+        cap.release()
+
+
+def preview_indices(frame_count, count=PREVIEW_COUNT):
+    return [int(frame_count * (i / count)) for i in range(count)]
+
+
+def thumbnail_candidates(frame_count, count=THUMB_CANDIDATES):
+    # Evenly spaced candidates, avoiding the first and last 10%
+    start_frame = int(frame_count * 0.1)
+    end_frame = int(frame_count * 0.9)
+    if end_frame <= start_frame:
+        return [frame_count // 2]
+    step = (end_frame - start_frame) / count
+    return [int(start_frame + step * (i + 0.5)) for i in range(count)]
+
+
+def score_frames(smalls):
+    """
+    Score a stack of small grayscale frames (N x H x W), higher is better.
+    Combines Laplacian sharpness, contrast and mid-range brightness;
+    black, blown-out and near-uniform frames score -1.
+    """
+    g = np.asarray(smalls, dtype=np.float32)
+    brightness = g.mean(axis=(1, 2))
+    contrast = g.std(axis=(1, 2))
+    lap = (4 * g[:, 1:-1, 1:-1] - g[:, :-2, 1:-1] - g[:, 2:, 1:-1]
+           - g[:, 1:-1, :-2] - g[:, 1:-1, 2:])
+    sharpness = lap.var(axis=(1, 2))
+    score = (0.5 * sharpness / (sharpness.max() + 1e-6)
+             + 0.35 * contrast / (contrast.max() + 1e-6)
+             + 0.15 * (1.0 - np.abs(brightness - 128.0) / 128.0))
+    unusable = (brightness < 16) | (brightness > 240) | (contrast < 6)
+    return np.where(unusable, -1.0, score)
+
+
+class ThumbnailPicker:
+    """Collects candidate frames until the time budget runs out, then picks the best."""
+
+    def __init__(self, budget=THUMB_BUDGET_SECONDS):
+        self.deadline = time.monotonic() + budget
+        self.thumbs = []
+        self.smalls = []
+
+    def offer(self, frame):
+        # Always keep the first candidate so there is something to fall back on
+        if self.thumbs and time.monotonic() > self.deadline:
+            return
+        thumb = cv2.resize(frame, THUMB_SIZE, interpolation=cv2.INTER_AREA)
+        small = cv2.resize(thumb, SCORE_SIZE, interpolation=cv2.INTER_AREA)
+        self.thumbs.append(thumb)
+        self.smalls.append(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY))
+
+    def best(self):
+        if not self.thumbs:
+            return None
+        return self.thumbs[int(np.argmax(score_frames(self.smalls)))]
+
+
+def select_thumbnail(video_path, output_path, budget=THUMB_BUDGET_SECONDS):
+    """Write the best-scoring candidate frame as the thumbnail. Returns True on success."""
+    picker = ThumbnailPicker(budget)
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            return False
+        total = probe_capture(cap)['frame_count']
+        if total <= 0:
+            return False
+        for _, frame in iter_frames(cap, thumbnail_candidates(total)):
+            picker.offer(frame)
+            if time.monotonic() > picker.deadline:
+                break
+    finally:
+        cap.release()
+    best = picker.best()
+    return best is not None and cv2.imwrite(output_path, best)
+
+
+def make_sprite(frames, output_path, tile=PREVIEW_SIZE, columns=SPRITE_COLUMNS):
+    """Tile frames (in order) into a single JPEG sprite sheet."""
+    if not frames:
+        return False
+    w, h = tile
+    rows = (len(frames) + columns - 1) // columns
+    sheet = np.zeros((rows * h, columns * w, 3), dtype=np.uint8)
+    for n, frame in enumerate(frames):
+        r, c = divmod(n, columns)
+        sheet[r * h:(r + 1) * h, c * w:(c + 1) * w] = cv2.resize(frame, tile)
+    return cv2.imwrite(output_path, sheet)
+
+
+def _vtt_time(x):
+    h = int(x // 3600); m = int((x % 3600) // 60); s = int(x % 60); ms = int((x - int(x)) * 1000)
+    return f"{h:02d}:{m:02d}:{s:02d}.{ms:03d}"
+
+
+def write_sprite_vtt(output_path, sprite_name, count, duration, tile=PREVIEW_SIZE, columns=SPRITE_COLUMNS):
+    """Write a WebVTT thumbnail track pointing at tiles of the sprite sheet."""
+    w, h = tile
+    step = duration / count if duration > 0 else 0
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write('WEBVTT\n\n')
+        for n in range(count):
+            r, c = divmod(n, columns)
+            f.write(f"{_vtt_time(n * step)} --> {_vtt_time((n + 1) * step)}\n")
+            f.write(f"{sprite_name}#xywh={c * w},{r * h},{w},{h}\n\n")
+
+
+def generate_previews(video_path, output_dir, prefix, thumbnail=True, count=PREVIEW_COUNT):
+    """
+    Single decode pass over the upload: thumbnail, source height and a
+    preview sprite sheet with its WebVTT track.
+    Returns a dict with 'height', 'thumbnail' (filename or None) and
+    'previews' (sprite metadata or None).
+    """
+    result = {'height': 0, 'thumbnail': None, 'previews': None}
+    cap = cv2.VideoCapture(video_path)
+    try:
+        with metrics.stage('probe') as span:
+            if not cap.isOpened():
+                span.fail()
+                return result
+            info = probe_capture(cap)
+            result['height'] = info['height']
+            total = info['frame_count']
+            if total <= 0:
+                span.fail()
+                return result
+
+        p_idx = preview_indices(total, count)
+        t_idx = set(thumbnail_candidates(total)) if thumbnail else set()
+        picker = ThumbnailPicker()
+        tiles = []
+        with metrics.stage('decode'):
+            for idx, frame in iter_frames(cap, p_idx + list(t_idx)):
+                if idx in t_idx:
+                    picker.offer(frame)
+                if idx in p_idx:
+                    tiles.extend([cv2.resize(frame, PREVIEW_SIZE)] * p_idx.count(idx))
+    finally:
+        cap.release()
+
+    if thumbnail:
+        with metrics.stage('thumbnail') as span:
+            best = picker.best()
+            thumb_name = f"{prefix}_thumb.jpg"
+            if best is not None and cv2.imwrite(os.path.join(output_dir, thumb_name), best):
+                result['thumbnail'] = thumb_name
+            else:
+                span.fail()
+
+    if tiles:
+        with metrics.stage('previews') as span:
+            sprite_name = f"{prefix}_sprite.jpg"
+            vtt_name = f"{prefix}_sprite.vtt"
+            if make_sprite(tiles, os.path.join(output_dir, sprite_name)):
+                write_sprite_vtt(os.path.join(output_dir, vtt_name), sprite_name, len(tiles), info['duration'])
+                result['previews'] = {
+                    'sprite': sprite_name,
+                    'vtt': vtt_name,
+                    'count': len(tiles),
+                    'columns': SPRITE_COLUMNS,
+                    'width': PREVIEW_SIZE[0],
+                    'height': PREVIEW_SIZE[1],
+                }
+            else:
+                span.fail()
+    return result
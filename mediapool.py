@@ -0,0 +1,104 @@
+# OpenCV work for uploads (frames, thumbnails, sprites, image variants,
+# duplicate fingerprints) runs in a small pool of worker processes rather
+# than in threads of the web process, so decoded frames and OpenCV's buffers
+# never sit in the address space that serves requests. At most MEDIA_WORKERS
+# jobs run at once (others wait in the pool's queue) and each worker is
+# replaced after MEDIA_TASKS_PER_CHILD jobs so its memory is handed back.
+# VIEWFLOW_MEDIA_WORKERS=0 runs the jobs inline instead.
+import os
+import sys
+import time
+import importlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import metrics
+
+MEDIA_WORKERS = int(os.environ.get('VIEWFLOW_MEDIA_WORKERS', min(2, os.cpu_count() or 1)))
+MEDIA_TASKS_PER_CHILD = int(os.environ.get('VIEWFLOW_MEDIA_TASKS_PER_CHILD', 20))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            options = {'max_workers': MEDIA_WORKERS, 'mp_context': multiprocessing.get_context('spawn')}
+            if sys.version_info >= (3, 11):
+                options['max_tasks_per_child'] = MEDIA_TASKS_PER_CHILD
+            _pool = ProcessPoolExecutor(**options)
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+def _job(module, name, args, kwargs):
+    # runs in the worker; stages recorded here travel back with the result
+    fn = getattr(importlib.import_module(module), name)
+    cpu = time.thread_time()
+    with metrics.trace(None) as spans:
+        result = fn(*args, **kwargs)
+    return result, spans, time.thread_time() - cpu
+
+
+def _run(module, name, *args, **kwargs):
+    if MEDIA_WORKERS <= 0:
+        return getattr(importlib.import_module(module), name)(*args, **kwargs)
+    pool = _get_pool()
+    try:
+        result, spans, cpu = pool.submit(_job, module, name, args, kwargs).result()
+    except BrokenProcessPool:
+        # a worker died (e.g. killed for memory); start a fresh pool next time
+        _discard_pool(pool)
+        raise
+    metrics.record_spans(spans)
+    metrics.add_cpu(cpu)
+    return result
+
+
+def extract_frames(video_path, frame_indices, size=None):
+    """
+    [(index, frame)] for the given frame indices, resized to size (w, h)
+    when given. Full-size frames are costly to send back; prefer a size.
+    """
+    return _run('media', 'extract_frames', video_path, frame_indices, size=size)
+
+
+def make_thumbnail(video_path, output_path):
+    """Write the best-scoring candidate frame of the video as a JPEG. Returns True on success."""
+    return _run('media', 'select_thumbnail', video_path, output_path)
+
+
+def make_sprite(video_path, output_dir, prefix, thumbnail=True):
+    """
+    Preview sprite sheet and WebVTT track, plus the thumbnail when asked,
+    from one decode pass (media.generate_previews); returns its result dict.
+    """
+    return _run('media', 'generate_previews', video_path, output_dir, prefix, thumbnail=thumbnail)
+
+
+def make_image_variants(upload_dir, source, sizes):
+    """Resized copies of an uploaded image (images.make_variants); returns its result dict."""
+    return _run('images', 'make_variants', upload_dir, source, sizes)
+
+
+def fingerprint(video_path):
+    """Content hash, stream info and sampled frame hashes of an upload (dedup.fingerprint)."""
+    return _run('dedup', 'fingerprint', video_path)
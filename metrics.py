@@ -0,0 +1,394 @@
+# Request and query instrumentation, exported at /metrics in the Prometheus
+# text format. Each worker process keeps its own numbers, so scrape every
+# worker (or run one). /metrics is only served when VIEWFLOW_METRICS_TOKEN is
+# set, to requests sending it as a bearer token. VIEWFLOW_METRICS=0 installs
+# nothing; VIEWFLOW_METRICS_LOG=json also logs one JSON line per request (and
+# per slow statement, with its full SQL) to the 'viewflow.requests' logger.
+# Upload processing stages are timed with trace()/stage(), exported here
+# and stored per video in video_stage_timing (`python metrics.py stages`).
+import os
+import re
+import hmac
+import json
+import hashlib
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+from flask import g, request, has_request_context, Response, abort
+from sqlalchemy import event, text, bindparam, DateTime
+
+METRICS_ENABLED = os.environ.get('VIEWFLOW_METRICS', '1') != '0'
+METRICS_LOG_JSON = os.environ.get('VIEWFLOW_METRICS_LOG') == 'json'
+# Bearer token a scraper must send to read /metrics; unset keeps the route off
+METRICS_TOKEN = os.environ.get('VIEWFLOW_METRICS_TOKEN')
+# Statements slower than this are kept (most recent SLOW_QUERY_SAMPLES) and exported,
+# labelled by a short hash of their text
+SLOW_QUERY_MS = float(os.environ.get('VIEWFLOW_SLOW_QUERY_MS', 100))
+SLOW_QUERY_SAMPLES = 20
+# Stage name for the whole time from upload to status 'ready'
+UPLOAD_TO_READY = 'upload_to_ready'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upload processing stages run from milliseconds (probe) to many minutes (transcodes)
+STAGE_BUCKETS = (0.05, 0.25, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+log = logging.getLogger('viewflow.requests')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # labels -> [bucket counts..., count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self.lock:
+            s = self.series.get(labels)
+            if s is None:
+                s = self.series[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    s[i] += 1
+            s[-2] += 1
+            s[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        names = self.labelnames + ('le',)
+        for labels, s in sorted(self.series.items()):
+            for bound, count in zip(self.buckets, s):
+                yield f"{self.name}_bucket{_labels(names, labels + (bound,))} {count}"
+            yield f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {s[-2]}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {s[-2]}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {s[-1]:.6f}"
+
+
+request_seconds = Histogram('viewflow_request_seconds', 'Request latency by endpoint.', ('endpoint', 'method', 'status'))
+request_queries = Histogram('viewflow_request_queries', 'SQL statements per request.', ('endpoint',), QUERY_COUNT_BUCKETS)
+request_query_seconds = Histogram('viewflow_request_query_seconds', 'Time spent in SQL per request.', ('endpoint',))
+query_seconds = Histogram('viewflow_db_query_seconds', 'SQL statement latency.')
+errors = Counter('viewflow_errors_total', 'Exceptions caught and logged by the app.', ('where',))
+stage_seconds = Histogram('viewflow_pipeline_stage_seconds', 'Upload processing stage duration.', ('stage',), STAGE_BUCKETS)
+stage_outcomes = Counter('viewflow_pipeline_stage_total', 'Upload processing stages by outcome.', ('stage', 'outcome'))
+_registry = [request_seconds, request_queries, request_query_seconds, query_seconds, errors,
+             stage_seconds, stage_outcomes]
+
+_slow = deque(maxlen=SLOW_QUERY_SAMPLES)
+_WS_RE = re.compile(r'\s+')
+
+
+def register(metric):
+    """Add a Counter or Histogram to the /metrics output."""
+    _registry.append(metric)
+    return metric
+
+
+def error(where, exc=None):
+    """Count an exception the caller handles itself (and log it when JSON logging is on)."""
+    if not METRICS_ENABLED:
+        return
+    errors.inc(where)
+    if METRICS_LOG_JSON:
+        log.info(json.dumps({'event': 'error', 'where': where, 'error': repr(exc)}))
+
+
+def slow_queries():
+    """Most recent slow statements as (seconds, query hash, statement, endpoint), newest last."""
+    return list(_slow)
+
+
+def query_hash(statement):
+    """Short stable name for a SQL statement, used as its label on /metrics."""
+    return hashlib.sha1(statement.encode('utf-8')).hexdigest()[:12]
+
+
+class Span:
+    """
+    One timed stage; outcome is 'ok', 'failed' (see fail()) or 'error'
+    (raised). cpu_seconds is the CPU time of the thread that ran the stage,
+    plus media pool jobs it waited on (add_cpu) and subprocesses such as
+    ffmpeg that finished within it. Subprocess time is process-wide: a
+    child of another thread that exits meanwhile is counted too.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = datetime.utcnow()
+        self.seconds = None
+        self.cpu_seconds = None
+        self.outcome = 'ok'
+
+    def fail(self):
+        self.outcome = 'failed'
+
+
+_local = threading.local()
+
+
+def _cpu_seconds():
+    # thread_time keeps concurrent requests and pipeline threads out of the figure
+    total = time.thread_time() + getattr(_local, 'offloaded_cpu', 0.0)
+    if resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        total += children.ru_utime + children.ru_stime
+    return total
+
+
+def add_cpu(seconds):
+    """Charge CPU time spent in another process on this thread's behalf (e.g. a media pool job)."""
+    _local.offloaded_cpu = getattr(_local, 'offloaded_cpu', 0.0) + seconds
+
+
+@contextmanager
+def trace(video_id, session=None):
+    """
+    Collect the stages run by this thread for video_id. With a session, the
+    spans are written to video_stage_timing when the block ends. An
+    enclosing trace also receives them.
+    """
+    spans = []
+    outer = getattr(_local, 'spans', None)
+    _local.spans = spans
+    try:
+        yield spans
+    finally:
+        _local.spans = outer
+        if outer is not None:
+            outer.extend(spans)
+        if session is not None and spans:
+            try:
+                save_spans(session, video_id, spans)
+            except Exception as e:
+                print(f"Stage timing save error: {e}")
+                session.rollback()
+
+
+@contextmanager
+def stage(name):
+    """Time a processing stage: histogram, outcome counter and the current trace, if any."""
+    span = Span(name)
+    start, cpu_start = time.perf_counter(), _cpu_seconds()
+    try:
+        yield span
+    except BaseException:
+        span.outcome = 'error'
+        raise
+    finally:
+        span.seconds = time.perf_counter() - start
+        span.cpu_seconds = _cpu_seconds() - cpu_start
+        _record(span)
+
+
+def _record(span):
+    if METRICS_ENABLED:
+        stage_seconds.observe(span.seconds, span.name)
+        stage_outcomes.inc(span.name, span.outcome)
+    spans = getattr(_local, 'spans', None)
+    if spans is not None:
+        spans.append(span)
+
+
+def record_stage(name, seconds, outcome='ok'):
+    """Add a stage measured elsewhere (e.g. upload-to-ready) to the metrics and current trace."""
+    span = Span(name)
+    span.seconds = seconds
+    span.outcome = outcome
+    _record(span)
+    return span
+
+
+def record_spans(spans):
+    """Add spans timed in another process (e.g. a media worker) to the metrics and current trace."""
+    for span in spans:
+        _record(span)
+
+
+def save_spans(session, video_id, spans):
+    session.execute(text(
+        "INSERT INTO video_stage_timing (video_id, stage, seconds, outcome, started_at) "
+        "VALUES (:v, :stage, :seconds, :outcome, :started_at)"
+    ).bindparams(bindparam('started_at', type_=DateTime())), [
+        {'v': video_id, 'stage': s.name, 'seconds': s.seconds, 'outcome': s.outcome, 'started_at': s.started_at}
+        for s in spans
+    ])
+    session.commit()
+
+
+def stage_breakdown(session, since=None):
+    """
+    Per stage over persisted timings: runs, failures, mean and max seconds,
+    and share of the total time, largest share first.
+    """
+    where = "WHERE started_at >= :since" if since else ""
+    stmt = text(
+        "SELECT stage, COUNT(*) AS runs, SUM(CASE WHEN outcome = 'ok' THEN 0 ELSE 1 END) AS failures, "
+        f"AVG(seconds) AS mean, MAX(seconds) AS max, SUM(seconds) AS total FROM video_stage_timing {where} "
+        "GROUP BY stage ORDER BY total DESC")
+    params = {}
+    if since:
+        stmt = stmt.bindparams(bindparam('since', type_=DateTime()))
+        params['since'] = since
+    rows = session.execute(stmt, params).fetchall()
+    # upload_to_ready spans the others, so it is left out of the shares
+    grand = sum(r.total for r in rows if r.stage != UPLOAD_TO_READY) or 1
+    return [
+        {'stage': r.stage, 'runs': r.runs, 'failures': r.failures, 'mean': r.mean, 'max': r.max,
+         'share': None if r.stage == UPLOAD_TO_READY else r.total / grand}
+        for r in rows
+    ]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    query_seconds.observe(elapsed)
+    endpoint = None
+    if has_request_context():
+        stats = g.get('_metrics')
+        if stats is not None:
+            stats['queries'] += 1
+            stats['query_seconds'] += elapsed
+        endpoint = request.endpoint
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        statement = _WS_RE.sub(' ', statement).strip()
+        digest = query_hash(statement)
+        _slow.append((elapsed, digest, statement[:200], endpoint or '-'))
+        if METRICS_LOG_JSON:
+            log.info(json.dumps({'event': 'slow_query', 'query': digest, 'endpoint': endpoint or '-',
+                                 'ms': round(elapsed * 1000, 2), 'statement': statement}))
+
+
+def instrument_engine(engine):
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _before_request():
+    g._metrics = {'start': time.perf_counter(), 'queries': 0, 'query_seconds': 0.0}
+
+
+def _after_request(response):
+    stats = g.pop('_metrics', None)
+    if stats is None:
+        return response
+    elapsed = time.perf_counter() - stats['start']
+    endpoint = request.endpoint or 'unknown'
+    request_seconds.observe(elapsed, endpoint, request.method, str(response.status_code))
+    request_queries.observe(stats['queries'], endpoint)
+    request_query_seconds.observe(stats['query_seconds'], endpoint)
+    if METRICS_LOG_JSON:
+        log.info(json.dumps({
+            'event': 'request', 'endpoint': endpoint, 'method': request.method, 'path': request.path,
+            'status': response.status_code, 'ms': round(elapsed * 1000, 2),
+            'queries': stats['queries'], 'query_ms': round(stats['query_seconds'] * 1000, 2),
+        }))
+    return response
+
+
+def render():
+    """All registered metrics plus cache stats and slow-query samples, Prometheus text format."""
+    lines = []
+    for metric in _registry:
+        with metric.lock:
+            lines.extend(metric.render())
+    try:
+        import cache
+        stats = cache.fragments.stats()
+        lines.append("# TYPE viewflow_fragment_cache_requests_total counter")
+        lines.append(f'viewflow_fragment_cache_requests_total{{result="hit"}} {stats["hits"]}')
+        lines.append(f'viewflow_fragment_cache_requests_total{{result="miss"}} {stats["misses"]}')
+    except Exception:
+        pass
+    lines.append("# HELP viewflow_db_slow_query_seconds Recent statements slower than the slow-query threshold.")
+    lines.append("# TYPE viewflow_db_slow_query_seconds gauge")
+    for i, (seconds, digest, _, endpoint) in enumerate(slow_queries()):
+        labels = _labels(('sample', 'endpoint', 'query'), (i, endpoint, digest))
+        lines.append(f"viewflow_db_slow_query_seconds{labels} {seconds:.6f}")
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view():
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied.encode('utf-8'), f'Bearer {METRICS_TOKEN}'.encode('utf-8')):
+        abort(401)
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app, db):
+    """
+    Hook request and query timing into app, unless disabled, and expose
+    /metrics when METRICS_TOKEN is set.
+    """
+    if not METRICS_ENABLED:
+        return
+    if METRICS_LOG_JSON and not log.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+    with app.app_context():
+        for engine in db.engines.values():
+            instrument_engine(engine)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    if METRICS_TOKEN:
+        app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+
+if __name__ == '__main__':
+    import sys
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    import database
+    if sys.argv[1:] != ['stages']:
+        sys.exit("usage: python metrics.py stages")
+    engine = create_engine(database.database_uri(os.path.dirname(os.path.abspath(__file__))))
+    with Session(engine) as session:
+        print(f"{'stage':24s} {'runs':>6s} {'failed':>6s} {'mean s':>9s} {'max s':>9s} {'share':>6s}")
+        for row in stage_breakdown(session):
+            share = '' if row['share'] is None else f"{row['share'] * 100:5.1f}%"
+            print(f"{row['stage']:24s} {row['runs']:6d} {row['failures']:6d} {row['mean']:9.3f} {row['max']:9.3f} {share:>6s}")
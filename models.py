@@ -1,8 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
+from database import RoutingSession
 from flask_login import UserMixin
 from datetime import datetime
+from cache import track_card_changes
 
-db = SQLAlchemy()
+# reads from @replica_reads views may go to a replica bind (database.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class User(UserMixin, db.Model):
@@ -19,6 +22,10 @@ class User(UserMixin, db.Model):
     profile_pic = db.Column(db.String(300), nullable=True)  # Path to profile picture
     bio = db.Column(db.Text, nullable=True)  # Optional bio/description
     notifications_enabled = db.Column(db.Boolean, default=True)
+    notifications_seen_at = db.Column(db.DateTime, nullable=True)  # Last visit to the notifications page
+    fanout_on_read_since = db.Column(db.DateTime, nullable=True)  # First upload merged at read time (large channels)
+    unread_notifications = db.Column(db.Integer, default=0)  # Header badge; kept in step by fan-out and mark-read
+    playlist_version = db.Column(db.Integer, default=0)  # Bumped on playlist add/remove (cached membership map key)
     videos = db.relationship('Video', backref='uploader', lazy=True)
 
     @property
@@ -48,6 +55,8 @@ class Video(db.Model):
     preview_images = db.Column(db.Text, nullable=True)  # JSON list of filenames
     captions = db.Column(db.String(300), nullable=True)  # Path to .vtt file
     auto_captions = db.Column(db.String(300), nullable=True)  # Path to auto-generated .vtt file
+    card_version = db.Column(db.Integer, default=0)  # Bumped when card fields change (fragment cache key)
+    fanout_on_read = db.Column(db.Boolean, default=False)  # Subscribers see it merged at read time (large channel)
 
 
 class Playlist(db.Model):
@@ -58,19 +67,23 @@ class Playlist(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     user = db.relationship('User', backref='playlists', lazy=True)
-    videos = db.relationship('PlaylistVideo', backref='playlist', lazy=True, cascade="all, delete-orphan")
+    videos = db.relationship('PlaylistVideo', backref='playlist', lazy=True, cascade="all, delete-orphan",
+                             order_by='PlaylistVideo.position')
 
 
 class PlaylistVideo(db.Model):
+    __table_args__ = (db.Index('ix_playlist_video_position', 'playlist_id', 'position', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     playlist_id = db.Column(db.Integer, db.ForeignKey('playlist.id'), nullable=False)
     video_id = db.Column(db.Integer, db.ForeignKey('video.id'), nullable=False)
     added_at = db.Column(db.DateTime, default=datetime.utcnow)
+    position = db.Column(db.Integer, nullable=True)
     
     video = db.relationship('Video', lazy=True)
 
 
 class WatchLater(db.Model):
+    __table_args__ = (db.Index('ix_watch_later_user_added', 'user_id', 'added_at', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     video_id = db.Column(db.Integer, db.ForeignKey('video.id'), nullable=False)
@@ -81,6 +94,8 @@ class WatchLater(db.Model):
 
 
 class Subscription(db.Model):
+    __table_args__ = (db.Index('ix_subscription_channel', 'channel_id', 'id'),
+                      db.Index('ix_subscription_channel_subscriber', 'channel_id', 'subscriber_id', 'id'))
     id = db.Column(db.Integer, primary_key=True)
     subscriber_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     channel_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -96,6 +111,7 @@ class Reaction(db.Model):
 
 
 class Comment(db.Model):
+    __table_args__ = (db.Index('ix_comment_video_posted', 'video_id', 'date_posted', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
     date_posted = db.Column(db.DateTime, default=datetime.utcnow)
@@ -117,6 +133,7 @@ class ViewHistory(db.Model):
 
 
 class Notification(db.Model):
+    __table_args__ = (db.Index('ix_notification_user_created', 'user_id', 'created_at', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     message = db.Column(db.String(500), nullable=False)
@@ -126,3 +143,59 @@ class Notification(db.Model):
     
     user = db.relationship('User', backref='notifications', lazy=True)
 
+
+class VideoStageTiming(db.Model):
+    """Duration and outcome of one upload processing stage (see metrics.trace)."""
+    __tablename__ = 'video_stage_timing'
+    id = db.Column(db.Integer, primary_key=True)
+    video_id = db.Column(db.Integer, db.ForeignKey('video.id'), nullable=False, index=True)
+    stage = db.Column(db.String(50), nullable=False, index=True)
+    seconds = db.Column(db.Float, nullable=False)
+    outcome = db.Column(db.String(20), nullable=False, default='ok')
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ImageVariant(db.Model):
+    """A resized copy of an uploaded image (see images.py)."""
+    __tablename__ = 'image_variant'
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(300), nullable=False, index=True)  # path under uploads, as stored on the row
+    content_hash = db.Column(db.String(64), nullable=False, index=True)
+    size = db.Column(db.Integer, nullable=False)  # shorter side in pixels
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    format = db.Column(db.String(8), nullable=False)
+    filename = db.Column(db.String(300), nullable=False)
+    bytes = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class VideoFingerprint(db.Model):
+    """Content hash and stream info of an upload, and the earlier video it duplicates (see dedup.py)."""
+    __tablename__ = 'video_fingerprint'
+    id = db.Column(db.Integer, primary_key=True)
+    video_id = db.Column(db.Integer, db.ForeignKey('video.id'), nullable=False, unique=True)
+    content_hash = db.Column(db.String(64), nullable=False, index=True)
+    duration = db.Column(db.Float, default=0.0)
+    width = db.Column(db.Integer, default=0)
+    height = db.Column(db.Integer, default=0)
+    duplicate_of = db.Column(db.Integer, nullable=True)
+    match_kind = db.Column(db.String(8), nullable=True)  # 'exact' or 'near'
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class VideoFrameHash(db.Model):
+    """64-bit dHash of one sampled frame, split into four indexed 16-bit bands for lookup."""
+    __tablename__ = 'video_frame_hash'
+    id = db.Column(db.Integer, primary_key=True)
+    video_id = db.Column(db.Integer, db.ForeignKey('video.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)  # index into dedup.FRAME_POSITIONS
+    hash = db.Column(db.BigInteger, nullable=False)  # stored signed
+    band0 = db.Column(db.Integer, nullable=False, index=True)
+    band1 = db.Column(db.Integer, nullable=False, index=True)
+    band2 = db.Column(db.Integer, nullable=False, index=True)
+    band3 = db.Column(db.Integer, nullable=False, index=True)
+
+
+# keep cached video cards in step with edits
+track_card_changes(Video, User)
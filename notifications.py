@@ -0,0 +1,177 @@
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import text, bindparam, DateTime
+
+# Subscribers handled per INSERT ... SELECT (one short transaction each)
+FANOUT_CHUNK_SIZE = 5000
+# Channels above this many subscribers are not fanned out on write; their
+# uploads are merged into each subscriber's notifications at read time.
+FANOUT_ON_READ_THRESHOLD = 10000
+
+# Read notifications older than this are deleted by compact(), in batches,
+# at most once per COMPACT_INTERVAL_SECONDS per process.
+RETENTION_DAYS = 90
+COMPACT_BATCH_SIZE = 5000
+COMPACT_INTERVAL_SECONDS = 3600
+_last_compact = 0.0
+
+
+def subscriber_count(session, channel_id):
+    return session.execute(
+        text("SELECT COUNT(*) FROM subscription WHERE channel_id = :c"), {'c': channel_id}
+    ).scalar() or 0
+
+
+def _mark_fanout_on_read(session, channel_id, video_id):
+    # The video row records that it is merged at read time, so uploads made
+    # while the channel was small keep their stored rows and are never merged
+    # twice, whichever way the channel crosses the threshold later.
+    # fanout_on_read_since (never cleared) lets the read query skip channels
+    # that have never been in on-read mode.
+    if video_id is not None:
+        session.execute(text("UPDATE video SET fanout_on_read = 1 WHERE id = :v"), {'v': video_id})
+    session.execute(text(
+        'UPDATE "user" SET fanout_on_read_since = COALESCE((SELECT upload_date FROM video WHERE id = :v), :now) '
+        'WHERE id = :c AND fanout_on_read_since IS NULL'
+    ).bindparams(bindparam('now', type_=DateTime())), {'c': channel_id, 'v': video_id, 'now': datetime.utcnow()})
+    session.commit()
+
+
+def fan_out_upload(session, channel_id, message, link, chunk_size=FANOUT_CHUNK_SIZE,
+                   on_read_threshold=FANOUT_ON_READ_THRESHOLD, video_id=None):
+    """
+    Notify the subscribers of channel_id (with notifications enabled) about a
+    new upload. Rows are written with bulk INSERT ... SELECT in chunks of
+    chunk_size subscriptions, walking subscription ids, one commit per chunk.
+    A subscriber gets one row and one badge increment however many
+    subscription rows they have for the channel.
+    On large channels the upload (video_id) is marked for fan-out-on-read
+    instead and nothing is written; the badge counter does not include such
+    merged uploads, only stored notifications.
+    Returns the number of notifications written.
+    """
+    if subscriber_count(session, channel_id) > on_read_threshold:
+        _mark_fanout_on_read(session, channel_id, video_id)
+        return 0
+
+    params = {'c': channel_id, 'message': message, 'link': link, 'now': datetime.utcnow()}
+    last_id = 0
+    total = 0
+    while True:
+        # id of the last subscription in this chunk (None when this is the final chunk)
+        upper = session.execute(text(
+            "SELECT id FROM subscription WHERE channel_id = :c AND id > :last "
+            "ORDER BY id LIMIT 1 OFFSET :n"
+        ), {'c': channel_id, 'last': last_id, 'n': chunk_size - 1}).scalar()
+        bound = "AND s.id <= :upper" if upper is not None else ""
+        # the chunk's recipients: each subscriber once, at their first subscription row
+        recipients = (
+            'FROM subscription s JOIN "user" u ON u.id = s.subscriber_id '
+            f"WHERE s.channel_id = :c AND s.id > :last {bound} "
+            "AND COALESCE(u.notifications_enabled, 1) = 1 "
+            "AND NOT EXISTS (SELECT 1 FROM subscription d WHERE d.channel_id = s.channel_id "
+            "AND d.subscriber_id = s.subscriber_id AND d.id < s.id)"
+        )
+        # keep the header badge counter in step with the rows written below
+        session.execute(text(
+            'UPDATE "user" SET unread_notifications = COALESCE(unread_notifications, 0) + 1 '
+            f"WHERE id IN (SELECT s.subscriber_id {recipients})"
+        ), {'c': channel_id, 'last': last_id, 'upper': upper})
+        result = session.execute(text(
+            "INSERT INTO notification (user_id, message, link, is_read, created_at) "
+            f"SELECT s.subscriber_id, :message, :link, 0, :now {recipients}"
+        ).bindparams(bindparam('now', type_=DateTime())), dict(params, last=last_id, upper=upper))
+        session.commit()
+        total += max(result.rowcount or 0, 0)
+        if upper is None:
+            break
+        last_id = upper
+    return total
+
+
+def channel_upload_events(session, user_id, limit=50, before=None, inclusive=False):
+    """
+    Fan-out-on-read: recent ready, public uploads from subscribed channels
+    that were marked for on-read delivery, newest first (optionally before a
+    timestamp, or at it too when inclusive). Empty when the user has
+    notifications turned off.
+    Each row has video_id, title, username and created_at.
+    """
+    stmt = text(
+        "SELECT v.id AS video_id, v.title AS title, u.username AS username, v.upload_date AS created_at "
+        "FROM subscription s "
+        'JOIN "user" me ON me.id = s.subscriber_id AND COALESCE(me.notifications_enabled, 1) = 1 '
+        'JOIN "user" u ON u.id = s.channel_id AND u.fanout_on_read_since IS NOT NULL '
+        "JOIN video v ON v.user_id = s.channel_id "
+        "WHERE s.subscriber_id = :u AND v.fanout_on_read = 1 AND v.is_public = 1 AND v.status = 'ready' "
+        "AND NOT EXISTS (SELECT 1 FROM subscription d WHERE d.channel_id = s.channel_id "
+        "AND d.subscriber_id = s.subscriber_id AND d.id < s.id) "
+        "AND v.upload_date >= u.fanout_on_read_since AND v.upload_date >= s.created_at "
+        + (f"AND v.upload_date {'<=' if inclusive else '<'} :before " if before else "") +
+        "ORDER BY v.upload_date DESC LIMIT :n"
+    )
+    params = {'u': user_id, 'n': limit}
+    if before:
+        stmt = stmt.bindparams(bindparam('before', type_=DateTime()))
+        params['before'] = before
+    return session.execute(stmt, params).fetchall()
+
+
+def mark_read(session, user_id, ids, seen_at=None):
+    """
+    Mark the given notification ids of a user read (the ones just shown) and
+    lower the badge counter by as many. With seen_at, also move
+    notifications_seen_at there: merged uploads up to it count as read.
+    """
+    if ids:
+        result = session.execute(text(
+            "UPDATE notification SET is_read = 1 WHERE user_id = :u AND is_read = 0 AND id IN :ids"
+        ).bindparams(bindparam('ids', expanding=True)), {'u': user_id, 'ids': list(ids)})
+        marked = max(result.rowcount or 0, 0)
+        if marked:
+            session.execute(text(
+                'UPDATE "user" SET unread_notifications = CASE WHEN COALESCE(unread_notifications, 0) > :n '
+                'THEN unread_notifications - :n ELSE 0 END WHERE id = :u'
+            ), {'u': user_id, 'n': marked})
+    if seen_at is not None:
+        session.execute(text(
+            'UPDATE "user" SET notifications_seen_at = :seen WHERE id = :u'
+        ).bindparams(bindparam('seen', type_=DateTime())), {'u': user_id, 'seen': seen_at})
+    session.commit()
+
+
+def mark_all_read(session, user_id):
+    """One UPDATE for all unread rows of a user, and reset the badge counter."""
+    session.execute(text(
+        "UPDATE notification SET is_read = 1 WHERE user_id = :u AND is_read = 0"
+    ), {'u': user_id})
+    session.execute(text(
+        'UPDATE "user" SET unread_notifications = 0, notifications_seen_at = :now WHERE id = :u'
+    ).bindparams(bindparam('now', type_=DateTime())), {'u': user_id, 'now': datetime.utcnow()})
+    session.commit()
+
+
+def compact(session, retention_days=RETENTION_DAYS, batch_size=COMPACT_BATCH_SIZE):
+    """Delete read notifications older than retention_days in short batches. Returns rows deleted."""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    total = 0
+    while True:
+        result = session.execute(text(
+            "DELETE FROM notification WHERE id IN ("
+            "SELECT id FROM notification WHERE is_read = 1 AND created_at < :cutoff LIMIT :n)"
+        ).bindparams(bindparam('cutoff', type_=DateTime())), {'cutoff': cutoff, 'n': batch_size})
+        session.commit()
+        deleted = max(result.rowcount or 0, 0)
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+def maybe_compact(session):
+    """Run compact() if this process has not done so in the last COMPACT_INTERVAL_SECONDS."""
+    global _last_compact
+    now = time.monotonic()
+    if _last_compact and now - _last_compact < COMPACT_INTERVAL_SECONDS:
+        return 0
+    _last_compact = now
+    return compact(session)
@@ -0,0 +1,56 @@
+from datetime import datetime
+from sqlalchemy import or_, and_
+
+DEFAULT_PAGE_SIZE = 30
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(key, row_id):
+    """Opaque cursor for the (sort key, id) of the last row on a page."""
+    if isinstance(key, datetime):
+        key = key.isoformat()
+    return f"{key}_{row_id}"
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; None for a missing or malformed cursor."""
+    if not cursor:
+        return None
+    try:
+        key, row_id = cursor.rsplit('_', 1)
+        try:
+            key = int(key)
+        except ValueError:
+            key = datetime.fromisoformat(key)
+        return key, int(row_id)
+    except (ValueError, AttributeError):
+        return None
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    try:
+        return max(1, min(int(value), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return default
+
+
+def keyset_page(query, key_col, id_col, cursor=None, limit=DEFAULT_PAGE_SIZE, ascending=False):
+    """
+    Keyset page over (key_col, id_col), newest/highest first unless ascending.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    after = decode_cursor(cursor) if isinstance(cursor, str) else cursor
+    if after:
+        key, row_id = after
+        if ascending:
+            query = query.filter(or_(key_col > key, and_(key_col == key, id_col > row_id)))
+        else:
+            query = query.filter(or_(key_col < key, and_(key_col == key, id_col < row_id)))
+    order = (key_col.asc(), id_col.asc()) if ascending else (key_col.desc(), id_col.desc())
+    rows = query.order_by(*order).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, key_col.key), getattr(last, id_col.key))
+    return rows, next_cursor
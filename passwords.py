@@ -0,0 +1,129 @@
+import os
+import time
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Hashing scheme for new and upgraded passwords, in Werkzeug's method syntax
+# (scrypt:N:r:p or pbkdf2:sha256:iterations). Stored hashes that use another
+# scheme are rehashed on the next successful login.
+PASSWORD_METHOD = os.environ.get('VIEWFLOW_PASSWORD_METHOD', 'scrypt:16384:8:1')
+
+# Verification runs on a small dedicated pool (hashlib releases the GIL);
+# attempts beyond workers + queue are turned away instead of piling up.
+VERIFY_WORKERS = int(os.environ.get('VIEWFLOW_PASSWORD_WORKERS', 2))
+VERIFY_QUEUE = 16
+VERIFY_TIMEOUT_SECONDS = 10
+
+# Login attempts: burst size and sustained rate per client IP and per account
+LOGIN_IP_BURST = 20
+LOGIN_IP_PER_MINUTE = 20
+LOGIN_ACCOUNT_BURST = 10
+LOGIN_ACCOUNT_PER_MINUTE = 5
+
+
+class PasswordBusy(Exception):
+    """Raised when the verification pool is saturated."""
+
+
+def hash_password(password, method=None):
+    return generate_password_hash(password, method=method or PASSWORD_METHOD)
+
+
+@lru_cache(maxsize=8)
+def _stored_prefix(method):
+    # Werkzeug stores the fully expanded method (defaults filled in) before the first '$'
+    return generate_password_hash('', method=method).split('$', 1)[0]
+
+
+def needs_rehash(pwhash, method=None):
+    """True if pwhash was made with a different scheme or parameters than configured."""
+    return pwhash.split('$', 1)[0] != _stored_prefix(method or PASSWORD_METHOD)
+
+
+_pool = ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix='pwverify')
+_slots = threading.BoundedSemaphore(VERIFY_WORKERS + VERIFY_QUEUE)
+
+
+def verify_password(pwhash, password):
+    """
+    check_password_hash on the bounded verification pool. Raises
+    PasswordBusy when too many verifications are already in flight or the
+    result does not arrive within VERIFY_TIMEOUT_SECONDS.
+    """
+    if not _slots.acquire(blocking=False):
+        raise PasswordBusy()
+    try:
+        future = _pool.submit(check_password_hash, pwhash, password)
+    except Exception:
+        _slots.release()
+        raise
+    # the slot is held until the hash finishes, even if this caller gives up waiting
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=VERIFY_TIMEOUT_SECONDS)
+    except FutureTimeout:
+        raise PasswordBusy()
+
+
+class TokenBucket:
+    """
+    In-memory token buckets keyed by string: `capacity` attempts at once,
+    refilled at `per_minute`. Idle full buckets are dropped periodically.
+    """
+
+    def __init__(self, capacity, per_minute, max_keys=100000):
+        self.capacity = capacity
+        self.rate = per_minute / 60.0
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def _level(self, key, now):
+        tokens, stamp = self.buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - stamp) * self.rate)
+
+    def consume(self, key, now=None):
+        """Take one token for key; False if the bucket is empty."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            tokens = self._level(key, now)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now)
+                return False
+            self.buckets[key] = (tokens - 1, now)
+            if len(self.buckets) > self.max_keys:
+                self._prune(now)
+            return True
+
+    def _prune(self, now):
+        for key in [k for k in self.buckets if self._level(k, now) >= self.capacity]:
+            del self.buckets[key]
+
+
+_ip_buckets = TokenBucket(LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE)
+_account_buckets = TokenBucket(LOGIN_ACCOUNT_BURST, LOGIN_ACCOUNT_PER_MINUTE)
+
+
+def login_allowed(ip, account):
+    """Charge one login attempt to the client IP and the account (email)."""
+    ip_ok = _ip_buckets.consume(ip or '-')
+    account_ok = _account_buckets.consume((account or '').strip().lower())
+    return ip_ok and account_ok
+
+
+def authenticate(session, user, password):
+    """
+    Verify a login for user (may be None). On success, upgrade the stored
+    hash if the configured scheme changed. Returns True/False; raises
+    PasswordBusy when verification capacity is exhausted.
+    """
+    if not user or not password:
+        return False
+    if not verify_password(user.password, password):
+        return False
+    if needs_rehash(user.password):
+        user.password = hash_password(password)
+        session.commit()
+    return True
@@ -0,0 +1,35 @@
+import hashlib
+from cache import LRUCache
+
+# Tags and attributes allowed in rendered user Markdown (video descriptions)
+ALLOWED_TAGS = ['p', 'strong', 'em', 'ul', 'ol', 'li', 'a', 'br', 'h1', 'h2', 'h3', 'blockquote', 'code', 'pre']
+ALLOWED_ATTRS = {'a': ['href', 'title', 'target']}
+
+# Rendered HTML kept per distinct source text; least recently used is evicted
+MARKDOWN_CACHE_SIZE = 1024
+
+_markdown_cache = LRUCache(MARKDOWN_CACHE_SIZE)
+
+
+def render_markdown_uncached(text):
+    """Markdown to HTML, sanitized with bleach."""
+    # imported on first render rather than at app startup
+    import markdown
+    import bleach
+    html = markdown.markdown(text)
+    return bleach.clean(html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS, strip=True)
+
+
+def render_markdown(text):
+    """
+    Sanitized HTML for a Markdown string. Results are cached by a hash of
+    the text, so an edited description simply gets a new entry.
+    """
+    if not text:
+        return ""
+    key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+    html = _markdown_cache.get(key)
+    if html is None:
+        html = render_markdown_uncached(text)
+        _markdown_cache.put(key, html)
+    return html
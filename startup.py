@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+from sqlalchemy import text
+
+# Video.js is served from static/vendor. The files are committed to the repo
+# (refresh them at build time with `python startup.py vendor`); starting the
+# app never touches the network.
+VIDEOJS_VERSION = '8.20.0'
+VIDEOJS_FILES = ('video.min.js', 'video-js.css')
+VIDEOJS_CDN = 'https://vjs.zencdn.net/{version}/{name}'
+
+
+class StartupTimer:
+    """Wall time of each startup phase, measured between successive mark() calls."""
+
+    def __init__(self, started=None):
+        self.last = started if started is not None else time.perf_counter()
+        self.phases = []
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def as_dict(self):
+        return {name: round(seconds * 1000, 1) for name, seconds in self.phases}
+
+    def report(self, label='startup'):
+        total = sum(seconds for _, seconds in self.phases)
+        parts = ', '.join(f"{name} {seconds * 1000:.1f}ms" for name, seconds in self.phases)
+        line = f"{label}: {parts} (total {total * 1000:.1f}ms)"
+        print(line)
+        return line
+
+
+def schema_version(conn, key):
+    """Schema version recorded for key by set_schema_version, 0 if none."""
+    try:
+        return conn.execute(text("SELECT version FROM schema_version WHERE name = :k"), {'k': key}).scalar() or 0
+    except Exception:
+        return 0
+
+
+def set_schema_version(conn, key, version):
+    """
+    Record that the migrations for key are applied up to version, so later
+    starts can skip create_all and the column probes. Each app keeps its own
+    key because their migrations cover different columns.
+    """
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version (name VARCHAR(50) PRIMARY KEY, version INTEGER NOT NULL)"))
+    conn.execute(text("DELETE FROM schema_version WHERE name = :k"), {'k': key})
+    conn.execute(text("INSERT INTO schema_version (name, version) VALUES (:k, :v)"), {'k': key, 'v': version})
+    conn.commit()
+
+
+def videojs_local(static_folder):
+    """True when the vendored Video.js files are present (checked on disk only)."""
+    vendor = os.path.join(static_folder, 'vendor')
+    return all(os.path.exists(os.path.join(vendor, name)) for name in VIDEOJS_FILES)
+
+
+def vendor_videojs(static_folder, version=VIDEOJS_VERSION):
+    """Download Video.js into static/vendor. Build/install step, not called by the app."""
+    import urllib.request
+    vendor = os.path.join(static_folder, 'vendor')
+    os.makedirs(vendor, exist_ok=True)
+    for name in VIDEOJS_FILES:
+        urllib.request.urlretrieve(VIDEOJS_CDN.format(version=version, name=name), os.path.join(vendor, name))
+        print(f"vendored {name} ({version})")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['vendor']:
+        sys.exit("usage: python startup.py vendor")
+    vendor_videojs(os.path.join(os.path.abspath(os.path.dirname(__file__)), 'static'))
@@ -4,6 +4,41 @@ document.addEventListener('DOMContentLoaded', ()=>{
     const forms = document.querySelectorAll('form.js-async-form');
     console.log('Found', forms.length, 'async forms');
     
+    // Build a comment node from the JSON returned by the comment endpoints
+    function buildComment(comment, canDelete) {
+        const div = document.createElement('div');
+        div.className = 'comment';
+        div.id = 'comment-' + comment.id;
+        div.style.cssText = 'display:flex; gap:10px; margin-bottom:20px;';
+
+        // Build avatar node safely
+        const anchor = document.createElement('a');
+        anchor.href = comment.user_url || '#';
+        if(comment.profile_pic){
+            const img = document.createElement('img'); img.src = comment.profile_pic; img.className = 'avatar'; img.style.width = '40px'; img.style.height = '40px'; img.style.objectFit = 'cover';
+            anchor.appendChild(img);
+        } else {
+            const avatarDiv = document.createElement('div'); avatarDiv.className = 'avatar'; avatarDiv.style.width = '40px'; avatarDiv.style.height = '40px'; avatarDiv.textContent = comment.initial || '?';
+            anchor.appendChild(avatarDiv);
+        }
+        div.appendChild(anchor);
+        const main = document.createElement('div'); main.style.flex = '1';
+        const meta = document.createElement('div'); meta.style.marginBottom = '4px';
+        const userLink = document.createElement('a'); userLink.href = comment.user_url || '#'; userLink.style.fontWeight = 'bold'; userLink.style.fontSize = '0.9rem'; userLink.style.marginRight = '8px'; userLink.textContent = comment.user || 'User';
+        const dateSpan = document.createElement('span'); dateSpan.style.color = 'var(--text-sec)'; dateSpan.style.fontSize = '0.8rem'; dateSpan.textContent = comment.date || '';
+        meta.appendChild(userLink); meta.appendChild(dateSpan);
+        const p = document.createElement('p'); p.style.margin = '0'; p.style.fontSize = '0.95rem'; p.textContent = comment.content || '';
+        main.appendChild(meta); main.appendChild(p);
+        div.appendChild(main);
+        if(canDelete){
+            const right = document.createElement('div');
+            const delForm = document.createElement('form'); delForm.method = 'POST'; delForm.action = '/comment/' + (comment.id) + '/delete'; delForm.className = 'js-async-form'; delForm.dataset.action = 'delete-comment';
+            const delBtn = document.createElement('button'); delBtn.type = 'submit'; delBtn.className = 'btn'; delBtn.style.padding = '4px 8px'; delBtn.style.fontSize = '0.8rem'; delBtn.style.opacity = '0.7'; delBtn.title = 'Delete'; delBtn.textContent = '✕';
+            delForm.appendChild(delBtn); right.appendChild(delForm); div.appendChild(right);
+        }
+        return div;
+    }
+
     function attachHandler(form) {
         console.log('Attaching handler to form with action:', form.action, 'data-action:', form.dataset.action);
         form.addEventListener('submit', async (e)=>{
@@ -175,35 +210,8 @@ document.addEventListener('DOMContentLoaded', ()=>{
                 } else if(action === 'comment'){
                     if(data.success && data.comment){
                         const list = document.getElementById('comments-list');
-                        const div = document.createElement('div');
-                        div.className = 'comment';
-                        div.id = 'comment-' + data.comment.id;
-                        div.style.cssText = 'display:flex; gap:10px; margin-bottom:20px; animation: fadeIn 0.3s ease;';
-                        
-                        // Build avatar node safely
-                        const anchor = document.createElement('a');
-                        anchor.href = data.comment.user_url || '#';
-                        if(data.comment.profile_pic){
-                            const img = document.createElement('img'); img.src = data.comment.profile_pic; img.className = 'avatar'; img.style.width = '40px'; img.style.height = '40px'; img.style.objectFit = 'cover';
-                            anchor.appendChild(img);
-                        } else {
-                            const avatarDiv = document.createElement('div'); avatarDiv.className = 'avatar'; avatarDiv.style.width = '40px'; avatarDiv.style.height = '40px'; avatarDiv.textContent = data.comment.initial || '?';
-                            anchor.appendChild(avatarDiv);
-                        }
-                        div.appendChild(anchor);
-                        const main = document.createElement('div'); main.style.flex = '1';
-                        const meta = document.createElement('div'); meta.style.marginBottom = '4px';
-                        const userLink = document.createElement('a'); userLink.href = data.comment.user_url || '#'; userLink.style.fontWeight = 'bold'; userLink.style.fontSize = '0.9rem'; userLink.style.marginRight = '8px'; userLink.textContent = data.comment.user || 'User';
-                        const dateSpan = document.createElement('span'); dateSpan.style.color = 'var(--text-sec)'; dateSpan.style.fontSize = '0.8rem'; dateSpan.textContent = data.comment.date || '';
-                        meta.appendChild(userLink); meta.appendChild(dateSpan);
-                        const p = document.createElement('p'); p.style.margin = '0'; p.style.fontSize = '0.95rem'; p.textContent = data.comment.content || '';
-                        main.appendChild(meta); main.appendChild(p);
-                        div.appendChild(main);
-                        const right = document.createElement('div');
-                        const delForm = document.createElement('form'); delForm.method = 'POST'; delForm.action = '/comment/' + (data.comment.id) + '/delete'; delForm.className = 'js-async-form'; delForm.dataset.action = 'delete-comment';
-                        const delBtn = document.createElement('button'); delBtn.type = 'submit'; delBtn.className = 'btn'; delBtn.style.padding = '4px 8px'; delBtn.style.fontSize = '0.8rem'; delBtn.style.opacity = '0.7'; delBtn.title = 'Delete'; delBtn.textContent = '✕';
-                        delForm.appendChild(delBtn); right.appendChild(delForm); div.appendChild(right);
-                        
+                        const div = buildComment(data.comment, true);
+                        div.style.animation = 'fadeIn 0.3s ease';
                         list.insertBefore(div, list.firstChild);
                         form.reset();
                         
@@ -230,4 +238,44 @@ document.addEventListener('DOMContentLoaded', ()=>{
     }
 
     forms.forEach(form => attachHandler(form));
+
+    // Infinite scroll for comments: fetch the next page when the marker below the list comes into view
+    const more = document.getElementById('comments-more');
+    if(more){
+        const list = document.getElementById('comments-list');
+        let loading = false;
+        async function loadMoreComments(){
+            if(loading || !more.dataset.cursor) return;
+            loading = true;
+            try{
+                const resp = await fetch(more.dataset.url + '?before=' + encodeURIComponent(more.dataset.cursor), {credentials: 'same-origin'});
+                if(!resp.ok){
+                    console.warn('Loading comments failed', resp.status);
+                    return;
+                }
+                const data = await resp.json();
+                data.comments.forEach(c => {
+                    // skip comments already on the page (e.g. just posted)
+                    if(document.getElementById('comment-' + c.id)) return;
+                    const div = buildComment(c, c.can_delete);
+                    list.appendChild(div);
+                    const delForm = div.querySelector('form');
+                    if(delForm) attachHandler(delForm);
+                });
+                more.dataset.cursor = data.next_cursor || '';
+                if(!data.next_cursor){
+                    observer.disconnect();
+                    more.remove();
+                }
+            }catch(err){
+                console.error('Loading comments error', err);
+            }finally{
+                loading = false;
+            }
+        }
+        const observer = new IntersectionObserver(entries => {
+            if(entries.some(e => e.isIntersecting)) loadMoreComments();
+        }, {rootMargin: '300px'});
+        observer.observe(more);
+    }
 });
@@ -551,14 +551,33 @@ document.addEventListener('DOMContentLoaded', function () {
       progressTooltip.style.left = (pct * 100) + '%';
 
       // Preview Image
-      if (previews && previews.length > 0) {
+      // previews is either a sprite sheet descriptor {sprite, count, columns, width, height}
+      // or (older uploads) a list of individual preview filenames
+      var uploadBase = videoSrc.substring(0, videoSrc.lastIndexOf('/') + 1);
+      var sprite = (previews && !Array.isArray(previews) && previews.sprite) ? previews : null;
+      if (sprite && sprite.count > 0) {
+          progressTooltip.classList.add('has-preview');
+          var sIdx = Math.min(sprite.count - 1, Math.floor(pct * sprite.count));
+          var cols = sprite.columns || sprite.count;
+          var sx = (sIdx % cols) * sprite.width;
+          var sy = Math.floor(sIdx / cols) * sprite.height;
+          progressTooltip.style.backgroundImage = 'url(' + uploadBase + encodeURIComponent(sprite.sprite) + ')';
+          progressTooltip.style.backgroundSize = (cols * sprite.width) + 'px auto';
+          progressTooltip.style.backgroundPosition = '-' + sx + 'px -' + sy + 'px';
+          progressTooltip.style.width = sprite.width + 'px';
+          progressTooltip.style.height = sprite.height + 'px';
+          progressTooltip.style.lineHeight = (sprite.height + 80) + 'px'; // Push text down
+          progressTooltip.style.textAlign = 'center';
+          progressTooltip.style.borderRadius = '8px';
+          progressTooltip.style.border = '2px solid #fff';
+          progressTooltip.style.textShadow = '0 1px 2px black';
+      } else if (Array.isArray(previews) && previews.length > 0) {
           progressTooltip.classList.add('has-preview');
           var idx = Math.floor(pct * previews.length);
           if (idx >= previews.length) idx = previews.length - 1;
           var img = previews[idx];
           if (img) {
               // Derive base path from video source to ensure correct path
-              var uploadBase = videoSrc.substring(0, videoSrc.lastIndexOf('/') + 1);
               progressTooltip.style.backgroundImage = 'url(' + uploadBase + img + ')';
               progressTooltip.style.backgroundSize = 'cover';
               progressTooltip.style.width = '160px';
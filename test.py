@@ -1,31 +1,43 @@
 import os
+import time
+_started = time.perf_counter()
 from datetime import datetime, timedelta
 from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, abort, jsonify, Blueprint
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import inspect, text, func
+from sqlalchemy.orm import joinedload
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from jinja2 import DictLoader
-import cv2
 import random
 from collections import Counter, defaultdict
 import math
 import voice
-import speech_recognition as sr
-import static_ffmpeg
+from notifications import fan_out_upload, channel_upload_events, mark_read, maybe_compact
+from pagination import keyset_page, page_size, decode_cursor, encode_cursor
+from rendering import render_markdown
+from passwords import hash_password, authenticate, login_allowed, PasswordBusy
+import identity
+import cache
+import startup
+import database
+import metrics
+import mediapool
+import images
+import dedup
+from database import replica_reads
 import uuid
 import shutil
 import subprocess
 import json
 import threading
-from vosk import Model, KaldiRecognizer
-import wave
-import markdown
-import bleach
 
 __version__ = '1.0.1'
 
+# Per-phase startup timings, printed once the app is ready
+_startup = startup.StartupTimer(_started)
+_startup.mark('imports')
+
 # ==========================================
 # CONFIGURATION
 # ==========================================
@@ -36,33 +48,39 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('VIEWFLOW_SECRET', 'dev-secret-key-gautham-deepak')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(BASE_DIR, 'viewflow.db')
+# DATABASE_URL or viewflow.db; SQLite gets WAL and a busy timeout (see database.py)
+database.configure(app, BASE_DIR)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 * 1024  # 16GB max
+# Rendered video cards: 'memory' (per process), 'sqlite[:path]' (shared by workers) or 'off'
+app.config['FRAGMENT_CACHE'] = os.environ.get('VIEWFLOW_FRAGMENT_CACHE', 'memory')
+# Video.js ships in static/vendor (see startup.py); only check the files exist
+app.config['VIDEOJS_LOCAL'] = startup.videojs_local(app.static_folder)
 
 # Markdown Filter
 @app.template_filter('markdown')
 def markdown_filter(text):
-    if not text:
-        return ""
-    # Convert markdown to HTML
-    html = markdown.markdown(text)
-    # Sanitize HTML
-    allowed_tags = ['p', 'strong', 'em', 'ul', 'ol', 'li', 'a', 'br', 'h1', 'h2', 'h3', 'blockquote', 'code', 'pre']
-    allowed_attrs = {'a': ['href', 'title', 'target']}
-    clean_html = bleach.clean(html, tags=allowed_tags, attributes=allowed_attrs, strip=True)
-    return clean_html
+    # Sanitized HTML, cached by content hash (see rendering.py)
+    return render_markdown(text)
 
 app.config['VOSK_MODEL_PATH'] = os.environ.get('VOSK_MODEL_PATH', os.path.join(UPLOAD_FOLDER, 'models', 'vosk-model-small-en-us-0.15'))
 
-db = SQLAlchemy(app)
+# reads from @replica_reads views may go to a replica bind (database.py)
+db = SQLAlchemy(app, session_options={'class_': database.RoutingSession})
+database.init_app(app, db)
+# request/query timing (VIEWFLOW_METRICS=0 to disable), at /metrics when VIEWFLOW_METRICS_TOKEN is set
+metrics.init_app(app, db)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'auth.login'
 
 ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv'}
 ALLOWED_IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp'}
+# Comments rendered with the watch page; later pages come from /api/video/<id>/comments
+COMMENTS_PAGE_SIZE = 20
+# Playlist and Watch Later pages (the limit query argument is capped by pagination.MAX_PAGE_SIZE)
+PLAYLIST_PAGE_SIZE = 50
 # Use filesystem templates from the `templates/` directory so edits there are reflected.
 # If you prefer the in-memory templates for tests, uncomment the DictLoader block below.
 # app.jinja_loader = DictLoader({
@@ -91,6 +109,10 @@ class User(UserMixin, db.Model):
     profile_pic = db.Column(db.String(300), nullable=True)
     bio = db.Column(db.Text, nullable=True)
     notifications_enabled = db.Column(db.Boolean, default=True)
+    notifications_seen_at = db.Column(db.DateTime, nullable=True)
+    fanout_on_read_since = db.Column(db.DateTime, nullable=True)
+    unread_notifications = db.Column(db.Integer, default=0)
+    playlist_version = db.Column(db.Integer, default=0)
     videos = db.relationship('Video', backref='uploader', lazy=True)
 
     @property
@@ -118,6 +140,8 @@ class Video(db.Model):
     heatmap = db.Column(db.Text, default='[]')
     preview_images = db.Column(db.Text, nullable=True)
     captions = db.Column(db.String(300), nullable=True)
+    card_version = db.Column(db.Integer, default=0)
+    fanout_on_read = db.Column(db.Boolean, default=False)
 
 
 class Playlist(db.Model):
@@ -128,19 +152,23 @@ class Playlist(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     user = db.relationship('User', backref='playlists', lazy=True)
-    videos = db.relationship('PlaylistVideo', backref='playlist', lazy=True, cascade="all, delete-orphan")
+    videos = db.relationship('PlaylistVideo', backref='playlist', lazy=True, cascade="all, delete-orphan",
+                             order_by='PlaylistVideo.position')
 
 
 class PlaylistVideo(db.Model):
+    __table_args__ = (db.Index('ix_playlist_video_position', 'playlist_id', 'position', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     playlist_id = db.Column(db.Integer, db.ForeignKey('playlist.id'), nullable=False)
     video_id = db.Column(db.Integer, db.ForeignKey('video.id'), nullable=False)
     added_at = db.Column(db.DateTime, default=datetime.utcnow)
+    position = db.Column(db.Integer, nullable=True)
     
     video = db.relationship('Video', lazy=True)
 
 
 class WatchLater(db.Model):
+    __table_args__ = (db.Index('ix_watch_later_user_added', 'user_id', 'added_at', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     video_id = db.Column(db.Integer, db.ForeignKey('video.id'), nullable=False)
@@ -151,6 +179,8 @@ class WatchLater(db.Model):
 
 
 class Subscription(db.Model):
+    __table_args__ = (db.Index('ix_subscription_channel', 'channel_id', 'id'),
+                      db.Index('ix_subscription_channel_subscriber', 'channel_id', 'subscriber_id', 'id'))
     id = db.Column(db.Integer, primary_key=True)
     subscriber_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     channel_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -166,6 +196,7 @@ class Reaction(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Comment(db.Model):
+    __table_args__ = (db.Index('ix_comment_video_posted', 'video_id', 'date_posted', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
     date_posted = db.Column(db.DateTime, default=datetime.utcnow)
@@ -185,6 +216,7 @@ class ViewHistory(db.Model):
     video = db.relationship('Video', backref='view_events', lazy=True)
 
 class Notification(db.Model):
+    __table_args__ = (db.Index('ix_notification_user_created', 'user_id', 'created_at', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     message = db.Column(db.String(500), nullable=False)
@@ -194,9 +226,76 @@ class Notification(db.Model):
     
     user = db.relationship('User', backref='notifications', lazy=True)
 
+
+class VideoStageTiming(db.Model):
+    """Duration and outcome of one upload processing stage (see metrics.trace)."""
+    __tablename__ = 'video_stage_timing'
+    id = db.Column(db.Integer, primary_key=True)
+    video_id = db.Column(db.Integer, db.ForeignKey('video.id'), nullable=False, index=True)
+    stage = db.Column(db.String(50), nullable=False, index=True)
+    seconds = db.Column(db.Float, nullable=False)
+    outcome = db.Column(db.String(20), nullable=False, default='ok')
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ImageVariant(db.Model):
+    """A resized copy of an uploaded image (see images.py)."""
+    __tablename__ = 'image_variant'
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(300), nullable=False, index=True)  # path under uploads, as stored on the row
+    content_hash = db.Column(db.String(64), nullable=False, index=True)
+    size = db.Column(db.Integer, nullable=False)  # shorter side in pixels
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    format = db.Column(db.String(8), nullable=False)
+    filename = db.Column(db.String(300), nullable=False)
+    bytes = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class VideoFingerprint(db.Model):
+    """Content hash and stream info of an upload, and the earlier video it duplicates (see dedup.py)."""
+    __tablename__ = 'video_fingerprint'
+    id = db.Column(db.Integer, primary_key=True)
+    video_id = db.Column(db.Integer, db.ForeignKey('video.id'), nullable=False, unique=True)
+    content_hash = db.Column(db.String(64), nullable=False, index=True)
+    duration = db.Column(db.Float, default=0.0)
+    width = db.Column(db.Integer, default=0)
+    height = db.Column(db.Integer, default=0)
+    duplicate_of = db.Column(db.Integer, nullable=True)
+    match_kind = db.Column(db.String(8), nullable=True)  # 'exact' or 'near'
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class VideoFrameHash(db.Model):
+    """64-bit dHash of one sampled frame, split into four indexed 16-bit bands for lookup."""
+    __tablename__ = 'video_frame_hash'
+    id = db.Column(db.Integer, primary_key=True)
+    video_id = db.Column(db.Integer, db.ForeignKey('video.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)  # index into dedup.FRAME_POSITIONS
+    hash = db.Column(db.BigInteger, nullable=False)  # stored signed
+    band0 = db.Column(db.Integer, nullable=False, index=True)
+    band1 = db.Column(db.Integer, nullable=False, index=True)
+    band2 = db.Column(db.Integer, nullable=False, index=True)
+    band3 = db.Column(db.Integer, nullable=False, index=True)
+
+
+class UploadEvent:
+    """A channel upload merged into the notifications list at read time (not stored)."""
+    def __init__(self, message, link, is_read, created_at):
+        self.message = message
+        self.link = link
+        self.is_read = is_read
+        self.created_at = created_at
+
+cache.track_card_changes(Video, User)
+cache.init_app(app)
+images.init_app(app, db)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # cached snapshot; views that write to the user load the row (current_user_record)
+    return identity.load_identity(user_id, lambda uid: db.session.get(User, uid))
 
 # ==========================================
 # UTILITIES
@@ -215,39 +314,6 @@ def allowed_file(filename, file_type='video'):
         return ext in ALLOWED_IMAGE_EXTENSIONS
     return False
 
-def generate_thumbnail(video_path, output_path):
-    """Generate a thumbnail from a random frame in the video"""
-    try:
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            return None
-        
-        # Get total frames
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        if total_frames <= 0:
-            cap.release()
-            return None
-        
-        # Pick a random frame (avoid first and last 10%)
-        start_frame = int(total_frames * 0.1)
-        end_frame = int(total_frames * 0.9)
-        random_frame = random.randint(start_frame, end_frame) if end_frame > start_frame else total_frames // 2
-        
-        # Set frame position
-        cap.set(cv2.CAP_PROP_POS_FRAMES, random_frame)
-        ret, frame = cap.read()
-        cap.release()
-        
-        if ret:
-            # Resize to standard thumbnail size (320x180)
-            thumbnail = cv2.resize(frame, (320, 180))
-            cv2.imwrite(output_path, thumbnail)
-            return True
-        return None
-    except Exception as e:
-        print(f"Error generating thumbnail: {e}")
-        return None
-
 # ==========================================
 # RECOMMENDATION ENGINE
 # ==========================================
@@ -400,6 +466,11 @@ def format_date(date):
 # --------------------------
 # Database / Uploads Init
 # --------------------------
+# Recorded in the schema_version table after init_db's migrations succeed;
+# increase it whenever a migration is added there.
+SCHEMA_VERSION = 6
+
+
 def init_db():
     """Create uploads directory, database tables, and run best-effort migrations.
     This is executed on app import so the test server can start even if the DB
@@ -412,12 +483,18 @@ def init_db():
         pass
 
     with app.app_context():
+        with db.engine.connect() as conn:
+            if startup.schema_version(conn, 'test') >= SCHEMA_VERSION:
+                return
+        # a failed step is logged and leaves the schema unstamped, so it is
+        # retried on the next start
+        failures = []
         try:
             db.create_all()
             print("Database initialized.")
-        except Exception:
+        except Exception as e:
             # continue even if create_all fails
-            pass
+            failures.append(e)
 
         # best-effort sqlite ALTER TABLE migrations for test environment
         try:
@@ -432,62 +509,68 @@ def init_db():
                     try:
                         conn.execute(text("ALTER TABLE video ADD COLUMN is_public BOOLEAN DEFAULT 1"))
                         conn.commit()
-                    except Exception:
-                        pass
+                    except Exception as e:
+                        failures.append(e)
                 if 'thumbnail' not in video_cols:
                     try:
                         conn.execute(text("ALTER TABLE video ADD COLUMN thumbnail VARCHAR(200)"))
                         conn.commit()
-                    except Exception:
-                        pass
+                    except Exception as e:
+                        failures.append(e)
                 if 'category' not in video_cols:
                     try:
                         conn.execute(text("ALTER TABLE video ADD COLUMN category VARCHAR(100)"))
                         conn.commit()
-                    except Exception:
-                        pass
+                    except Exception as e:
+                        failures.append(e)
                 if 'tags' not in video_cols:
                     try:
                         conn.execute(text("ALTER TABLE video ADD COLUMN tags VARCHAR(500)"))
                         conn.commit()
-                    except Exception:
-                        pass
+                    except Exception as e:
+                        failures.append(e)
                 if 'resolutions' not in video_cols:
                     try:
                         conn.execute(text("ALTER TABLE video ADD COLUMN resolutions VARCHAR(200)"))
                         conn.commit()
-                    except Exception:
-                        pass
+                    except Exception as e:
+                        failures.append(e)
                 if 'height' not in video_cols:
                     try:
                         conn.execute(text("ALTER TABLE video ADD COLUMN height INTEGER"))
                         conn.commit()
-                    except Exception:
-                        pass
+                    except Exception as e:
+                        failures.append(e)
                 if 'status' not in video_cols:
                     try:
                         conn.execute(text("ALTER TABLE video ADD COLUMN status VARCHAR(20) DEFAULT 'ready'"))
                         conn.commit()
-                    except Exception:
-                        pass
+                    except Exception as e:
+                        failures.append(e)
                 if 'heatmap' not in video_cols:
                     try:
                         conn.execute(text("ALTER TABLE video ADD COLUMN heatmap TEXT DEFAULT '[]'"))
                         conn.commit()
-                    except Exception:
-                        pass
+                    except Exception as e:
+                        failures.append(e)
                 if 'preview_images' not in video_cols:
                     try:
                         conn.execute(text("ALTER TABLE video ADD COLUMN preview_images TEXT"))
                         conn.commit()
-                    except Exception:
-                        pass
+                    except Exception as e:
+                        failures.append(e)
                 if 'captions' not in video_cols:
                     try:
                         conn.execute(text("ALTER TABLE video ADD COLUMN captions VARCHAR(300)"))
                         conn.commit()
-                    except Exception:
-                        pass
+                    except Exception as e:
+                        failures.append(e)
+                if 'card_version' not in video_cols:
+                    try:
+                        conn.execute(text("ALTER TABLE video ADD COLUMN card_version INTEGER DEFAULT 0"))
+                        conn.commit()
+                    except Exception as e:
+                        failures.append(e)
 
             # user table columns
             try:
@@ -499,59 +582,152 @@ def init_db():
                     try:
                         conn.execute(text("ALTER TABLE user ADD COLUMN display_name VARCHAR(150)"))
                         conn.commit()
-                    except Exception:
-                        pass
+                    except Exception as e:
+                        failures.append(e)
                 if 'location' not in user_cols:
                     try:
                         conn.execute(text("ALTER TABLE user ADD COLUMN location VARCHAR(200)"))
                         conn.commit()
-                    except Exception:
-                        pass
+                    except Exception as e:
+                        failures.append(e)
                 if 'age' not in user_cols:
                     try:
                         conn.execute(text("ALTER TABLE user ADD COLUMN age INTEGER"))
                         conn.commit()
-                    except Exception:
-                        pass
+                    except Exception as e:
+                        failures.append(e)
                 if 'date_joined' not in user_cols:
                     try:
                         conn.execute(text("ALTER TABLE user ADD COLUMN date_joined DATETIME"))
                         conn.commit()
-                    except Exception:
-                        pass
+                    except Exception as e:
+                        failures.append(e)
+                if 'date_of_birth' not in user_cols:
+                    try:
+                        conn.execute(text("ALTER TABLE user ADD COLUMN date_of_birth DATE"))
+                        conn.commit()
+                    except Exception as e:
+                        failures.append(e)
                 if 'gender' not in user_cols:
                     try:
                         conn.execute(text("ALTER TABLE user ADD COLUMN gender VARCHAR(50)"))
                         conn.commit()
-                    except Exception:
-                        pass
+                    except Exception as e:
+                        failures.append(e)
                 if 'profile_pic' not in user_cols:
                     try:
                         conn.execute(text("ALTER TABLE user ADD COLUMN profile_pic VARCHAR(300)"))
                         conn.commit()
-                    except Exception:
-                        pass
+                    except Exception as e:
+                        failures.append(e)
                 if 'bio' not in user_cols:
                     try:
                         conn.execute(text("ALTER TABLE user ADD COLUMN bio TEXT"))
                         conn.commit()
-                    except Exception:
-                        pass
+                    except Exception as e:
+                        failures.append(e)
                 if 'notifications_enabled' not in user_cols:
                     try:
                         conn.execute(text("ALTER TABLE user ADD COLUMN notifications_enabled BOOLEAN DEFAULT 1"))
                         conn.commit()
-                    except Exception:
-                        pass
-        except Exception:
+                    except Exception as e:
+                        failures.append(e)
+                if 'notifications_seen_at' not in user_cols:
+                    try:
+                        conn.execute(text("ALTER TABLE user ADD COLUMN notifications_seen_at DATETIME"))
+                        conn.commit()
+                    except Exception as e:
+                        failures.append(e)
+                if 'fanout_on_read_since' not in user_cols:
+                    try:
+                        conn.execute(text("ALTER TABLE user ADD COLUMN fanout_on_read_since DATETIME"))
+                        conn.commit()
+                    except Exception as e:
+                        failures.append(e)
+                if 'playlist_version' not in user_cols:
+                    try:
+                        conn.execute(text("ALTER TABLE user ADD COLUMN playlist_version INTEGER DEFAULT 0"))
+                        conn.commit()
+                    except Exception as e:
+                        failures.append(e)
+                if 'unread_notifications' not in user_cols:
+                    try:
+                        conn.execute(text("ALTER TABLE user ADD COLUMN unread_notifications INTEGER DEFAULT 0"))
+                        conn.execute(text(
+                            'UPDATE "user" SET unread_notifications = '
+                            '(SELECT COUNT(*) FROM notification n WHERE n.user_id = "user".id AND n.is_read = 0)'))
+                        conn.commit()
+                    except Exception as e:
+                        failures.append(e)
+                # after the user columns: the backfill reads fanout_on_read_since. One
+                # commit, so a failed backfill leaves the column to be added again
+                if 'fanout_on_read' not in video_cols:
+                    try:
+                        conn.execute(text("ALTER TABLE video ADD COLUMN fanout_on_read BOOLEAN DEFAULT 0"))
+                        # uploads merged at read time before the flag existed
+                        conn.execute(text(
+                            'UPDATE video SET fanout_on_read = 1 WHERE EXISTS (SELECT 1 FROM "user" u '
+                            'WHERE u.id = video.user_id AND u.fanout_on_read_since IS NOT NULL '
+                            'AND video.upload_date >= u.fanout_on_read_since)'))
+                        conn.commit()
+                    except Exception as e:
+                        conn.rollback()
+                        failures.append(e)
+
+            # indexes added after the tables were first created
+            with db.engine.connect() as conn:
+                try:
+                    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_subscription_channel ON subscription (channel_id, id)"))
+                    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_subscription_channel_subscriber ON subscription (channel_id, subscriber_id, id)"))
+                    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_notification_user_created ON notification (user_id, created_at, id)"))
+                    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_comment_video_posted ON comment (video_id, date_posted, id)"))
+                    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_watch_later_user_added ON watch_later (user_id, added_at, id)"))
+                    conn.commit()
+                except Exception as e:
+                    failures.append(e)
+
+            # playlist positions: number existing entries in insertion order
+            try:
+                pv_cols = [c['name'] for c in inspector.get_columns('playlist_video')]
+            except Exception:
+                pv_cols = []
+            with db.engine.connect() as conn:
+                try:
+                    if pv_cols and 'position' not in pv_cols:
+                        conn.execute(text("ALTER TABLE playlist_video ADD COLUMN position INTEGER"))
+                    conn.execute(text(
+                        "UPDATE playlist_video SET position = (SELECT COUNT(*) FROM playlist_video p2 "
+                        "WHERE p2.playlist_id = playlist_video.playlist_id AND p2.id <= playlist_video.id) "
+                        "WHERE position IS NULL"))
+                    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_playlist_video_position ON playlist_video (playlist_id, position, id)"))
+                    conn.commit()
+                except Exception as e:
+                    failures.append(e)
+
+            if not failures:
+                with db.engine.connect() as conn:
+                    startup.set_schema_version(conn, 'test', SCHEMA_VERSION)
+        except Exception as e:
             # if inspector or engine access fails, just continue
-            pass
+            failures.append(e)
+        for e in failures:
+            print(f"Migration error (will retry on next start): {e}")
+
 
+# Spawned worker processes (mediapool, the caption pool) re-import the main
+# script as __mp_main__; they only need its definitions, not a database setup
+# and a replica sync thread of their own
+IN_WORKER = __name__ == '__mp_main__'
 
 # Initialize DB and uploads at import time so the app is ready on start
-init_db()
+_startup.mark('config')
+if not IN_WORKER:
+    init_db()
+    database.start_replica_sync(app)
+_startup.mark('database')
 
 @main_bp.route('/')
+@replica_reads
 def home():
     # Base query for visible videos
     base_query = Video.query.filter_by(status='ready')
@@ -588,6 +764,7 @@ def home():
                 show_extra_sections = False
         except Exception as e:
             print(f"Recommendation error: {e}")
+            metrics.error('recommendations', e)
             # Fallback on error
             all_public = Video.query.filter_by(is_public=True).all()
             for_you = random.sample(all_public, min(len(all_public), 4)) if all_public else []
@@ -614,6 +791,7 @@ def home():
 
 @main_bp.route('/playlists')
 @login_required
+@replica_reads
 def playlists():
     user_playlists = Playlist.query.filter_by(user_id=current_user.id).order_by(Playlist.created_at.desc()).all()
     return render_template('playlists.html', title='My Playlists', playlists=user_playlists)
@@ -632,13 +810,18 @@ def create_playlist():
 
 
 @main_bp.route('/playlist/<int:playlist_id>')
+@replica_reads
 def view_playlist(playlist_id):
     playlist = Playlist.query.get_or_404(playlist_id)
     if not playlist.is_public and (not current_user.is_authenticated or current_user.id != playlist.user_id):
         abort(403)
     
-    videos = [pv.video for pv in playlist.videos]
-    return render_template('playlist.html', title=playlist.name, playlist=playlist, videos=videos)
+    items, next_cursor = playlist_page(playlist.id, request.args.get('after'),
+                                       page_size(request.args.get('limit'), PLAYLIST_PAGE_SIZE))
+    videos = [pv.video for pv in items if pv.video]
+    video_count = PlaylistVideo.query.filter_by(playlist_id=playlist.id).count()
+    return render_template('playlist.html', title=playlist.name, playlist=playlist, videos=videos,
+                           video_count=video_count, next_cursor=next_cursor)
 
 
 @main_bp.route('/playlist/<int:playlist_id>/add/<int:video_id>', methods=['POST'])
@@ -650,9 +833,11 @@ def add_to_playlist(playlist_id, video_id):
     
     exists = PlaylistVideo.query.filter_by(playlist_id=playlist_id, video_id=video_id).first()
     if not exists:
-        pv = PlaylistVideo(playlist_id=playlist_id, video_id=video_id)
+        # append at the end; positions give the playlist a stable order
+        last = db.session.query(db.func.max(PlaylistVideo.position)).filter_by(playlist_id=playlist_id).scalar()
+        pv = PlaylistVideo(playlist_id=playlist_id, video_id=video_id, position=(last or 0) + 1)
         db.session.add(pv)
-        db.session.commit()
+        bump_playlist_version(playlist_id, video_id, added=True)
         if is_ajax(request):
             return jsonify({'success': True, 'is_saved_in_any': True})
         flash('Added to playlist')
@@ -673,14 +858,11 @@ def remove_from_playlist(playlist_id, video_id):
     pv = PlaylistVideo.query.filter_by(playlist_id=playlist_id, video_id=video_id).first()
     if pv:
         db.session.delete(pv)
-        db.session.commit()
+        version = bump_playlist_version(playlist_id, video_id, added=False)
         
         # Check if saved in any other playlist
-        user_playlists = Playlist.query.filter_by(user_id=current_user.id).all()
-        is_saved_in_any = False
-        if user_playlists:
-            p_ids = [p.id for p in user_playlists]
-            is_saved_in_any = PlaylistVideo.query.filter(PlaylistVideo.playlist_id.in_(p_ids), PlaylistVideo.video_id == video_id).first() is not None
+        saved = cache.playlist_map(db.session, current_user.id, version)
+        is_saved_in_any = bool(saved.get(video_id))
             
         if is_ajax(request):
             return jsonify({'success': True, 'is_saved_in_any': is_saved_in_any})
@@ -691,10 +873,12 @@ def remove_from_playlist(playlist_id, video_id):
 
 @main_bp.route('/watch-later')
 @login_required
+@replica_reads
 def watch_later():
-    wl_items = WatchLater.query.filter_by(user_id=current_user.id).order_by(WatchLater.added_at.desc()).all()
-    videos = [item.video for item in wl_items]
-    return render_template('watch_later.html', title='Watch Later', videos=videos)
+    wl_items, next_cursor = watch_later_page(current_user.id, request.args.get('before'),
+                                             page_size(request.args.get('limit'), PLAYLIST_PAGE_SIZE))
+    videos = [item.video for item in wl_items if item.video]
+    return render_template('watch_later.html', title='Watch Later', videos=videos, next_cursor=next_cursor)
 
 
 @main_bp.route('/watch-later/add/<int:video_id>', methods=['POST'])
@@ -732,18 +916,10 @@ def remove_from_watch_later(video_id):
     return redirect(url_for('main.watch_later'))
 
 
-@main_bp.route('/search')
-def search():
-    query = request.args.get('q', '').strip()
-    if not query:
-        return redirect(url_for('main.home'))
-    
-    # Process natural language/voice commands
-    clean_query = voice.process_command(query)
-    
+def search_videos(clean_query):
     # Search in video title, description, and uploader name
     search_pattern = f"%{clean_query}%"
-    videos = Video.query.join(Video.uploader).filter(
+    return Video.query.join(Video.uploader).filter(
         (Video.is_public == True) &
         (
             (Video.title.ilike(search_pattern)) |
@@ -751,12 +927,26 @@ def search():
             (User.username.ilike(search_pattern)) |
             (User.display_name.ilike(search_pattern))
         )
-    ).order_by(Video.upload_date.desc()).all()
+    ).order_by(Video.upload_date.desc())
+
+
+@main_bp.route('/search')
+@replica_reads
+def search():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return redirect(url_for('main.home'))
+    
+    # Process natural language/voice commands
+    clean_query = voice.process_command(query)
+    
+    videos = search_videos(clean_query).all()
     
     return render_template('search.html', title=f"Search: {clean_query}", query=clean_query, videos=videos)
 
 
 @main_bp.route('/search/suggestions')
+@replica_reads
 def search_suggestions():
     query = request.args.get('q', '').strip()
     suggestions = []
@@ -783,6 +973,12 @@ def voice_search_api():
     if audio_file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
 
+    # speech libraries are only needed here; importing them at startup costs seconds
+    import speech_recognition as sr
+    import static_ffmpeg
+    from vosk import Model, KaldiRecognizer
+    import wave
+
     try:
         static_ffmpeg.add_paths()
     except Exception:
@@ -859,6 +1055,7 @@ def voice_search_api():
         return jsonify({'error': 'Audio conversion failed'}), 500
     except Exception as e:
         print(f"Voice search error: {e}")
+        metrics.error('voice_search', e)
         import traceback
         traceback.print_exc()
         return jsonify({'error': 'Voice processing failed'}), 500
@@ -879,8 +1076,16 @@ def login():
     if request.method == 'POST':
         email = request.form.get('email')
         password = request.form.get('password')
+        if not login_allowed(request.remote_addr, email):
+            flash('Too many login attempts. Please wait a minute and try again.')
+            return render_template('login.html', title="Login"), 429
         user = User.query.filter_by(email=email).first()
-        if user and check_password_hash(user.password, password):
+        try:
+            authenticated = authenticate(db.session, user, password)
+        except PasswordBusy:
+            flash('The server is busy. Please try again in a moment.')
+            return render_template('login.html', title="Login"), 503
+        if authenticated:
             login_user(user)
             return redirect(url_for('main.home'))
         flash('Login failed. Check your email and password.')
@@ -943,7 +1148,7 @@ def register():
             username=username,
             display_name=display_name,
             email=email, 
-            password=generate_password_hash(password, method='pbkdf2:sha256'),
+            password=hash_password(password),
             date_of_birth=date_of_birth,
             gender=gender if gender else None,
             location=location if location else None,
@@ -953,6 +1158,7 @@ def register():
         )
         db.session.add(new_user)
         db.session.commit()
+        images.generate_async(app, db, profile_pic_path, 'avatar')
         login_user(new_user)
         flash('Account created successfully!')
         return redirect(url_for('main.home'))
@@ -967,22 +1173,25 @@ def logout():
 @main_bp.route('/settings', methods=['GET', 'POST'])
 @login_required
 def settings():
+    user = current_user_record()
     if request.method == 'POST':
-        current_user.username = request.form.get('username')
-        current_user.display_name = request.form.get('display_name')
-        current_user.email = request.form.get('email')
-        current_user.gender = request.form.get('gender')
-        current_user.location = request.form.get('location')
-        current_user.bio = request.form.get('bio')
-        current_user.notifications_enabled = 'notifications_enabled' in request.form
+        user.username = request.form.get('username')
+        user.display_name = request.form.get('display_name')
+        user.email = request.form.get('email')
+        user.gender = request.form.get('gender')
+        user.location = request.form.get('location')
+        user.bio = request.form.get('bio')
+        user.notifications_enabled = 'notifications_enabled' in request.form
         
         dob_str = request.form.get('date_of_birth')
         if dob_str:
             try:
-                current_user.date_of_birth = datetime.strptime(dob_str, '%Y-%m-%d').date()
+                user.date_of_birth = datetime.strptime(dob_str, '%Y-%m-%d').date()
             except ValueError:
                 pass
 
+        new_profile_pic = None
+        old_profile_pic = user.profile_pic
         if 'profile_pic' in request.files:
             file = request.files['profile_pic']
             if file and file.filename:
@@ -994,20 +1203,29 @@ def settings():
                     os.makedirs(profiles_dir, exist_ok=True)
                     save_path = os.path.join(profiles_dir, save_name)
                     file.save(save_path)
-                    current_user.profile_pic = f"profiles/{save_name}"
+                    user.profile_pic = f"profiles/{save_name}"
+                    new_profile_pic = user.profile_pic
         
         try:
             db.session.commit()
+            identity.invalidate(user.id)
+            images.generate_async(app, db, new_profile_pic, 'avatar')
+            if new_profile_pic:
+                unused = images.release(db.session, old_profile_pic)
+                db.session.commit()
+                images.delete_files(app.config['UPLOAD_FOLDER'], unused)
             flash('Profile updated successfully')
+            return redirect(url_for('main.settings'))
         except Exception as e:
             db.session.rollback()
             flash('Error updating profile')
             
-    return render_template('settings.html', title='Settings')
+    return render_template('settings.html', title='Settings', user=user)
 
 
 @main_bp.route('/subscriptions')
 @login_required
+@replica_reads
 def subscriptions():
     # 1. Get subscribed channels
     subs = Subscription.query.filter_by(subscriber_id=current_user.id).all()
@@ -1040,13 +1258,49 @@ def subscriptions():
 @main_bp.route('/notifications')
 @login_required
 def notifications():
-    notifs = Notification.query.filter_by(user_id=current_user.id).order_by(Notification.created_at.desc()).all()
-    # Mark as read
-    for n in notifs:
-        if not n.is_read:
-            n.is_read = True
-    db.session.commit()
-    return render_template('notifications.html', title='Notifications', notifications=notifs)
+    cursor = request.args.get('before')
+    limit = page_size(request.args.get('limit'))
+    after = decode_cursor(cursor)
+    stored, more = keyset_page(
+        Notification.query.filter_by(user_id=current_user.id),
+        Notification.created_at, Notification.id, after, limit)
+
+    # Uploads from large channels are not fanned out on write; merge them in.
+    # Both kinds are ordered by (created_at, id), merged uploads using
+    # -video_id so they sort after stored rows of the same instant and the
+    # page cursor can point at either kind.
+    items = [((n.created_at, n.id), n) for n in stored]
+    seen_at = current_user_record().notifications_seen_at
+    events = channel_upload_events(db.session, current_user.id, limit=limit + 1,
+                                   before=after[0] if after else None, inclusive=True)
+    for e in events:
+        created_at = e.created_at
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+        key = (created_at, -e.video_id)
+        if after and key >= after:
+            continue
+        items.append((key, UploadEvent(
+            message=f"{e.username} uploaded: {e.title}",
+            link=url_for('main.watch', video_id=e.video_id),
+            is_read=bool(seen_at and created_at <= seen_at),
+            created_at=created_at)))
+    items.sort(key=lambda item: item[0], reverse=True)
+    more = more or len(items) > limit or len(events) > limit
+    items = items[:limit]
+    next_cursor = encode_cursor(*items[-1][0]) if more and items else None
+    notifs = [n for _, n in items]
+
+    # Render first so this visit still highlights what was unread, then mark
+    # read only what was shown. Merged uploads are read up to a time, which
+    # moves to now when the newest page held every unread one.
+    page = render_template('notifications.html', title='Notifications',
+                           notifications=notifs, next_cursor=next_cursor)
+    shown_all_unread = not more or (seen_at is not None and items[-1][0][0] <= seen_at)
+    mark_read(db.session, current_user.id, [n.id for n in notifs if isinstance(n, Notification)],
+              seen_at=datetime.utcnow() if not cursor and shown_all_unread else None)
+    identity.invalidate(current_user.id)
+    return page
 
 
 def transcode_video(input_path, output_path, height):
@@ -1066,93 +1320,116 @@ def transcode_video(input_path, output_path, height):
 
 def process_video_upload(app, video_id, video_path, save_name, timestamp):
     with app.app_context():
-        with app.test_request_context():
+        with app.test_request_context(), metrics.trace(video_id, db.session):
+            video = None
             try:
                 video = Video.query.get(video_id)
                 if not video:
                     return
 
-                # Generate thumbnail if not present
-                thumbnail_name = f"{timestamp}_thumb.jpg"
-                thumbnail_path = os.path.join(app.config['UPLOAD_FOLDER'], thumbnail_name)
-                if not video.thumbnail:
-                    generate_thumbnail(video_path, thumbnail_path)
-                
-                # Detect original height
-                original_height = 0
+                upload_dir = app.config['UPLOAD_FOLDER']
+                base_name = os.path.splitext(save_name)[0]
+                frames = {'height': 0, 'thumbnail': None, 'previews': None}
+                resolutions = []
+
+                # A re-upload of an earlier video takes over what was already made for it
                 try:
-                    cap = cv2.VideoCapture(video_path)
-                    if cap.isOpened():
-                        original_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                    cap.release()
-                except:
-                    pass
+                    fingerprint, duplicate_of, reuse = dedup.detect(db.session, upload_dir, video.id, video.user_id, save_name)
+                    original = Video.query.get(duplicate_of) if duplicate_of else None
+                except Exception as e:
+                    print(f"Duplicate check error: {e}")
+                    metrics.error('dedup', e)
+                    db.session.rollback()
+                    original = None
+                if original:
+                    frames['height'] = fingerprint['height']
+                    if reuse['renditions'] and original.resolutions:
+                        original_base = os.path.splitext(original.filename)[0]
+                        for res in json.loads(original.resolutions):
+                            if dedup.link_upload(upload_dir, f"{original_base}_{res}.mp4", f"{base_name}_{res}.mp4"):
+                                resolutions.append(res)
+                    if reuse['previews'] and original.preview_images:
+                        frames['previews'] = dedup.reuse_previews(upload_dir, json.loads(original.preview_images), timestamp)
+                    if reuse['thumbnail'] and original.thumbnail and not video.thumbnail:
+                        thumb_name = f"{timestamp}_thumb{os.path.splitext(original.thumbnail)[1]}"
+                        if dedup.link_upload(upload_dir, original.thumbnail, thumb_name):
+                            frames['thumbnail'] = thumb_name
+                            if images.variants_for(db.session, original.thumbnail):
+                                images.generate_async(app, db, thumb_name, 'thumbnail')
+                    if reuse['captions'] and original.captions and not video.captions:
+                        captions_name = f"{timestamp}_captions{os.path.splitext(original.captions)[1]}"
+                        if dedup.link_upload(upload_dir, original.captions, captions_name):
+                            video.captions = captions_name
+
+                # Thumbnail, source height and preview sprite in one decode pass on a
+                # media worker (media.generate_previews records its probe/decode/thumbnail/previews stages)
+                if not (frames['previews'] and (video.thumbnail or frames['thumbnail'])):
+                    try:
+                        made = mediapool.make_sprite(video_path, upload_dir, timestamp,
+                                                     thumbnail=not (video.thumbnail or frames['thumbnail']))
+                        frames = {'height': made['height'], 'thumbnail': frames['thumbnail'] or made['thumbnail'],
+                                  'previews': frames['previews'] or made['previews']}
+                    except Exception as e:
+                        print(f"Preview generation error: {e}")
+                        metrics.error('previews', e)
+                original_height = frames['height']
 
                 # Transcode
-                resolutions = []
-                base_name = os.path.splitext(save_name)[0]
                 for res in [720, 480, 360]:
                     # Don't upscale
                     if original_height > 0 and res >= original_height:
                         continue
-                        
-                    res_name = f"{base_name}_{res}p.mp4"
-                    res_path = os.path.join(app.config['UPLOAD_FOLDER'], res_name)
-                    if transcode_video(video_path, res_path, res):
-                        resolutions.append(f"{res}p")
+                    if f"{res}p" in resolutions:
+                        continue
 
-                # Generate preview images (10 frames)
-                preview_images = []
-                try:
-                    cap = cv2.VideoCapture(video_path)
-                    if cap.isOpened():
-                        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                        if total_frames > 0:
-                            for i in range(10):
-                                frame_idx = int(total_frames * (i / 10))
-                                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-                                ret, frame = cap.read()
-                                if ret:
-                                    p_name = f"{timestamp}_preview_{i}.jpg"
-                                    p_path = os.path.join(app.config['UPLOAD_FOLDER'], p_name)
-                                    # Resize to small
-                                    frame = cv2.resize(frame, (160, 90))
-                                    cv2.imwrite(p_path, frame)
-                                    preview_images.append(p_name)
-                    cap.release()
-                except Exception as e:
-                    print(f"Preview generation error: {e}")
+                    res_name = f"{base_name}_{res}p.mp4"
+                    res_path = os.path.join(upload_dir, res_name)
+                    with metrics.stage(f'transcode_{res}p') as span:
+                        if transcode_video(video_path, res_path, res):
+                            resolutions.append(f"{res}p")
+                        else:
+                            span.fail()
 
                 # Update video
                 if not video.thumbnail:
-                    video.thumbnail = thumbnail_name if os.path.exists(thumbnail_path) else None
+                    video.thumbnail = frames['thumbnail']
                 video.resolutions = json.dumps(resolutions) if resolutions else None
                 video.height = original_height if original_height > 0 else None
                 video.status = 'ready'
-                video.preview_images = json.dumps(preview_images) if preview_images else None
+                video.preview_images = json.dumps(frames['previews']) if frames['previews'] else None
                 
-                # Notify subscribers
-                try:
-                    subscribers = Subscription.query.filter_by(channel_id=video.user_id).all()
-                    for sub in subscribers:
-                        subscriber = User.query.get(sub.subscriber_id)
-                        if subscriber and getattr(subscriber, 'notifications_enabled', True):
-                            notif = Notification(
-                                user_id=subscriber.id,
-                                message=f"{video.uploader.username} uploaded: {video.title}",
-                                link=url_for('main.watch', video_id=video.id)
-                            )
-                            db.session.add(notif)
-                except Exception as e:
-                    print(f"Notification error: {e}")
-
                 db.session.commit()
+                if video.upload_date:
+                    metrics.record_stage(metrics.UPLOAD_TO_READY, (datetime.utcnow() - video.upload_date).total_seconds())
+
+                # Notify subscribers as a separate chunked job, outside the transaction above
+                notify = threading.Thread(target=notify_subscribers, args=(
+                    app, video.id, video.user_id,
+                    f"{video.uploader.username} uploaded: {video.title}",
+                    url_for('main.watch', video_id=video.id)))
+                notify.daemon = True
+                notify.start()
                 
             except Exception as e:
                 print(f"Background upload error: {e}")
+                metrics.error('upload_processing', e)
                 if video:
                     video.status = 'failed'
                     db.session.commit()
+                    if video.upload_date:
+                        metrics.record_stage(metrics.UPLOAD_TO_READY,
+                                             (datetime.utcnow() - video.upload_date).total_seconds(), 'failed')
+
+def notify_subscribers(app, video_id, channel_id, message, link):
+    with app.app_context(), metrics.trace(video_id, db.session):
+        try:
+            with metrics.stage('notification_fanout'):
+                fan_out_upload(db.session, channel_id, message, link, video_id=video_id)
+            maybe_compact(db.session)
+        except Exception as e:
+            print(f"Notification error: {e}")
+            metrics.error('notification_fanout', e)
+            db.session.rollback()
 
 @main_bp.route('/api/video/<int:video_id>/heatmap', methods=['GET', 'POST'])
 def video_heatmap(video_id):
@@ -1173,6 +1450,7 @@ def video_heatmap(video_id):
                 return jsonify({'success': True})
         except Exception as e:
             print(f"Heatmap update error: {e}")
+            metrics.error('heatmap', e)
             return jsonify({'error': 'Failed to update heatmap'}), 400
             
     # GET
@@ -1245,6 +1523,7 @@ def upload():
             )
             db.session.add(new_video)
             db.session.commit()
+            images.generate_async(app, db, thumbnail_filename, 'thumbnail')
             
             # Start background task
             thread = threading.Thread(target=process_video_upload, args=(app, new_video.id, video_path, save_name, timestamp))
@@ -1281,6 +1560,7 @@ def watch(video_id):
             print(f"[VIEW DEBUG] Owner viewing - no increment")
     except Exception as e:
         print(f"[VIEW DEBUG] Error: {e}")
+        metrics.error('view_count', e)
         db.session.rollback()
 
     # recommended: use ML engine for logged in users, else fallback
@@ -1308,8 +1588,8 @@ def watch(video_id):
     likes = Reaction.query.filter_by(video_id=video_id, type=1).count()
     dislikes = Reaction.query.filter_by(video_id=video_id, type=-1).count()
 
-    # fetch comments
-    comments = Comment.query.filter_by(video_id=video_id).order_by(Comment.date_posted.desc()).all()
+    # first page of comments; the rest are fetched as the viewer scrolls
+    comments, comments_cursor = comments_page(video_id)
 
     is_liked = False
     is_disliked = False
@@ -1330,9 +1610,8 @@ def watch(video_id):
         user_playlists = Playlist.query.filter_by(user_id=current_user.id).all()
         is_watch_later = WatchLater.query.filter_by(user_id=current_user.id, video_id=video_id).first() is not None
         if user_playlists:
-            p_ids = [p.id for p in user_playlists]
-            existing = PlaylistVideo.query.filter(PlaylistVideo.playlist_id.in_(p_ids), PlaylistVideo.video_id == video_id).all()
-            saved_playlist_ids = [e.playlist_id for e in existing]
+            saved = cache.playlist_map(db.session, current_user.id, current_user.playlist_version)
+            saved_playlist_ids = list(saved.get(video_id, ()))
             is_saved = len(saved_playlist_ids) > 0
 
     # Prepare resolutions list
@@ -1361,13 +1640,85 @@ def watch(video_id):
 
     return render_template('watch.html', title=video.title, video=video, recommended=recommended,
                            likes=likes, dislikes=dislikes, is_liked=is_liked, is_disliked=is_disliked,
-                           is_subscribed=is_subscribed, comments=comments, resolutions=avail_resolutions,
+                           is_subscribed=is_subscribed, comments=comments, comments_cursor=comments_cursor, resolutions=avail_resolutions,
                            user_playlists=user_playlists, is_watch_later=is_watch_later, is_saved=is_saved,
                            saved_playlist_ids=saved_playlist_ids)
 
+def comment_json(comment):
+    """Fields the watch page script needs to render one comment."""
+    user = comment.user
+    return {
+        'id': comment.id,
+        'content': comment.content,
+        'user': user.display_name or user.username,
+        'user_url': url_for('main.user_profile', username=user.username),
+        'profile_pic': url_for('main.uploaded_file', filename=user.profile_pic) if user.profile_pic else None,
+        'initial': user.username[0].upper(),
+        'date': format_date(comment.date_posted),
+        'can_delete': current_user.is_authenticated and current_user.id in (comment.user_id, comment.video.user_id),
+    }
+
+def current_user_record():
+    """The logged-in user's User row; current_user itself is a cached read-only snapshot."""
+    return db.session.get(User, current_user.id)
+
+def bump_playlist_version(playlist_id, video_id, added):
+    """
+    Commit a playlist change under a new playlist_version and carry the
+    current user's cached map over with it. Returns the new version.
+    """
+    version = cache.next_playlist_version(db.session, current_user.id)
+    db.session.commit()
+    # the snapshot carries playlist_version
+    identity.invalidate(current_user.id)
+    # this write alone moved the version from version - 1
+    cache.update_playlist_map(current_user.id, version - 1, version, video_id, playlist_id, added)
+    return version
+
+def drop_from_playlists(video_id):
+    """Remove a deleted video from every playlist, with a new playlist_version for each owner (caller commits)."""
+    owners = [r[0] for r in db.session.query(Playlist.user_id).join(PlaylistVideo, PlaylistVideo.playlist_id == Playlist.id)
+              .filter(PlaylistVideo.video_id == video_id).distinct()]
+    PlaylistVideo.query.filter_by(video_id=video_id).delete()
+    for user_id in owners:
+        cache.next_playlist_version(db.session, user_id)
+        identity.invalidate(user_id)
+
+def playlist_page(playlist_id, cursor=None, limit=PLAYLIST_PAGE_SIZE):
+    """Playlist entries in position order, with their videos and uploaders in the same query."""
+    return keyset_page(
+        PlaylistVideo.query.options(joinedload(PlaylistVideo.video).joinedload(Video.uploader))
+        .filter_by(playlist_id=playlist_id),
+        PlaylistVideo.position, PlaylistVideo.id, cursor, limit, ascending=True)
+
+def watch_later_page(user_id, cursor=None, limit=PLAYLIST_PAGE_SIZE):
+    """Newest-first Watch Later entries, with their videos and uploaders in the same query."""
+    return keyset_page(
+        WatchLater.query.options(joinedload(WatchLater.video).joinedload(Video.uploader))
+        .filter_by(user_id=user_id),
+        WatchLater.added_at, WatchLater.id, cursor, limit)
+
+def comments_page(video_id, cursor=None, limit=COMMENTS_PAGE_SIZE):
+    """Newest-first page of a video's comments with their authors loaded in the same query."""
+    return keyset_page(
+        Comment.query.options(joinedload(Comment.user)).filter_by(video_id=video_id),
+        Comment.date_posted, Comment.id, cursor, limit)
+
 def is_ajax(request):
     return request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.args.get('ajax')
 
+@main_bp.route('/api/video/<int:video_id>/comments')
+@replica_reads
+def video_comments(video_id):
+    video = Video.query.get_or_404(video_id)
+    # same visibility rule as the watch page
+    if not getattr(video, 'is_public', True):
+        if not (current_user.is_authenticated and current_user.id == video.user_id):
+            abort(404)
+    comments, next_cursor = comments_page(video.id, request.args.get('before'),
+                                          page_size(request.args.get('limit'), COMMENTS_PAGE_SIZE))
+    return jsonify({'comments': [comment_json(c) for c in comments], 'next_cursor': next_cursor})
+
 @main_bp.route('/video/<int:video_id>/comment', methods=['POST'])
 def add_comment(video_id):
     if not current_user.is_authenticated:
@@ -1395,18 +1746,7 @@ def add_comment(video_id):
     db.session.commit()
     
     if is_ajax(request):
-        return jsonify({
-            'success': True,
-            'comment': {
-                'id': comment.id,
-                'content': comment.content,
-                'user': current_user.display_name or current_user.username,
-                'user_url': url_for('main.user_profile', username=current_user.username),
-                'profile_pic': url_for('main.uploaded_file', filename=current_user.profile_pic) if current_user.profile_pic else None,
-                'initial': current_user.username[0].upper(),
-                'date': format_date(comment.date_posted)
-            }
-        })
+        return jsonify({'success': True, 'comment': comment_json(comment)})
         
     flash('Comment added')
     return redirect(url_for('main.watch', video_id=video_id))
@@ -1440,6 +1780,7 @@ def uploaded_file(filename):
 # Minimal stubs for endpoints referenced by templates originally written for a blueprint.
 # These are lightweight and redirect back to home or the referrer so `url_for` works.
 @main_bp.route('/user/<string:username>')
+@replica_reads
 def user_profile(username):
     # Render a simple channel page showing the user's public videos.
     channel = User.query.filter_by(username=username).first()
@@ -1523,12 +1864,13 @@ def user_profile(username):
     # Playlists and Watch Later (only for owner)
     playlists = []
     watch_later_videos = []
+    watch_later_cursor = None
     if current_user.is_authenticated and current_user.id == channel.id:
         playlists = Playlist.query.filter_by(user_id=channel.id).order_by(Playlist.created_at.desc()).all()
-        wl_items = WatchLater.query.filter_by(user_id=channel.id).order_by(WatchLater.added_at.desc()).all()
-        watch_later_videos = [item.video for item in wl_items]
+        wl_items, watch_later_cursor = watch_later_page(channel.id)
+        watch_later_videos = [item.video for item in wl_items if item.video]
 
-    return render_template('user.html', title=display_name_val, channel=channel, videos=videos, subs_count=subs_count, is_subscribed=is_subscribed, analytics=analytics_data, playlists=playlists, watch_later_videos=watch_later_videos)
+    return render_template('user.html', title=display_name_val, channel=channel, videos=videos, subs_count=subs_count, is_subscribed=is_subscribed, analytics=analytics_data, playlists=playlists, watch_later_videos=watch_later_videos, watch_later_cursor=watch_later_cursor)
 
 
 @main_bp.route('/subscribe/<int:channel_id>', methods=['POST'])
@@ -1596,10 +1938,15 @@ def delete_video(video_id):
         # Delete related records manually to avoid FK constraint errors
         Reaction.query.filter_by(video_id=video.id).delete()
         ViewHistory.query.filter_by(video_id=video.id).delete()
+        VideoStageTiming.query.filter_by(video_id=video.id).delete()
         Comment.query.filter_by(video_id=video.id).delete()
+        dedup.forget(db.session, video.id)
+        drop_from_playlists(video.id)
 
         db.session.delete(video)
+        unused = images.release(db.session, video.thumbnail)
         db.session.commit()
+        images.delete_files(app.config['UPLOAD_FOLDER'], unused)
         flash('Video deleted')
     except Exception as e:
         print(f"Delete error: {e}")
@@ -1644,6 +1991,8 @@ def edit_video(video_id):
         video.tags = request.form.get('tags')
         
         # Handle thumbnail update if provided
+        new_thumbnail = None
+        old_thumbnail = video.thumbnail
         if 'thumbnail' in request.files:
             file = request.files['thumbnail']
             if file and file.filename != '':
@@ -1652,8 +2001,14 @@ def edit_video(video_id):
                 save_name = f"{timestamp}_thumb_{filename}"
                 file.save(os.path.join(app.config['UPLOAD_FOLDER'], save_name))
                 video.thumbnail = save_name
+                new_thumbnail = save_name
 
         db.session.commit()
+        images.generate_async(app, db, new_thumbnail, 'thumbnail')
+        if new_thumbnail:
+            unused = images.release(db.session, old_thumbnail)
+            db.session.commit()
+            images.delete_files(app.config['UPLOAD_FOLDER'], unused)
         flash('Video updated')
         return redirect(url_for('main.watch', video_id=video.id))
         
@@ -1707,84 +2062,18 @@ def react_video(video_id):
 
 app.register_blueprint(auth_bp)
 app.register_blueprint(main_bp)
+_startup.mark('routes')
+app.config['STARTUP_TIMINGS'] = _startup.as_dict()
+if not IN_WORKER:
+    _startup.report('test.py startup')
 
 # ==========================================
 # MAIN EXECUTION
 # ==========================================
 
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-        # Ensure new columns exist in sqlite table (simple migration for test environment)
-        try:
-            inspector = inspect(db.engine)
-            cols = [c['name'] for c in inspector.get_columns('video')]
-            with db.engine.connect() as conn:
-                if 'is_public' not in cols:
-                    try:
-                        conn.execute(text("ALTER TABLE video ADD COLUMN is_public BOOLEAN DEFAULT 1"))
-                    except Exception:
-                        pass
-                if 'thumbnail' not in cols:
-                    try:
-                        conn.execute(text("ALTER TABLE video ADD COLUMN thumbnail VARCHAR(200)"))
-                    except Exception:
-                        pass
-                if 'resolutions' not in cols:
-                    try:
-                        conn.execute(text("ALTER TABLE video ADD COLUMN resolutions VARCHAR(200)"))
-                    except Exception:
-                        pass
-                if 'height' not in cols:
-                    try:
-                        conn.execute(text("ALTER TABLE video ADD COLUMN height INTEGER"))
-                    except Exception:
-                        pass
-                if 'status' not in cols:
-                    try:
-                        conn.execute(text("ALTER TABLE video ADD COLUMN status VARCHAR(20) DEFAULT 'ready'"))
-                    except Exception:
-                        pass
-                if 'heatmap' not in cols:
-                    try:
-                        conn.execute(text("ALTER TABLE video ADD COLUMN heatmap TEXT DEFAULT '[]'"))
-                    except Exception:
-                        pass
-                if 'preview_images' not in cols:
-                    try:
-                        conn.execute(text("ALTER TABLE video ADD COLUMN preview_images TEXT"))
-                    except Exception:
-                        pass
-                # ensure user table has new profile columns
-                try:
-                    user_cols = [c['name'] for c in inspector.get_columns('user')]
-                    if 'display_name' not in user_cols:
-                        try:
-                            conn.execute(text("ALTER TABLE user ADD COLUMN display_name VARCHAR(150)"))
-                        except Exception:
-                            pass
-                    if 'location' not in user_cols:
-                        try:
-                            conn.execute(text("ALTER TABLE user ADD COLUMN location VARCHAR(150)"))
-                        except Exception:
-                            pass
-                    if 'date_of_birth' not in user_cols:
-                        try:
-                            conn.execute(text("ALTER TABLE user ADD COLUMN date_of_birth DATE"))
-                        except Exception:
-                            pass
-                    if 'date_joined' not in user_cols:
-                        try:
-                            conn.execute(text("ALTER TABLE user ADD COLUMN date_joined DATETIME"))
-                        except Exception:
-                            pass
-                except Exception:
-                    pass
-        except Exception:
-            # If inspector or alter fails, continue; this is best-effort for the test DB
-            pass
-        print("Database initialized.")
-        print("ViewFlow is running. Developed by Gautham Nair and Deepak Patel.")
+    # init_db() already ran at import
+    print("ViewFlow is running. Developed by Gautham Nair and Deepak Patel.")
         
     # Allow overriding port with PORT env var for local testing
     port = int(os.environ.get('PORT', 5000))
@@ -4,11 +4,25 @@ import random
 import threading
 from flask import Blueprint, render_template, request, redirect, url_for, send_from_directory, flash, current_app, abort, jsonify
 from werkzeug.utils import secure_filename
-from models import db, Video, User, Reaction, Subscription, Comment, ViewHistory, Playlist, PlaylistVideo, WatchLater
+from models import db, Video, User, Reaction, Subscription, Comment, ViewHistory, Playlist, PlaylistVideo, WatchLater, VideoStageTiming
 from flask_login import current_user, login_required
 from datetime import datetime
+from sqlalchemy.orm import joinedload
+from pagination import keyset_page, page_size
+from rendering import render_markdown
+from database import replica_reads
+import cache
+import metrics
+import mediapool
+import dedup
+import images
+import identity
 
 ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv'}
+# Comments rendered with the watch page; later pages come from /api/video/<id>/comments
+COMMENTS_PAGE_SIZE = 20
+# Playlist and Watch Later pages (the limit query argument is capped by pagination.MAX_PAGE_SIZE)
+PLAYLIST_PAGE_SIZE = 50
 
 main_bp = Blueprint('main', __name__)
 
@@ -22,7 +36,13 @@ def format_date(date):
     return date.strftime('%b %d, %Y')
 
 
+@main_bp.app_template_filter('markdown')
+def markdown_filter(text):
+    return render_markdown(text)
+
+
 @main_bp.route('/')
+@replica_reads
 def home():
     # Base query for visible videos
     base_query = Video.query
@@ -60,6 +80,7 @@ def home():
                 show_extra_sections = False
         except Exception as e:
             print(f"Recommendation error: {e}")
+            metrics.error('recommendations', e)
             # Fallback on error
             all_public = Video.query.filter_by(is_public=True).all()
             for_you = random.sample(all_public, min(len(all_public), 4)) if all_public else []
@@ -130,8 +151,8 @@ def watch(video_id):
     likes = Reaction.query.filter_by(video_id=video_id, type=1).count()
     dislikes = Reaction.query.filter_by(video_id=video_id, type=-1).count()
     
-    # fetch comments
-    comments = Comment.query.filter_by(video_id=video_id).order_by(Comment.date_posted.desc()).all()
+    # first page of comments; the rest are fetched as the viewer scrolls
+    comments, comments_cursor = comments_page(video_id)
     
     is_liked = False
     is_disliked = False
@@ -152,9 +173,8 @@ def watch(video_id):
         user_playlists = Playlist.query.filter_by(user_id=current_user.id).all()
         is_watch_later = WatchLater.query.filter_by(user_id=current_user.id, video_id=video_id).first() is not None
         if user_playlists:
-            p_ids = [p.id for p in user_playlists]
-            existing = PlaylistVideo.query.filter(PlaylistVideo.playlist_id.in_(p_ids), PlaylistVideo.video_id == video_id).all()
-            saved_playlist_ids = [e.playlist_id for e in existing]
+            saved = cache.playlist_map(db.session, current_user.id, current_user.playlist_version)
+            saved_playlist_ids = list(saved.get(video_id, ()))
             is_saved = len(saved_playlist_ids) > 0
 
     # detect auto-generated captions file (if any) matching the uploaded filename base
@@ -173,7 +193,7 @@ def watch(video_id):
 
     return render_template('watch.html', title=video.title, video=video, recommended=recommended,
                            likes=likes, dislikes=dislikes, is_liked=is_liked, is_disliked=is_disliked,
-                           is_subscribed=is_subscribed, comments=comments, user_playlists=user_playlists, is_watch_later=is_watch_later, is_saved=is_saved,
+                           is_subscribed=is_subscribed, comments=comments, comments_cursor=comments_cursor, user_playlists=user_playlists, is_watch_later=is_watch_later, is_saved=is_saved,
                            saved_playlist_ids=saved_playlist_ids, auto_caption_url=auto_caption_url)
 
 
@@ -182,6 +202,135 @@ def uploaded_file(filename):
     return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
 
 
+def _generate_thumbnail(app, vid_id, saved_path, orig_filename, ts):
+    try:
+        with app.app_context(), metrics.trace(vid_id, db.session):
+            thumbs_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'thumbnails')
+            os.makedirs(thumbs_dir, exist_ok=True)
+            thumb_name = f"{ts}_{os.path.splitext(orig_filename)[0]}.jpg"
+            thumb_path = os.path.join(thumbs_dir, thumb_name)
+
+            # score candidate frames and keep the best one
+            try:
+                with metrics.stage('thumbnail') as span:
+                    picked = mediapool.make_thumbnail(saved_path, thumb_path)
+                    if not picked:
+                        span.fail()
+            except Exception:
+                picked = False
+
+            if not picked:
+                # fall back to ffmpeg at the midpoint when OpenCV cannot read the file
+                probe_cmd = [
+                    'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+                    '-of', 'default=noprint_wrappers=1:nokey=1', saved_path
+                ]
+                with metrics.stage('probe'):
+                    proc = subprocess.run(probe_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=10)
+                duration = None
+                if proc.returncode == 0:
+                    try:
+                        duration = float(proc.stdout.strip())
+                    except Exception:
+                        duration = None
+
+                t = duration / 2 if duration and duration > 2 else 1.0
+
+                ff_cmd = [
+                    'ffmpeg', '-ss', str(t), '-i', saved_path,
+                    '-frames:v', '1', '-q:v', '2', thumb_path, '-y'
+                ]
+                with metrics.stage('thumbnail_ffmpeg'):
+                    subprocess.run(ff_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30)
+
+            # update video record with thumbnail path if file created
+            if os.path.exists(thumb_path):
+                rel = os.path.join('thumbnails', thumb_name)
+                v = Video.query.get(vid_id)
+                if v:
+                    v.thumbnail = rel
+                    db.session.commit()
+    except Exception as e:
+        metrics.error('thumbnail', e)
+        try:
+            db.session.rollback()
+        except Exception:
+            pass
+
+
+def _generate_captions(app, vid_id, saved_path, orig_filename, ts):
+    try:
+        with app.app_context(), metrics.trace(vid_id, db.session):
+            import captions
+            base = os.path.splitext(orig_filename)[0]
+            auto_name = f"{ts}_{base}_auto.vtt"
+            auto_path = os.path.join(app.config['UPLOAD_FOLDER'], auto_name)
+
+            # audio is decoded straight from an ffmpeg pipe, no intermediate WAV
+            if captions.generate_auto_captions(saved_path, auto_path, app.config.get('VOSK_MODEL_PATH')):
+                # update DB record with auto caption filename
+                try:
+                    v = Video.query.get(vid_id)
+                    if v:
+                        v.auto_captions = auto_name
+                        db.session.commit()
+                except Exception:
+                    try: db.session.rollback()
+                    except Exception: pass
+    except Exception as e:
+        metrics.error('captions', e)
+
+
+def _process_upload(app, vid_id, saved_path, orig_filename, ts):
+    """
+    Check the upload against earlier videos (dedup.detect), take over the
+    thumbnail and captions of an earlier copy where allowed, then start the
+    thumbnail and caption threads for whatever is still missing.
+    """
+    need_thumbnail = need_captions = True
+    try:
+        with app.app_context(), metrics.trace(vid_id, db.session):
+            upload_dir = app.config['UPLOAD_FOLDER']
+            v = Video.query.get(vid_id)
+            if v:
+                _, duplicate_of, reuse = dedup.detect(db.session, upload_dir, v.id, v.user_id,
+                                                      os.path.basename(saved_path))
+                original = Video.query.get(duplicate_of) if duplicate_of else None
+                if original:
+                    base = os.path.splitext(orig_filename)[0]
+                    if reuse['thumbnail'] and original.thumbnail:
+                        rel = os.path.join('thumbnails', f"{ts}_{base}{os.path.splitext(original.thumbnail)[1]}")
+                        if dedup.link_upload(upload_dir, original.thumbnail, rel):
+                            v.thumbnail = rel
+                            need_thumbnail = False
+                    if reuse['auto_captions'] and original.auto_captions:
+                        auto_name = f"{ts}_{base}_auto.vtt"
+                        if dedup.link_upload(upload_dir, original.auto_captions, auto_name):
+                            v.auto_captions = auto_name
+                            need_captions = False
+                    if reuse['captions'] and original.captions and not v.captions:
+                        captions_name = f"{ts}_captions{os.path.splitext(original.captions)[1]}"
+                        if dedup.link_upload(upload_dir, original.captions, captions_name):
+                            v.captions = captions_name
+                    db.session.commit()
+    except Exception as e:
+        metrics.error('dedup', e)
+        try:
+            db.session.rollback()
+        except Exception:
+            pass
+
+    if need_thumbnail:
+        thread = threading.Thread(target=_generate_thumbnail, args=(app, vid_id, saved_path, orig_filename, ts))
+        thread.daemon = True
+        thread.start()
+    if need_captions:
+        # does not overwrite user-provided captions
+        cap_thread = threading.Thread(target=_generate_captions, args=(app, vid_id, saved_path, orig_filename, ts))
+        cap_thread.daemon = True
+        cap_thread.start()
+
+
 @main_bp.route('/upload', methods=['GET', 'POST'])
 @login_required
 def upload():
@@ -233,167 +382,12 @@ def upload():
             db.session.add(new_video)
             db.session.commit()
 
-            # Start background thread to generate thumbnail without blocking upload
-            def _generate_thumbnail(app, vid_id, saved_path, orig_filename, ts):
-                try:
-                    with app.app_context():
-                        # get duration
-                        probe_cmd = [
-                            'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-                            '-of', 'default=noprint_wrappers=1:nokey=1', saved_path
-                        ]
-                        proc = subprocess.run(probe_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=10)
-                        duration = None
-                        if proc.returncode == 0:
-                            try:
-                                duration = float(proc.stdout.strip())
-                            except Exception:
-                                duration = None
-
-                        if duration and duration > 2:
-                            t = random.uniform(max(1.0, 0.1 * duration), max(1.5, 0.9 * duration))
-                        else:
-                            t = 1.0
-
-                        thumbs_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'thumbnails')
-                        os.makedirs(thumbs_dir, exist_ok=True)
-                        thumb_name = f"{ts}_{os.path.splitext(orig_filename)[0]}.jpg"
-                        thumb_path = os.path.join(thumbs_dir, thumb_name)
-
-                        ff_cmd = [
-                            'ffmpeg', '-ss', str(t), '-i', saved_path,
-                            '-frames:v', '1', '-q:v', '2', thumb_path, '-y'
-                        ]
-                        subprocess.run(ff_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30)
-
-                        # update video record with thumbnail path if file created
-                        if os.path.exists(thumb_path):
-                            rel = os.path.join('thumbnails', thumb_name)
-                            v = Video.query.get(vid_id)
-                            if v:
-                                v.thumbnail = rel
-                                db.session.commit()
-                except Exception:
-                    try:
-                        db.session.rollback()
-                    except Exception:
-                        pass
-
+            # Duplicate check, then thumbnail and caption threads, without blocking the upload
             app_obj = current_app._get_current_object()
-            thread = threading.Thread(target=_generate_thumbnail, args=(app_obj, new_video.id, save_path, filename, timestamp))
+            thread = threading.Thread(target=_process_upload, args=(app_obj, new_video.id, save_path, filename, timestamp))
             thread.daemon = True
             thread.start()
 
-            # Start background thread to auto-generate captions (does not overwrite user-provided captions)
-            def _generate_captions(app, vid_id, saved_path, orig_filename, ts):
-                try:
-                    with app.app_context():
-                        import shutil, subprocess, wave, json
-                        import speech_recognition as sr
-                        from vosk import Model, KaldiRecognizer
-                        UPLOAD_FOLDER = app.config['UPLOAD_FOLDER']
-
-                        base = os.path.splitext(orig_filename)[0]
-                        auto_name = f"{ts}_{base}_auto.vtt"
-                        auto_path = os.path.join(UPLOAD_FOLDER, auto_name)
-
-                        # Extract audio to WAV
-                        wav_path = os.path.join(UPLOAD_FOLDER, f"{ts}_{base}_audio.wav")
-                        try:
-                            subprocess.run(['ffmpeg', '-i', saved_path, '-ac', '1', '-ar', '16000', wav_path, '-y'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, timeout=120)
-                        except Exception:
-                            if os.path.exists(wav_path): os.remove(wav_path)
-                            return
-
-                        duration = None
-                        try:
-                            proc = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', saved_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=10)
-                            if proc.returncode == 0:
-                                duration = float(proc.stdout.strip())
-                        except Exception:
-                            duration = None
-
-                        transcript = ''
-                        # try Vosk offline if available
-                        try:
-                            model_path = app.config.get('VOSK_MODEL_PATH')
-                            if model_path and os.path.exists(model_path):
-                                wf = wave.open(wav_path, 'rb')
-                                model = Model(model_path)
-                                rec = KaldiRecognizer(model, wf.getframerate())
-                                rec.SetWords(False)
-                                while True:
-                                    buf = wf.readframes(4000)
-                                    if len(buf) == 0: break
-                                    rec.AcceptWaveform(buf)
-                                final = json.loads(rec.FinalResult())
-                                transcript = final.get('text', '')
-                                wf.close()
-                        except Exception:
-                            transcript = ''
-
-                        # fallback to Google (requires internet)
-                        if not transcript:
-                            try:
-                                r = sr.Recognizer()
-                                with sr.AudioFile(wav_path) as source:
-                                    audio_data = r.record(source)
-                                    transcript = r.recognize_google(audio_data)
-                            except Exception:
-                                transcript = ''
-
-                        # Build simple WebVTT by chunking words across duration
-                        if transcript:
-                            words = transcript.split()
-                            if duration and duration > 0:
-                                cue_len = 4.0
-                                cues = []
-                                i = 0
-                                wps = len(words) / duration if duration>0 else 2
-                                while i < len(words):
-                                    start_sec = (i / wps) if wps>0 else 0
-                                    j = i + int(cue_len * wps)
-                                    if j <= i: j = min(i+10, len(words))
-                                    end_sec = (j / wps) if wps>0 else (start_sec + cue_len)
-                                    text = ' '.join(words[i:j])
-                                    cues.append((start_sec, end_sec, text))
-                                    i = j
-                            else:
-                                cues = [(0.0, max(4.0, len(transcript.split())/2.0), transcript)]
-
-                            try:
-                                with open(auto_path, 'w', encoding='utf-8') as f:
-                                    f.write('WEBVTT\n\n')
-                                    for s,e,t in cues:
-                                        def fmt(x):
-                                            h = int(x//3600); m = int((x%3600)//60); sss = int(x%60); ms = int((x - int(x))*1000)
-                                            return f"{h:02d}:{m:02d}:{sss:02d}.{ms:03d}"
-                                        f.write(f"{fmt(s)} --> {fmt(e)}\n{t}\n\n")
-                                # update DB record with auto caption filename
-                                try:
-                                    v = Video.query.get(vid_id)
-                                    if v:
-                                        v.auto_captions = auto_name
-                                        db.session.commit()
-                                except Exception:
-                                    try: db.session.rollback()
-                                    except Exception: pass
-                            except Exception:
-                                pass
-
-                        if os.path.exists(wav_path):
-                            try: os.remove(wav_path)
-                            except Exception: pass
-                except Exception:
-                    try:
-                        pass
-                    except Exception:
-                        pass
-
-            cap_thread = threading.Thread(target=_generate_captions, args=(app_obj, new_video.id, save_path, filename, timestamp))
-            cap_thread.daemon = True
-            cap_thread.start()
-
             return redirect(url_for('main.home'))
         else:
             flash('File type not allowed')
@@ -421,8 +415,13 @@ def delete_video(video_id):
                 os.remove(tpath)
     except Exception:
         pass
+    VideoStageTiming.query.filter_by(video_id=video.id).delete()
+    dedup.forget(db.session, video.id)
+    drop_from_playlists(video.id)
     db.session.delete(video)
+    unused = images.release(db.session, video.thumbnail)
     db.session.commit()
+    images.delete_files(current_app.config['UPLOAD_FOLDER'], unused)
     flash('Video deleted')
     return redirect(url_for('main.home'))
 
@@ -442,6 +441,7 @@ def toggle_visibility(video_id):
 
 
 @main_bp.route('/user/<string:username>')
+@replica_reads
 def user_profile(username):
     user = User.query.filter_by(username=username).first_or_404()
     # show public videos or owner-only
@@ -460,13 +460,74 @@ def user_profile(username):
     # Playlists and Watch Later (only for owner)
     playlists = []
     watch_later_videos = []
+    watch_later_cursor = None
     if current_user.is_authenticated and current_user.id == user.id:
         playlists = Playlist.query.filter_by(user_id=user.id).order_by(Playlist.created_at.desc()).all()
-        wl_items = WatchLater.query.filter_by(user_id=user.id).order_by(WatchLater.added_at.desc()).all()
-        watch_later_videos = [item.video for item in wl_items]
-
-    return render_template('user.html', title=user.display_name or user.username, channel=user, videos=videos, subs_count=subs_count, is_subscribed=is_subscribed, playlists=playlists, watch_later_videos=watch_later_videos)
-
+        wl_items, watch_later_cursor = watch_later_page(user.id)
+        watch_later_videos = [item.video for item in wl_items if item.video]
+
+    return render_template('user.html', title=user.display_name or user.username, channel=user, videos=videos, subs_count=subs_count, is_subscribed=is_subscribed, playlists=playlists, watch_later_videos=watch_later_videos, watch_later_cursor=watch_later_cursor)
+
+
+def comment_json(comment):
+    """Fields the watch page script needs to render one comment."""
+    user = comment.user
+    return {
+        'id': comment.id,
+        'content': comment.content,
+        'user': user.display_name or user.username,
+        'user_url': url_for('main.user_profile', username=user.username),
+        'profile_pic': url_for('main.uploaded_file', filename=user.profile_pic) if user.profile_pic else None,
+        'initial': user.username[0].upper(),
+        'date': format_date(comment.date_posted),
+        'can_delete': current_user.is_authenticated and current_user.id in (comment.user_id, comment.video.user_id),
+    }
+
+def current_user_record():
+    """The logged-in user's User row; current_user itself is a cached read-only snapshot."""
+    return db.session.get(User, current_user.id)
+
+def bump_playlist_version(playlist_id, video_id, added):
+    """
+    Commit a playlist change under a new playlist_version and carry the
+    current user's cached map over with it. Returns the new version.
+    """
+    version = cache.next_playlist_version(db.session, current_user.id)
+    db.session.commit()
+    # the snapshot carries playlist_version
+    identity.invalidate(current_user.id)
+    # this write alone moved the version from version - 1
+    cache.update_playlist_map(current_user.id, version - 1, version, video_id, playlist_id, added)
+    return version
+
+def drop_from_playlists(video_id):
+    """Remove a deleted video from every playlist, with a new playlist_version for each owner (caller commits)."""
+    owners = [r[0] for r in db.session.query(Playlist.user_id).join(PlaylistVideo, PlaylistVideo.playlist_id == Playlist.id)
+              .filter(PlaylistVideo.video_id == video_id).distinct()]
+    PlaylistVideo.query.filter_by(video_id=video_id).delete()
+    for user_id in owners:
+        cache.next_playlist_version(db.session, user_id)
+        identity.invalidate(user_id)
+
+def playlist_page(playlist_id, cursor=None, limit=PLAYLIST_PAGE_SIZE):
+    """Playlist entries in position order, with their videos and uploaders in the same query."""
+    return keyset_page(
+        PlaylistVideo.query.options(joinedload(PlaylistVideo.video).joinedload(Video.uploader))
+        .filter_by(playlist_id=playlist_id),
+        PlaylistVideo.position, PlaylistVideo.id, cursor, limit, ascending=True)
+
+def watch_later_page(user_id, cursor=None, limit=PLAYLIST_PAGE_SIZE):
+    """Newest-first Watch Later entries, with their videos and uploaders in the same query."""
+    return keyset_page(
+        WatchLater.query.options(joinedload(WatchLater.video).joinedload(Video.uploader))
+        .filter_by(user_id=user_id),
+        WatchLater.added_at, WatchLater.id, cursor, limit)
+
+def comments_page(video_id, cursor=None, limit=COMMENTS_PAGE_SIZE):
+    """Newest-first page of a video's comments with their authors loaded in the same query."""
+    return keyset_page(
+        Comment.query.options(joinedload(Comment.user)).filter_by(video_id=video_id),
+        Comment.date_posted, Comment.id, cursor, limit)
 
 def is_ajax(request):
     return request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.args.get('ajax')
@@ -563,6 +624,18 @@ def react_video(video_id):
     
     return redirect(url_for('main.watch', video_id=video_id))
 
+@main_bp.route('/api/video/<int:video_id>/comments')
+@replica_reads
+def video_comments(video_id):
+    video = Video.query.get_or_404(video_id)
+    # same visibility rule as the watch page
+    if not video.is_public:
+        if not (current_user.is_authenticated and current_user.id == video.user_id):
+            abort(404)
+    comments, next_cursor = comments_page(video.id, request.args.get('before'),
+                                          page_size(request.args.get('limit'), COMMENTS_PAGE_SIZE))
+    return jsonify({'comments': [comment_json(c) for c in comments], 'next_cursor': next_cursor})
+
 @main_bp.route('/video/<int:video_id>/comment', methods=['POST'])
 def add_comment(video_id):
     if not current_user.is_authenticated:
@@ -590,18 +663,7 @@ def add_comment(video_id):
     db.session.commit()
     
     if is_ajax(request):
-        return jsonify({
-            'success': True,
-            'comment': {
-                'id': comment.id,
-                'content': comment.content,
-                'user': current_user.display_name or current_user.username,
-                'user_url': url_for('main.user_profile', username=current_user.username),
-                'profile_pic': url_for('main.uploaded_file', filename=current_user.profile_pic) if current_user.profile_pic else None,
-                'initial': current_user.username[0].upper(),
-                'date': format_date(comment.date_posted)
-            }
-        })
+        return jsonify({'success': True, 'comment': comment_json(comment)})
         
     flash('Comment added')
     return redirect(url_for('main.watch', video_id=video_id))
@@ -630,6 +692,7 @@ def delete_comment(comment_id):
 
 @main_bp.route('/playlists')
 @login_required
+@replica_reads
 def playlists():
     user_playlists = Playlist.query.filter_by(user_id=current_user.id).order_by(Playlist.created_at.desc()).all()
     return render_template('playlists.html', title='My Playlists', playlists=user_playlists)
@@ -648,13 +711,18 @@ def create_playlist():
 
 
 @main_bp.route('/playlist/<int:playlist_id>')
+@replica_reads
 def view_playlist(playlist_id):
     playlist = Playlist.query.get_or_404(playlist_id)
     if not playlist.is_public and (not current_user.is_authenticated or current_user.id != playlist.user_id):
         abort(403)
     
-    videos = [pv.video for pv in playlist.videos]
-    return render_template('playlist.html', title=playlist.name, playlist=playlist, videos=videos)
+    items, next_cursor = playlist_page(playlist.id, request.args.get('after'),
+                                       page_size(request.args.get('limit'), PLAYLIST_PAGE_SIZE))
+    videos = [pv.video for pv in items if pv.video]
+    video_count = PlaylistVideo.query.filter_by(playlist_id=playlist.id).count()
+    return render_template('playlist.html', title=playlist.name, playlist=playlist, videos=videos,
+                           video_count=video_count, next_cursor=next_cursor)
 
 
 @main_bp.route('/playlist/<int:playlist_id>/add/<int:video_id>', methods=['POST'])
@@ -666,9 +734,11 @@ def add_to_playlist(playlist_id, video_id):
     
     exists = PlaylistVideo.query.filter_by(playlist_id=playlist_id, video_id=video_id).first()
     if not exists:
-        pv = PlaylistVideo(playlist_id=playlist_id, video_id=video_id)
+        # append at the end; positions give the playlist a stable order
+        last = db.session.query(db.func.max(PlaylistVideo.position)).filter_by(playlist_id=playlist_id).scalar()
+        pv = PlaylistVideo(playlist_id=playlist_id, video_id=video_id, position=(last or 0) + 1)
         db.session.add(pv)
-        db.session.commit()
+        bump_playlist_version(playlist_id, video_id, added=True)
         if is_ajax(request):
             return jsonify({'success': True, 'is_saved_in_any': True})
         flash('Added to playlist')
@@ -689,14 +759,11 @@ def remove_from_playlist(playlist_id, video_id):
     pv = PlaylistVideo.query.filter_by(playlist_id=playlist_id, video_id=video_id).first()
     if pv:
         db.session.delete(pv)
-        db.session.commit()
+        version = bump_playlist_version(playlist_id, video_id, added=False)
         
         # Check if saved in any other playlist
-        user_playlists = Playlist.query.filter_by(user_id=current_user.id).all()
-        is_saved_in_any = False
-        if user_playlists:
-            p_ids = [p.id for p in user_playlists]
-            is_saved_in_any = PlaylistVideo.query.filter(PlaylistVideo.playlist_id.in_(p_ids), PlaylistVideo.video_id == video_id).first() is not None
+        saved = cache.playlist_map(db.session, current_user.id, version)
+        is_saved_in_any = bool(saved.get(video_id))
             
         if is_ajax(request):
             return jsonify({'success': True, 'is_saved_in_any': is_saved_in_any})
@@ -707,10 +774,12 @@ def remove_from_playlist(playlist_id, video_id):
 
 @main_bp.route('/watch-later')
 @login_required
+@replica_reads
 def watch_later():
-    wl_items = WatchLater.query.filter_by(user_id=current_user.id).order_by(WatchLater.added_at.desc()).all()
-    videos = [item.video for item in wl_items]
-    return render_template('watch_later.html', title='Watch Later', videos=videos)
+    wl_items, next_cursor = watch_later_page(current_user.id, request.args.get('before'),
+                                             page_size(request.args.get('limit'), PLAYLIST_PAGE_SIZE))
+    videos = [item.video for item in wl_items if item.video]
+    return render_template('watch_later.html', title='Watch Later', videos=videos, next_cursor=next_cursor)
 
 
 @main_bp.route('/watch-later/add/<int:video_id>', methods=['POST'])
@@ -748,20 +817,26 @@ def remove_from_watch_later(video_id):
     return redirect(url_for('main.watch_later'))
 
 
+def search_videos(clean_query):
+    return Video.query.filter(Video.title.contains(clean_query) | Video.description.contains(clean_query)).filter_by(is_public=True)
+
+
 @main_bp.route('/search')
+@replica_reads
 def search():
     import voice
     query = request.args.get('q', '')
     if query:
         # Process natural language/voice commands
         clean_query = voice.process_command(query)
-        videos = Video.query.filter(Video.title.contains(clean_query) | Video.description.contains(clean_query)).filter_by(is_public=True).all()
+        videos = search_videos(clean_query).all()
     else:
         videos = []
     return render_template('search.html', title='Search', videos=videos, query=query)
 
 
 @main_bp.route('/search/suggestions')
+@replica_reads
 def search_suggestions():
     query = request.args.get('q', '').strip()
     suggestions = []
@@ -874,6 +949,7 @@ def voice_search_api():
         return jsonify({'error': 'Audio conversion failed'}), 500
     except Exception as e:
         print(f"Voice search error: {e}")
+        metrics.error('voice_search', e)
         import traceback
         traceback.print_exc()
         return jsonify({'error': 'Voice processing failed'}), 500